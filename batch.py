@@ -0,0 +1,176 @@
+import sys
+import os
+import math
+import time
+import fnmatch
+import argparse
+import multiprocessing
+
+from trajectory import Trajectory
+from trajectory_io import BINARY_SUFFIX
+
+
+# 无界面的批处理命令行工具，在进程池中对目录下的每个轨迹文件执行同一操作
+# 例: python batch.py transform paths/ out/ --rotate 90 --origin 10 5 --translate 1 0
+
+
+def list_trajectory_files(input_dir, pattern):
+    return sorted(name for name in os.listdir(input_dir) if fnmatch.fnmatch(name, pattern))
+
+
+def apply_operation(trajectory, options):
+    # 返回 [(输出文件名后缀, 轨迹)]
+    operation = options['operation']
+    if operation == 'transform':
+        cx, cy = options['origin']
+        if options['scale'] is not None:
+            trajectory.scale(options['scale'], cx, cy)
+        if options['rotate'] is not None:
+            trajectory.rotate(math.radians(options['rotate']), cx, cy)
+        if options['translate'] is not None:
+            trajectory.translate(*options['translate'])
+        return [('', trajectory)]
+    if operation == 'decimate':
+        return [('', trajectory.decimate(options['step']))]
+    if operation == 'clip':
+        return [('', trajectory.clip(*options['box']))]
+    if operation == 'simplify':
+        return [('', trajectory.simplify(options['tolerance']))]
+    if operation == 'dedupe':
+        return [('', trajectory.remove_duplicates(options['tolerance']))]
+    if operation == 'resample':
+        return [('', trajectory.resample(options['spacing']))]
+    if operation == 'convert':
+        return [('', trajectory)]  # 格式由输出文件的扩展名决定
+    if operation == 'split':
+        parts = trajectory.split(options['max_poses'])
+        return [(f"_{index:03d}", part) for index, part in enumerate(parts)]
+    raise ValueError(f"unknown operation: {operation}")
+
+
+def process_file(task):
+    # 在工作进程中运行: 返回 (文件名, 输入位姿数, 输出位姿数, 耗时, 错误信息)
+    input_path, output_dir, options = task
+    file_name = os.path.basename(input_path)
+    start_time = time.perf_counter()
+    count_in = count_out = 0
+    try:
+        trajectory = Trajectory.load(input_path, options['use_cache'])
+        count_in = len(trajectory)
+        stem, extension = os.path.splitext(file_name)
+        extension = operation_format(options) or extension
+        for suffix, result in apply_operation(trajectory, options):
+            result.save(os.path.join(output_dir, stem + suffix + extension))
+            count_out += len(result)
+    except Exception as error:
+        return file_name, count_in, count_out, time.perf_counter() - start_time, str(error)
+    return file_name, count_in, count_out, time.perf_counter() - start_time, None
+
+
+def operation_format(options):
+    # convert 的输出扩展名，其他操作保持输入格式 (返回 None)
+    if options['operation'] != 'convert':
+        return None
+    return BINARY_SUFFIX if options['to'] == 'binary' else '.yaml'
+
+
+def load_file(task):
+    input_path, use_cache = task
+    return Trajectory.load(input_path, use_cache)
+
+
+def report(file_name, count_in, count_out, elapsed, error=None):
+    if error:
+        print(f"文件名={file_name} 失败: {error}")
+        return
+    rate = count_in / elapsed if elapsed > 0 else 0.0
+    print(f"文件名={file_name} 轨迹长度={count_in}->{count_out} 耗时={elapsed:.3f}s 吞吐={rate:.0f} 位姿/s")
+
+
+def run_merge(args, file_names, pool):
+    start_time = time.perf_counter()
+    tasks = [(os.path.join(args.input_dir, file_name), not args.no_cache) for file_name in file_names]
+    trajectories = pool.map(load_file, tasks)
+    merged = Trajectory.merge(trajectories)
+    merged.save(args.output)
+    count_in = sum(len(trajectory) for trajectory in trajectories)
+    report(os.path.basename(args.output), count_in, len(merged), time.perf_counter() - start_time)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="轨迹文件批处理 (无需图形界面)")
+    subparsers = parser.add_subparsers(dest='operation', required=True)
+
+    def add_operation(name, help_text, output_help="输出目录"):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument('input_dir', help="输入目录")
+        subparser.add_argument('output', help=output_help)
+        subparser.add_argument('--pattern', default='*.yaml', help="文件名匹配模式 (默认 *.yaml)")
+        subparser.add_argument('--workers', type=int, default=None, help="工作进程数 (默认 CPU 核数)")
+        subparser.add_argument('--no-cache', action='store_true', help="不使用解析缓存")
+        return subparser
+
+    transform = add_operation('transform', "平移/旋转/缩放 (依次执行缩放、旋转、平移)")
+    transform.add_argument('--translate', type=float, nargs=2, metavar=('DX', 'DY'))
+    transform.add_argument('--rotate', type=float, metavar='DEG', help="逆时针旋转角度 (度)")
+    transform.add_argument('--scale', type=float, metavar='FACTOR')
+    transform.add_argument('--origin', type=float, nargs=2, metavar=('X', 'Y'), default=(0.0, 0.0),
+                           help="旋转和缩放的中心 (默认原点)")
+
+    decimate = add_operation('decimate', "每 N 个位姿保留一个")
+    decimate.add_argument('--step', type=int, required=True)
+
+    clip = add_operation('clip', "只保留矩形范围内的位姿")
+    clip.add_argument('--box', type=float, nargs=4, required=True, metavar=('XMIN', 'YMIN', 'XMAX', 'YMAX'))
+
+    simplify = add_operation('simplify', "Douglas-Peucker 简化")
+    simplify.add_argument('--tolerance', type=float, required=True, help="允许的最大偏差 (米)")
+
+    dedupe = add_operation('dedupe', "去除重复位姿")
+    dedupe.add_argument('--tolerance', type=float, default=0.0, help="视为重复的距离 (米，默认只去除完全重合的)")
+
+    resample = add_operation('resample', "按固定间距重采样")
+    resample.add_argument('--spacing', type=float, required=True, help="间距 (米)")
+
+    split = add_operation('split', "按最大位姿数拆分为多个文件")
+    split.add_argument('--max-poses', type=int, required=True)
+
+    convert = add_operation('convert', f"在 YAML 与二进制格式 ({BINARY_SUFFIX}，内存映射打开) 之间无损转换")
+    convert.add_argument('--to', choices=('binary', 'yaml'), required=True,
+                         help=f"输出格式 (转回 YAML 时用 --pattern '*{BINARY_SUFFIX}')")
+
+    add_operation('merge', "按文件名顺序合并为一个文件", output_help="输出文件")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    file_names = list_trajectory_files(args.input_dir, args.pattern)
+    if not file_names:
+        print(f"{args.input_dir} 中没有匹配 {args.pattern} 的文件")
+        return 1
+
+    with multiprocessing.Pool(args.workers) as pool:
+        if args.operation == 'merge':
+            return run_merge(args, file_names, pool)
+
+        os.makedirs(args.output, exist_ok=True)
+        options = dict(vars(args), use_cache=not args.no_cache)
+        tasks = [(os.path.join(args.input_dir, file_name), args.output, options) for file_name in file_names]
+
+        start_time = time.perf_counter()
+        total_poses = failures = 0
+        for file_name, count_in, count_out, elapsed, error in pool.imap_unordered(process_file, tasks):
+            report(file_name, count_in, count_out, elapsed, error)
+            total_poses += count_in
+            failures += error is not None
+
+    elapsed = time.perf_counter() - start_time
+    rate = total_poses / elapsed if elapsed > 0 else 0.0
+    print(f"共 {len(file_names)} 个文件 失败 {failures} 个 位姿 {total_poses} 耗时={elapsed:.3f}s 吞吐={rate:.0f} 位姿/s")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
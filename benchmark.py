@@ -0,0 +1,281 @@
+import sys
+import os
+import math
+import json
+import time
+import shutil
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+
+# 性能基准: 生成 1k~5M 位姿的合成轨迹文件，在无界面 (offscreen) 的 Qt 平台上驱动 MapEditor，
+# 测量加载、首帧、各缩放级别的绘制、拖动和保存耗时以及峰值内存，结果输出为 JSON 便于比较不同版本。
+# 每个规模在独立的子进程中运行，峰值内存互不影响。
+# 例: python benchmark.py --sizes 1000 100000 --output result.json
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000, 5000000]
+ZOOM_LEVELS = [1, 10, 100]  # 相对于显示整条轨迹的缩放倍数
+PAINT_FRAMES = 5
+PAN_FRAMES = 30
+DRAG_MOVES = 20
+POSE_SPACING = 0.05  # 合成轨迹相邻位姿的间距 (米)
+
+
+def synthetic_points(count, seed=0):
+    # 步长固定、方向缓慢随机变化的轨迹，随机种子固定保证结果可复现
+    rng = np.random.default_rng(seed)
+    headings = np.cumsum(rng.normal(0.0, 0.05, count))
+    steps = np.column_stack((np.cos(headings), np.sin(headings))) * POSE_SPACING
+    points = np.cumsum(steps, axis=0)
+    return points - points.mean(axis=0), headings
+
+
+def write_poses_file(file_path, count, seed=0, chunk_size=100000):
+    # 直接按 yaml.dump 的块格式输出文本，生成百万级位姿时比构造字典再 dump 快得多
+    points, headings = synthetic_points(count, seed)
+    with open(file_path, 'w') as file:
+        file.write("header:\n  frame_id: map\nposes:\n")
+        for start in range(0, count, chunk_size):
+            stop = min(start + chunk_size, count)
+            lines = []
+            for (x, y), heading in zip(points[start:stop].tolist(), headings[start:stop].tolist()):
+                lines.append(f"- orientation:\n    w: {math.cos(heading / 2)!r}\n    x: 0.0\n    y: 0.0\n"
+                             f"    z: {math.sin(heading / 2)!r}\n  position:\n    x: {x!r}\n    y: {y!r}\n    z: 0.0\n")
+            file.write(''.join(lines))
+
+
+def peak_rss_bytes():
+    # 本进程和已结束的子进程 (加载/保存进程池) 中较大的峰值常驻内存，Linux 上 ru_maxrss 单位为 KB
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {'self': own * scale, 'children': children * scale}
+
+
+def wait_until(app, condition, timeout=3600.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("benchmark step timed out")
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def run_one(file_path, count):
+    # 在当前进程中运行一个规模的全部测量，返回结果字典
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import Qt, QEvent, QPointF
+    from PyQt5.QtGui import QMouseEvent
+    import main
+    from instrumentation import profiler
+
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    editor = main.MapEditor()
+    editor.resize(1200, 800)
+    editor.show()
+    app.processEvents()
+    view = editor.graphics_view
+    file_name = os.path.basename(file_path)
+    editor.root_dir = os.path.dirname(file_path)
+    result = {'poses': count, 'file_bytes': os.path.getsize(file_path)}
+
+    def load(prefix):
+        # 从开始加载到图层可编辑的耗时，以及到第一帧 (首块预览) 绘制完成的耗时
+        start_time = time.perf_counter()
+        editor.start_loading([file_name])
+        first_frame = None
+        while file_name not in editor.trajectory_layers:
+            stream = editor.streaming_loads.get(file_name)
+            if first_frame is None and stream is not None and stream['items']:
+                view.viewport().grab()
+                first_frame = time.perf_counter() - start_time
+            if stream is None and file_name not in editor.pending_loads:
+                raise RuntimeError(editor.log_lines[-1])
+            app.processEvents()
+            time.sleep(0.001)
+        result[prefix + '_seconds'] = time.perf_counter() - start_time
+        if first_frame is None:
+            # 只有一块 (小文件或命中缓存) 时没有预览阶段，首帧即完整图层的第一帧
+            view.viewport().grab()
+            first_frame = time.perf_counter() - start_time
+        result[prefix + '_first_frame_seconds'] = first_frame
+
+    def unload():
+        editor.layer_list_widget.setCurrentRow(0)
+        editor.unload_selected_layer()
+
+    load('load_cold')  # 无缓存，完整解析 YAML
+    unload()
+    load('load_cached')
+    layer = editor.trajectory_layers[file_name]
+
+    # 各缩放级别下每帧的绘制耗时 (整个视口，包括网格)
+    bounds = layer.boundingRect()
+    view.fitInView(bounds, Qt.KeepAspectRatio)
+    fit_scale = view.transform().m11()
+    paint = {}
+    for zoom in ZOOM_LEVELS:
+        view.resetTransform()
+        view.scale(fit_scale * zoom, fit_scale * zoom)
+        view.centerOn(bounds.center())
+        frame_times = []  # 第一帧会建立绘制缓存，单独记录
+        for _ in range(PAINT_FRAMES + 1):
+            start_time = time.perf_counter()
+            view.viewport().grab()
+            frame_times.append(time.perf_counter() - start_time)
+        paint[str(zoom)] = {'first_ms': frame_times[0] * 1000,
+                            'mean_ms': float(np.mean(frame_times[1:])) * 1000,
+                            'max_ms': float(np.max(frame_times[1:])) * 1000}
+    result['paint'] = paint
+
+    # 平移: 交互中的连续帧 (自适应草图画质) 达到的帧率，以及停止后恢复完整画质的一帧
+    view.resetTransform()
+    view.scale(fit_scale * 10, fit_scale * 10)
+    view.centerOn(bounds.center())
+    scroll_bar = view.horizontalScrollBar()
+    start_time = time.perf_counter()
+    for _ in range(PAN_FRAMES):
+        view.begin_interaction()
+        scroll_bar.setValue(scroll_bar.value() + 20)
+        view.viewport().grab()
+    pan_seconds = time.perf_counter() - start_time
+    max_level = view.interaction_max_level
+    view.end_interaction()
+    start_time = time.perf_counter()
+    view.viewport().grab()
+    result['pan'] = {'fps': PAN_FRAMES / pan_seconds, 'max_draft_level': max_level,
+                     'settle_frame_ms': (time.perf_counter() - start_time) * 1000}
+
+    # 拖动: 选中轨迹中间约 1% 的位姿 (至少 1 个，最多 10000 个)，按下其中一个拖动后松开
+    view.resetTransform()
+    view.scale(100, 100)
+    center = count // 2
+    half = max(min(count // 200, 5000), 1)
+    selection = slice(max(center - half, 0), center + half)
+    layer.selected[selection] = True
+    anchor = layer.points[center]
+    view.centerOn(QPointF(*anchor))
+    app.processEvents()
+    viewport = view.viewport()
+    press_pos = QPointF(view.mapFromScene(QPointF(*anchor)))
+
+    def send(event_type, pos, button, buttons):
+        event = QMouseEvent(event_type, pos, button, buttons, Qt.NoModifier)
+        start_time = time.perf_counter()
+        QApplication.sendEvent(viewport, event)
+        viewport.repaint()
+        return time.perf_counter() - start_time
+
+    press_time = send(QEvent.MouseButtonPress, press_pos, Qt.LeftButton, Qt.LeftButton)
+    move_times = [send(QEvent.MouseMove, press_pos + QPointF(step, step), Qt.NoButton, Qt.LeftButton)
+                  for step in range(1, DRAG_MOVES + 1)]
+    release_pos = press_pos + QPointF(DRAG_MOVES, DRAG_MOVES)
+    release_time = send(QEvent.MouseButtonRelease, release_pos, Qt.LeftButton, Qt.NoButton)
+    result['drag'] = {'selected_poses': int(layer.selected_indices().size),
+                      'moved': bool(editor.trajectories[file_name].is_dirty),
+                      'press_ms': press_time * 1000,
+                      'move_mean_ms': float(np.mean(move_times)) * 1000,
+                      'move_max_ms': float(np.max(move_times)) * 1000,
+                      'release_ms': release_time * 1000,
+                      'total_ms': (press_time + sum(move_times) + release_time) * 1000}
+
+    # 保存: 从点击保存到后台写完
+    start_time = time.perf_counter()
+    editor.save_yaml_files()
+    wait_until(app, lambda: not editor.pending_saves)
+    result['save_seconds'] = time.perf_counter() - start_time
+
+    editor.close()
+    app.processEvents()
+    result['peak_rss_bytes'] = peak_rss_bytes()
+    result['profile'] = profiler.summary()  # 编辑器内置计时的汇总
+    return result
+
+
+def run_size(count, work_dir, seed):
+    # 生成文件后在子进程中测量
+    file_path = os.path.join(work_dir, f"poses_{count}.yaml")
+    start_time = time.perf_counter()
+    write_poses_file(file_path, count, seed)
+    generate_seconds = time.perf_counter() - start_time
+
+    environment = dict(os.environ, QT_QPA_PLATFORM='offscreen',
+                       XDG_CACHE_HOME=os.path.join(work_dir, 'cache'))  # 独立的解析缓存，保证首次加载不命中
+    command = [sys.executable, os.path.abspath(__file__), '--run-one', file_path, str(count)]
+    completed = subprocess.run(command, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        return {'poses': count, 'error': completed.stderr.strip().splitlines()[-1:]}
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['generate_seconds'] = generate_seconds
+    return result
+
+
+def environment_info():
+    info = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+    }
+    try:
+        from PyQt5.QtCore import QT_VERSION_STR, PYQT_VERSION_STR
+        info['qt'] = QT_VERSION_STR
+        info['pyqt'] = PYQT_VERSION_STR
+    except ImportError:
+        pass
+    try:
+        info['git_revision'] = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                              text=True).stdout.strip() or None
+    except OSError:
+        info['git_revision'] = None
+    return info
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="地图编辑器性能基准 (无界面运行)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="位姿数 (默认 1k~5M)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON 结果文件 (默认输出到标准输出)")
+    parser.add_argument('--work-dir', help="生成文件的目录 (默认临时目录，结束后删除)")
+    parser.add_argument('--run-one', nargs=2, metavar=('FILE', 'COUNT'), help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.run_one:
+        file_path, count = args.run_one
+        print(json.dumps(run_one(file_path, int(count))))
+        return 0
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='mapeditor-benchmark-')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = []
+        for count in args.sizes:
+            print(f"位姿数={count} ...", file=sys.stderr)
+            results.append(run_size(count, work_dir, args.seed))
+            print(json.dumps(results[-1]), file=sys.stderr)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'environment': environment_info(), 'seed': args.seed, 'results': results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
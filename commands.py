@@ -0,0 +1,242 @@
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+# 撤销/重做命令 (不依赖 Qt)
+# 命令只记录文件名、位姿索引和位移等紧凑数据，不持有图形项；
+# 执行时调用 target (编辑器) 的 move_poses / transform_poses / set_poses_alive / replace_trajectory。
+
+COMMAND_OVERHEAD = 128  # 每条命令对象本身的大致字节数
+
+
+def compact_indices(indices):
+    indices = np.asarray(indices)
+    if len(indices) and indices.max() < np.iinfo(np.int32).max:
+        return indices.astype(np.int32)
+    return indices.astype(np.int64)
+
+
+class MoveCommand:
+    # 位姿平移 delta: 所有位姿共用的 (dx, dy)，或逐个位姿的 (n, 2) 位移
+    def __init__(self, file_name, indices, delta):
+        self.file_name = file_name
+        self.indices = compact_indices(indices)
+        self.delta = np.asarray(delta, dtype=np.float64)
+
+    def undo(self, target):
+        target.move_poses(self.file_name, self.indices, -self.delta)
+
+    def redo(self, target):
+        target.move_poses(self.file_name, self.indices, self.delta)
+
+    def nbytes(self):
+        return COMMAND_OVERHEAD + self.indices.nbytes + self.delta.nbytes
+
+    def description(self):
+        return f"移动 {len(self.indices)} 个位姿"
+
+
+class TransformCommand:
+    # 位姿的相似变换 p' = matrix @ p + offset (旋转、镜像、缩放)，撤销时应用逆变换，只保存 2x3 个系数
+    def __init__(self, file_name, indices, matrix, offset):
+        self.file_name = file_name
+        self.indices = compact_indices(indices)
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.offset = np.asarray(offset, dtype=np.float64)
+
+    def undo(self, target):
+        inverse = np.linalg.inv(self.matrix)
+        target.transform_poses(self.file_name, self.indices, inverse, -inverse @ self.offset)
+
+    def redo(self, target):
+        target.transform_poses(self.file_name, self.indices, self.matrix, self.offset)
+
+    def nbytes(self):
+        return COMMAND_OVERHEAD + self.indices.nbytes + self.matrix.nbytes + self.offset.nbytes
+
+    def description(self):
+        return f"变换 {len(self.indices)} 个位姿"
+
+
+class DeleteCommand:
+    def __init__(self, file_name, indices):
+        self.file_name = file_name
+        self.indices = compact_indices(indices)
+
+    def undo(self, target):
+        target.set_poses_alive(self.file_name, self.indices, True)
+
+    def redo(self, target):
+        target.set_poses_alive(self.file_name, self.indices, False)
+
+    def nbytes(self):
+        return COMMAND_OVERHEAD + self.indices.nbytes
+
+    def description(self):
+        return f"删除 {len(self.indices)} 个位姿"
+
+
+class ReplaceCommand:
+    # 整条轨迹替换 (位姿数变化的操作)，需要保存前后两份轨迹
+    def __init__(self, file_name, old_trajectory, old_alive, new_trajectory, new_alive):
+        self.file_name = file_name
+        self.old_state = (old_trajectory, old_alive.copy())
+        self.new_state = (new_trajectory, new_alive.copy())
+
+    def undo(self, target):
+        target.replace_trajectory(self.file_name, *self.old_state)
+
+    def redo(self, target):
+        target.replace_trajectory(self.file_name, *self.new_state)
+
+    def nbytes(self):
+        return COMMAND_OVERHEAD + sum(trajectory.nbytes() + alive.nbytes
+                                      for trajectory, alive in (self.old_state, self.new_state))
+
+    def description(self):
+        return f"替换轨迹 {self.file_name}"
+
+
+class CommandGroup:
+    # 一次操作 (如多选拖动、批量删除) 产生的多条命令，作为一步撤销
+    def __init__(self, commands, description=None):
+        self.commands = list(commands)
+        self.group_description = description
+
+    def undo(self, target):
+        for command in reversed(self.commands):
+            command.undo(target)
+
+    def redo(self, target):
+        for command in self.commands:
+            command.redo(target)
+
+    def nbytes(self):
+        return COMMAND_OVERHEAD + sum(command.nbytes() for command in self.commands)
+
+    def description(self):
+        if self.group_description:
+            return self.group_description
+        return "，".join(command.description() for command in self.commands)
+
+    def file_names(self):
+        return {command.file_name for command in self.commands}
+
+
+class CommandStack:
+    # 撤销/重做栈，超过 max_depth 条或 max_bytes 字节 (撤销和重做记录合计) 时丢弃记录:
+    # 先丢弃离当前状态最远的重做记录 (下一次 push 时本来就会清空)，再丢弃最早的撤销记录
+    def __init__(self, max_depth=1000, max_bytes=256 * 1024 * 1024):
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.undo_commands = deque()
+        self.redo_commands = deque()
+        self.undo_bytes = 0
+        self.redo_bytes = 0
+        self.open_groups = []
+        self.listener = None  # listener(command, undo): 每条命令执行、撤销或重做后调用 (如写入编辑日志)
+
+    @property
+    def total_bytes(self):
+        return self.undo_bytes + self.redo_bytes
+
+    def notify(self, command, undo=False):
+        if self.listener is not None:
+            self.listener(command, undo)
+
+    def push(self, command):
+        # 记录一条已执行的命令
+        self.notify(command)
+        self.store(command)
+
+    def store(self, command):
+        if self.open_groups:
+            self.open_groups[-1].append(command)
+            return
+        self.undo_commands.append(command)
+        self.undo_bytes += command.nbytes()
+        self.redo_commands.clear()
+        self.redo_bytes = 0
+        self.enforce_limits()
+
+    @contextmanager
+    def group(self, description=None):
+        # with stack.group(): 期间 push 的命令合并为一步
+        self.open_groups.append([])
+        try:
+            yield
+        finally:
+            commands = self.open_groups.pop()
+            if commands:
+                self.store(commands[0] if len(commands) == 1 and description is None
+                           else CommandGroup(commands, description))
+
+    def enforce_limits(self):
+        while self.redo_commands and self.total_bytes > self.max_bytes:
+            self.redo_bytes -= self.redo_commands.popleft().nbytes()
+        while self.undo_commands and (len(self.undo_commands) > self.max_depth
+                                      or self.total_bytes > self.max_bytes):
+            self.undo_bytes -= self.undo_commands.popleft().nbytes()
+
+    def set_limits(self, max_depth=None, max_bytes=None):
+        if max_depth is not None:
+            self.max_depth = max_depth
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self.enforce_limits()
+
+    def can_undo(self):
+        return bool(self.undo_commands)
+
+    def can_redo(self):
+        return bool(self.redo_commands)
+
+    def undo(self, target):
+        if not self.undo_commands:
+            return None
+        command = self.undo_commands.pop()
+        command.undo(target)
+        self.notify(command, undo=True)
+        size = command.nbytes()
+        self.undo_bytes -= size
+        self.redo_bytes += size
+        self.redo_commands.append(command)
+        return command
+
+    def redo(self, target):
+        if not self.redo_commands:
+            return None
+        command = self.redo_commands.pop()
+        command.redo(target)
+        self.notify(command)
+        size = command.nbytes()
+        self.redo_bytes -= size
+        self.undo_bytes += size
+        self.undo_commands.append(command)
+        return command
+
+    def discard_file(self, file_name):
+        # 文件卸载后丢弃与它有关的命令
+        def keep(commands):
+            kept = deque()
+            for command in commands:
+                if isinstance(command, CommandGroup):
+                    command.commands = [sub for sub in command.commands if sub.file_name != file_name]
+                    if command.commands:
+                        kept.append(command)
+                elif command.file_name != file_name:
+                    kept.append(command)
+            return kept
+
+        self.undo_commands = keep(self.undo_commands)
+        self.redo_commands = keep(self.redo_commands)
+        self.undo_bytes = sum(command.nbytes() for command in self.undo_commands)
+        self.redo_bytes = sum(command.nbytes() for command in self.redo_commands)
+
+    def clear(self):
+        self.undo_commands.clear()
+        self.redo_commands.clear()
+        self.undo_bytes = 0
+        self.redo_bytes = 0
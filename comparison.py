@@ -0,0 +1,105 @@
+import time
+from functools import partial
+
+import numpy as np
+
+from spatial_index import GridIndex
+
+# 轨迹比较 (不依赖 Qt): 候选轨迹每个位姿到参考轨迹 (折线) 的最近距离、统计量和超出容差的区段
+
+DEVIATION_BINS = 8  # 着色的分级数: 前一半在容差内，后一半超出容差 (最高到两倍容差)
+
+
+class ReferenceIndex:
+    # 参考折线的线段索引: 每条线段按不超过 step 的间距取采样点 (含起点)，网格索引中存采样点，
+    # 查询时计算到采样点所在线段的距离。线段上任一处与最近的采样点相距不超过 step / 2，
+    # nearest_many 按此扩大搜索范围，结果是到折线的精确距离 (稀疏的规划路径也不会因只看最近顶点而高估)
+    def __init__(self, reference):
+        steps = np.hypot(*np.diff(reference, axis=0).T)
+        # 采样间距取相邻位姿间距的中位数，个别很长的线段不会产生过多采样点 (总数不超过约 5 倍位姿数)
+        step = max(float(np.median(steps)), float(steps.sum()) / (4 * len(steps))) if len(steps) else 0.0
+        if step > 0:
+            pieces = np.maximum(np.ceil(steps / step).astype(np.int64), 1)
+            segments = np.repeat(np.arange(len(steps)), pieces)
+            t = (np.arange(len(segments)) - np.repeat(np.cumsum(pieces) - pieces, pieces)) / np.repeat(pieces, pieces)
+            starts = reference[segments]
+            directions = reference[segments + 1] - starts
+            samples = starts + directions * t[:, None]
+            self.slack = float((steps / pieces).max()) / 2
+            # 每个采样点所在线段的起点、方向和 1 / 长度平方，按列存放，查询时只需按采样点序号取出
+            self.start_x, self.start_y = starts.T.copy()
+            self.direction_x, self.direction_y = directions.T.copy()
+            length_sq = self.direction_x ** 2 + self.direction_y ** 2
+            self.inverse_length_sq = np.divide(1.0, length_sq, out=np.zeros(len(segments)), where=length_sq > 0)
+        else:
+            # 单个位姿或所有位姿重合: 到折线的距离就是到顶点的距离
+            samples = reference
+            self.slack = None
+        # 比较时的查询点都在轨迹附近，格子取得比编辑用的索引更小，候选点更少
+        self.grid = GridIndex(samples, points_per_cell=4)
+
+    def segment_distance_sq(self, candidate, owners, samples):
+        px = candidate[owners, 0] - self.start_x[samples]
+        py = candidate[owners, 1] - self.start_y[samples]
+        dx, dy = self.direction_x[samples], self.direction_y[samples]
+        t = np.clip((px * dx + py * dy) * self.inverse_length_sq[samples], 0.0, 1.0)
+        px -= t * dx
+        py -= t * dy
+        return px * px + py * py
+
+    def distances(self, candidate):
+        if self.slack is None:
+            return self.grid.nearest_many(candidate)[1]
+        return self.grid.nearest_many(candidate, distance=partial(self.segment_distance_sq, candidate),
+                                      slack=self.slack)[1]
+
+
+def build_reference_index(reference):
+    return ReferenceIndex(np.asarray(reference, dtype=np.float64).reshape(-1, 2))
+
+
+def path_deviations(reference, candidate, index=None):
+    # 候选位姿到参考折线 (各线段) 的最近距离
+    reference = np.asarray(reference, dtype=np.float64).reshape(-1, 2)
+    candidate = np.asarray(candidate, dtype=np.float64).reshape(-1, 2)
+    if not len(reference):
+        return np.full(len(candidate), np.inf)
+    if index is None:
+        index = build_reference_index(reference)
+    return index.distances(candidate)
+
+
+def compare_trajectories_timed(reference, candidate):
+    # 在后台进程中执行: 返回 (距离数组, 耗时)
+    start_time = time.perf_counter()
+    distances = path_deviations(reference, candidate)
+    return distances, time.perf_counter() - start_time
+
+
+def deviation_stats(distances):
+    if not len(distances):
+        return {'count': 0, 'max': 0.0, 'mean': 0.0, 'p95': 0.0}
+    return {'count': len(distances),
+            'max': float(distances.max()),
+            'mean': float(distances.mean()),
+            'p95': float(np.percentile(distances, 95))}
+
+
+def out_of_tolerance_segments(distances, tolerance):
+    # 连续超出容差的区段 [(起始位置, 结束位置 (含), 最大偏差)]，位置为 distances 中的下标
+    over = np.concatenate(([False], distances > tolerance, [False]))
+    edges = np.diff(over.astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)  # 不含
+    if not len(starts):
+        return []
+    padded = np.append(distances, 0.0)  # ends 可能等于 len(distances)
+    maxima = np.maximum.reduceat(padded, np.column_stack((starts, ends)).ravel())[::2]
+    return list(zip(starts.tolist(), (ends - 1).tolist(), maxima.tolist()))
+
+
+def deviation_bins(distances, tolerance):
+    # 着色分级 (uint8): 0..BINS/2-1 在容差内，BINS/2..BINS-1 超出容差
+    half = DEVIATION_BINS // 2
+    scaled = np.nan_to_num(distances / tolerance * half, nan=0.0, posinf=DEVIATION_BINS)
+    return np.clip(scaled, 0, DEVIATION_BINS - 1).astype(np.uint8)
@@ -0,0 +1,386 @@
+import os
+import time
+import shutil
+import struct
+import zlib
+import numpy as np
+
+from trajectory import Trajectory
+from trajectory_io import BINARY_SUFFIX
+from commands import MoveCommand, TransformCommand, DeleteCommand, ReplaceCommand, CommandGroup
+
+try:
+    import fcntl
+except ImportError:  # Windows: 不加锁，其他进程的会话一律视为已结束
+    fcntl = None
+
+# 编辑日志 (不依赖 Qt): 每次编辑 (移动、删除、变换、替换) 以紧凑的二进制记录追加到本次会话的日志文件，
+# 分批 fsync；程序异常退出后可以在原文件上重放日志恢复未保存的修改，只有保存时才重写轨迹文件。
+#
+# 每个文件以一条 BASE 记录开始: 编辑器中的文件名、原文件的大小/修改时间和内存中的位姿数。保存只写入未删除的位姿，
+# 内存中仍有已删除的位姿时另外记录删除掩码，并把已删除的位姿存为会话目录中的二进制快照，
+# 之后记录中的位姿索引因此始终与内存中一致。BASE 的 since 为起点已包含的最后一条记录的序号，
+# 重放时只执行序号更大的记录。保存完成后为该文件重新写一条 BASE，其 since 为提交保存前的最后一条记录，
+# 保存期间的编辑重放时仍然有效。
+
+JOURNAL_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'mapeditor', 'journal'
+)
+JOURNAL_MAGIC = b'MEJRNL2\n'  # 版本 2: BASE 记录中加入文件名
+JOURNAL_FILE = 'journal.log'
+LOCK_FILE = 'lock'
+SYNC_BYTES = 1024 * 1024  # 未同步的数据超过这么多字节时立即 fsync
+
+FRAME = struct.Struct('<II')  # 载荷长度, CRC32
+RECORD = struct.Struct('<BI')  # 类型, 文件编号
+BASE_FIELDS = struct.Struct('<QqqQ')  # since (起点已包含的最后一条记录), 原文件大小, 修改时间 (纳秒), 内存中的位姿数
+ARRAY = struct.Struct('<cBQ')  # 类型 (i/f), 元素字节数, 元素个数
+FLAG = struct.Struct('<B')
+
+BASE, MOVE, TRANSFORM, ALIVE, REPLACE, CLOSE = range(1, 7)
+
+
+class JournalError(Exception):
+    pass
+
+
+def pack_string(text):
+    data = text.encode('utf-8')
+    return struct.pack('<H', len(data)) + data
+
+
+def pack_array(array):
+    array = np.ascontiguousarray(array)
+    array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+    return ARRAY.pack(array.dtype.kind.encode(), array.dtype.itemsize, array.size) + array.tobytes()
+
+
+def pack_mask(mask):
+    # 空掩码表示没有已删除的位姿
+    return struct.pack('<Q', len(mask)) + np.packbits(mask).tobytes()
+
+
+class RecordReader:
+    def __init__(self, payload):
+        self.payload = payload
+        self.offset = RECORD.size
+
+    def unpack(self, layout):
+        values = layout.unpack_from(self.payload, self.offset)
+        self.offset += layout.size
+        return values
+
+    def string(self):
+        length, = struct.unpack_from('<H', self.payload, self.offset)
+        self.offset += 2 + length
+        return bytes(self.payload[self.offset - length:self.offset]).decode('utf-8')
+
+    def array(self):
+        kind, itemsize, count = self.unpack(ARRAY)
+        array = np.frombuffer(self.payload, np.dtype(f'<{kind.decode()}{itemsize}'), count, self.offset)
+        self.offset += count * itemsize
+        return array
+
+    def mask(self):
+        count, = struct.unpack_from('<Q', self.payload, self.offset)
+        size = (count + 7) // 8
+        bits = np.frombuffer(self.payload, np.uint8, size, self.offset + 8)
+        self.offset += 8 + size
+        return np.unpackbits(bits, count=count).astype(bool)
+
+
+def read_records(journal_path):
+    # 返回 ([(类型, 文件编号, RecordReader)], 有效数据的字节数)；
+    # 末尾写了一半或校验失败的记录 (写入时崩溃) 及其后的内容被忽略
+    with open(journal_path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(JOURNAL_MAGIC):
+        raise JournalError("not an edit journal")
+    records = []
+    offset = len(JOURNAL_MAGIC)
+    while offset + FRAME.size <= len(data):
+        length, checksum = FRAME.unpack_from(data, offset)
+        payload = memoryview(data)[offset + FRAME.size:offset + FRAME.size + length]
+        if len(payload) != length or length < RECORD.size or zlib.crc32(payload) != checksum:
+            break
+        record_type, file_id = RECORD.unpack_from(payload)
+        records.append((record_type, file_id, RecordReader(payload)))
+        offset += FRAME.size + length
+    return records, offset
+
+
+def parse_base(reader):
+    since, size, mtime, count = reader.unpack(BASE_FIELDS)
+    path = reader.string()
+    name = reader.string()
+    deleted = reader.mask()
+    snapshot = reader.string()
+    return {'since': since, 'size': size, 'mtime': mtime, 'count': count, 'path': path, 'name': name,
+            'deleted': deleted, 'snapshot': snapshot}
+
+
+def load_base(session_dir, base):
+    # 原文件 + 已删除位姿的快照 -> 与记录 BASE 时内存中相同的 (轨迹, 未删除掩码)
+    stat = os.stat(base['path'])
+    if (stat.st_size, stat.st_mtime_ns) != (base['size'], base['mtime']):
+        raise JournalError("file changed on disk since the journal was written")
+    trajectory = Trajectory.load(base['path'])
+    deleted = base['deleted']
+    if not len(deleted):
+        if len(trajectory) != base['count']:
+            raise JournalError("pose count does not match the journal")
+        return trajectory, np.ones(len(trajectory), dtype=bool)
+    removed = Trajectory.load(os.path.join(session_dir, base['snapshot']))
+    if len(deleted) != base['count'] or len(trajectory) + len(removed) != base['count']:
+        raise JournalError("pose count does not match the journal")
+    positions = np.concatenate((np.flatnonzero(~deleted), np.flatnonzero(deleted)))
+    merged = Trajectory.merge([trajectory, removed]).take(np.argsort(positions, kind='stable'))
+    return merged, ~deleted
+
+
+def apply_record(session_dir, record_type, reader, trajectory, alive):
+    # 在 (轨迹, 未删除掩码) 上执行一条编辑记录，返回新的 (轨迹, 掩码)
+    if record_type == MOVE:
+        indices = reader.array()
+        delta = reader.array().reshape(-1, 2)
+        trajectory.points[indices] = trajectory.points[indices] + delta
+        trajectory.mark_modified(indices)
+    elif record_type == TRANSFORM:
+        coefficients = reader.array()
+        indices = reader.array()
+        trajectory.transform(coefficients[:4].reshape(2, 2), coefficients[4:], indices)
+    elif record_type == ALIVE:
+        flag, = reader.unpack(FLAG)
+        indices = reader.array()
+        alive[indices] = bool(flag)
+        trajectory.mark_modified(indices)
+    elif record_type == REPLACE:
+        alive = reader.mask()
+        trajectory = Trajectory.load(os.path.join(session_dir, reader.string())).copy()
+        trajectory.mark_modified()
+    return trajectory, alive
+
+
+def pending_files(records):
+    # 未关闭且在最后一条 BASE 之后有编辑的文件: {文件编号: (BASE, [(类型, RecordReader)])}
+    bases = {}
+    closed = set()
+    for sequence, (record_type, file_id, reader) in enumerate(records):
+        if record_type == BASE:
+            bases[file_id] = parse_base(reader)
+        elif record_type == CLOSE:
+            closed.add(file_id)
+    edits = {file_id: [] for file_id in bases if file_id not in closed}
+    for sequence, (record_type, file_id, reader) in enumerate(records):
+        if file_id in edits and record_type not in (BASE, CLOSE) and sequence > bases[file_id]['since']:
+            edits[file_id].append((record_type, reader))
+    return {file_id: (bases[file_id], file_edits) for file_id, file_edits in edits.items() if file_edits}
+
+
+def summarize_session(session_dir):
+    # 不加载轨迹，只列出可以恢复的文件: [(路径, 编辑数)]
+    records, _ = read_records(os.path.join(session_dir, JOURNAL_FILE))
+    return [(base['path'], len(edits)) for base, edits in pending_files(records).values()]
+
+
+def replay_session(session_dir):
+    # 重放会话日志: 返回 ([(文件编号, 文件名, 路径, 轨迹, 未删除掩码, 编辑数)], [(路径, 错误)])
+    records, _ = read_records(os.path.join(session_dir, JOURNAL_FILE))
+    recovered, failed = [], []
+    for file_id, (base, edits) in pending_files(records).items():
+        try:
+            trajectory, alive = load_base(session_dir, base)
+            for record_type, reader in edits:
+                trajectory, alive = apply_record(session_dir, record_type, reader, trajectory, alive)
+        except (OSError, ValueError, JournalError) as error:
+            failed.append((base['path'], str(error)))
+            continue
+        recovered.append((file_id, base['name'], base['path'], trajectory, alive, len(edits)))
+    return recovered, failed
+
+
+def discard_session(session_dir):
+    shutil.rmtree(session_dir, ignore_errors=True)
+
+
+def stale_sessions():
+    # 已结束 (没有进程持有锁) 的会话目录，最近的在前
+    try:
+        names = sorted(os.listdir(JOURNAL_DIR), reverse=True)
+    except OSError:
+        return []
+    sessions = []
+    for name in names:
+        session_dir = os.path.join(JOURNAL_DIR, name)
+        if not os.path.isfile(os.path.join(session_dir, JOURNAL_FILE)):
+            continue
+        if fcntl is None and name.endswith(f'-{os.getpid()}'):
+            continue
+        handle = lock_session(session_dir)
+        if handle is not None:
+            handle.close()
+            sessions.append(session_dir)
+    return sessions
+
+
+def lock_session(session_dir):
+    # 会话目录的独占锁，返回打开的锁文件 (关闭即释放)；已被其他进程持有时返回 None
+    handle = open(os.path.join(session_dir, LOCK_FILE), 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+    return handle
+
+
+class EditJournal:
+    # 本次会话的日志: 记录追加到缓冲的文件中，sync() 时 flush + fsync
+    def __init__(self, session_dir, lock, file_ids=None, sequence=0):
+        self.session_dir = session_dir
+        self.lock = lock
+        self.file = open(os.path.join(session_dir, JOURNAL_FILE), 'ab')
+        self.file_ids = dict(file_ids or {})  # 文件名 -> 文件编号
+        self.next_file_id = max(self.file_ids.values(), default=0) + 1
+        self.sequence = sequence  # 下一条记录的序号
+        self.unsynced_bytes = 0
+
+    @classmethod
+    def create(cls):
+        session_dir = os.path.join(JOURNAL_DIR, time.strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}')
+        os.makedirs(session_dir)
+        lock = lock_session(session_dir)
+        with open(os.path.join(session_dir, JOURNAL_FILE), 'wb') as file:
+            file.write(JOURNAL_MAGIC)
+        return cls(session_dir, lock)
+
+    @classmethod
+    def adopt(cls, session_dir, file_ids):
+        # 接管已结束的会话 (恢复后继续在同一日志上追加)，截掉末尾不完整的记录
+        lock = lock_session(session_dir)
+        if lock is None:
+            raise JournalError("session is still in use")
+        journal_path = os.path.join(session_dir, JOURNAL_FILE)
+        records, valid_bytes = read_records(journal_path)
+        os.truncate(journal_path, valid_bytes)
+        used = {file_id for _, file_id, _ in records}
+        journal = cls(session_dir, lock, file_ids, len(records))
+        journal.next_file_id = max(used, default=0) + 1
+        for file_id in used - set(journal.file_ids.values()):
+            journal.append(CLOSE, file_id)  # 没有恢复的文件不再提示
+        journal.sync()
+        return journal
+
+    def append(self, record_type, file_id, body=b''):
+        payload = RECORD.pack(record_type, file_id) + body
+        self.file.write(FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.sequence += 1
+        self.unsynced_bytes += FRAME.size + len(payload)
+        if self.unsynced_bytes >= SYNC_BYTES:
+            self.sync()
+
+    def sync(self):
+        if self.unsynced_bytes:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced_bytes = 0
+
+    def write_snapshot(self, name, trajectory):
+        trajectory.save(os.path.join(self.session_dir, name))
+        return name
+
+    def append_base(self, file_id, file_name, file_path, since, removed, deleted):
+        # file_name: 编辑器中的文件名 (图层和日志的键)，恢复时沿用；
+        # removed: 已删除的位姿 (deleted 为 True 处)，文件中只有其余位姿
+        stat = os.stat(file_path)
+        snapshot = ''
+        if deleted.any():
+            snapshot = self.write_snapshot(f'base-{self.sequence}{BINARY_SUFFIX}', removed)
+        body = BASE_FIELDS.pack(since, stat.st_size, stat.st_mtime_ns, len(deleted))
+        self.append(BASE, file_id, body + pack_string(os.path.abspath(file_path)) + pack_string(file_name)
+                    + pack_mask(deleted if deleted.any() else deleted[:0]) + pack_string(snapshot))
+
+    def open_file(self, file_name, file_path, trajectory, alive):
+        # 文件加载后 (编辑前) 调用
+        file_id = self.file_ids[file_name] = self.next_file_id
+        self.next_file_id += 1
+        deleted = ~alive
+        removed = trajectory.take(deleted) if deleted.any() else None
+        self.append_base(file_id, file_name, file_path, self.sequence, removed, deleted)
+
+    def close_file(self, file_name):
+        file_id = self.file_ids.pop(file_name, None)
+        if file_id is not None:
+            self.append(CLOSE, file_id)
+
+    def begin_save(self, trajectory, alive):
+        # 提交保存时调用，返回的记号在保存完成后交给 finish_save；
+        # 保存的内容包含到目前为止的所有记录 (序号 < self.sequence)，下一条记录起在保存之后
+        deleted = ~alive
+        return self.sequence - 1, (trajectory.take(deleted) if deleted.any() else None), deleted
+
+    def finish_save(self, file_name, file_path, token):
+        # 保存完成: 文件的起点改为刚保存的文件，提交保存之后的记录仍然有效
+        file_id = self.file_ids.get(file_name)
+        if file_id is not None:
+            self.append_base(file_id, file_name, file_path, *token)
+
+    def record(self, command, undo=False):
+        # 一条已执行 (undo=True 时为已撤销) 的命令
+        if isinstance(command, CommandGroup):
+            for sub_command in (reversed(command.commands) if undo else command.commands):
+                self.record(sub_command, undo)
+            return
+        file_id = self.file_ids.get(command.file_name)
+        if file_id is None:
+            return
+        if isinstance(command, MoveCommand):
+            delta = -command.delta if undo else command.delta
+            self.append(MOVE, file_id, pack_array(command.indices) + pack_array(delta))
+        elif isinstance(command, TransformCommand):
+            matrix, offset = command.matrix, command.offset
+            if undo:
+                matrix = np.linalg.inv(matrix)
+                offset = -matrix @ offset
+            self.append(TRANSFORM, file_id, pack_array(np.concatenate((matrix.ravel(), offset)))
+                        + pack_array(command.indices))
+        elif isinstance(command, DeleteCommand):
+            self.append(ALIVE, file_id, FLAG.pack(undo) + pack_array(command.indices))
+        elif isinstance(command, ReplaceCommand):
+            trajectory, alive = command.old_state if undo else command.new_state
+            snapshot = self.write_snapshot(f'replace-{self.sequence}{BINARY_SUFFIX}', trajectory)
+            self.append(REPLACE, file_id, pack_mask(alive) + pack_string(snapshot))
+
+    def compact(self, files):
+        # 所有修改都已保存后调用，files: [(文件名, 路径, 轨迹, 未删除掩码)]；
+        # 用只含各文件 BASE 的新日志替换原日志，删除不再引用的快照
+        self.file.close()
+        journal_path = os.path.join(self.session_dir, JOURNAL_FILE)
+        with open(journal_path + '.tmp', 'wb') as file:
+            file.write(JOURNAL_MAGIC)
+        os.replace(journal_path + '.tmp', journal_path)
+        for name in os.listdir(self.session_dir):
+            if name.endswith(BINARY_SUFFIX):
+                os.unlink(os.path.join(self.session_dir, name))
+        self.file = open(journal_path, 'ab')
+        self.file_ids = {}
+        self.next_file_id = 1
+        self.sequence = 0
+        self.unsynced_bytes = 0
+        for file_name, file_path, trajectory, alive in files:
+            self.open_file(file_name, file_path, trajectory, alive)
+        self.sync()
+
+    def close(self):
+        # 保留日志 (下次启动时可以恢复)
+        self.sync()
+        self.file.close()
+        self.lock.close()
+
+    def discard(self):
+        # 没有未保存的修改时删除整个会话目录
+        self.file.close()
+        self.lock.close()
+        discard_session(self.session_dir)
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+
+from trajectory import Trajectory
+from trajectory_io import TRAJECTORY_SUFFIXES
+
+# 目录中轨迹文件的元数据索引 (不依赖 Qt)
+# 每个文件记录位姿数、包围盒、轨迹长度、修改时间和一条几十个点的缩略折线，
+# 按目录存放在缓存目录中的 JSON 文件里；文件大小或修改时间变化时才重新解析该文件。
+
+INDEX_VERSION = 1
+INDEX_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'mapeditor', 'index'
+)
+THUMBNAIL_POINTS = 64
+SORT_KEYS = ('name', 'poses', 'length', 'mtime')
+
+
+def index_path_for(folder):
+    digest = hashlib.sha1(os.path.abspath(folder).encode('utf-8')).hexdigest()
+    return os.path.join(INDEX_DIR, digest + '.json')
+
+
+def scan_folder(folder, suffix=TRAJECTORY_SUFFIXES):
+    # 文件名 -> (大小, 修改时间)，只做 stat 不读内容
+    files = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix) and entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def thumbnail_of(points, count=THUMBNAIL_POINTS):
+    # 等间隔抽取的缩略折线 (场景坐标)，首尾两点保留
+    if len(points) <= count:
+        sample = points
+    else:
+        sample = points[np.linspace(0, len(points) - 1, count).round().astype(int)]
+    return np.round(sample, 3).tolist()
+
+
+def index_trajectory_file(file_path, use_cache=True):
+    # 在后台进程中执行: 解析 (或读缓存) 一个文件，返回它的索引条目
+    start_time = time.perf_counter()
+    stat = os.stat(file_path)
+    entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    try:
+        points = Trajectory.load(file_path, use_cache).points
+    except Exception as error:
+        entry['error'] = str(error)
+        return entry
+
+    entry['poses'] = len(points)
+    if len(points):
+        entry['bounds'] = points.min(axis=0).tolist() + points.max(axis=0).tolist()
+        entry['length'] = float(np.hypot(*np.diff(points, axis=0).T).sum())
+    else:
+        entry['bounds'] = None
+        entry['length'] = 0.0
+    entry['thumbnail'] = thumbnail_of(points)
+    entry['elapsed'] = time.perf_counter() - start_time
+    return entry
+
+
+class FolderIndex:
+    def __init__(self, folder):
+        self.folder = folder
+        self.entries = {}  # 文件名 -> 索引条目
+        self.files = {}  # 目录中当前的文件名 -> (大小, 修改时间)
+        self.dirty = False
+        try:
+            with open(index_path_for(folder), 'r') as file:
+                data = json.load(file)
+            if data.get('version') == INDEX_VERSION:
+                self.entries = data['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def refresh(self):
+        # 对比目录的当前状态，删除已不存在的文件，返回需要 (重新) 建立索引的文件名
+        self.files = files = scan_folder(self.folder)
+        for file_name in set(self.entries) - set(files):
+            del self.entries[file_name]
+            self.dirty = True
+        return sorted(file_name for file_name, (size, mtime) in files.items()
+                      if self.entries.get(file_name, {}).get('size') != size
+                      or self.entries.get(file_name, {}).get('mtime') != mtime)
+
+    def update(self, file_name, entry):
+        self.entries[file_name] = entry
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        index_path = index_path_for(self.folder)
+        try:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            with open(index_path + '.tmp', 'w') as file:
+                json.dump({'version': INDEX_VERSION, 'folder': os.path.abspath(self.folder),
+                           'entries': self.entries}, file)
+            os.replace(index_path + '.tmp', index_path)
+            self.dirty = False
+        except OSError:
+            pass  # 索引写入失败只影响下次打开的速度
+
+    def query(self, name_filter='', region=None, sort_key='name', descending=False):
+        # 目录中符合条件的文件名: 名称包含 name_filter，包围盒与 region (x0, y0, x1, y1) 相交；
+        # 尚未建立索引的文件按区域过滤时保留，排序时排在最后
+        name_filter = name_filter.lower()
+        selected = []
+        for file_name in self.files:
+            if name_filter and name_filter not in file_name.lower():
+                continue
+            entry = self.entries.get(file_name)
+            bounds = entry.get('bounds') if entry else None
+            if region is not None and entry is not None and 'error' not in entry:
+                if bounds is None or (bounds[2] < region[0] or bounds[0] > region[2]
+                                      or bounds[3] < region[1] or bounds[1] > region[3]):
+                    continue
+            selected.append(file_name)
+
+        if sort_key == 'name':
+            return sorted(selected, reverse=descending)
+        known = [name for name in selected if sort_key in self.entries.get(name, {})]
+        unknown = sorted(name for name in selected if sort_key not in self.entries.get(name, {}))
+        known.sort(key=lambda name: (self.entries[name][sort_key], name), reverse=descending)
+        return known + unknown
@@ -1,12 +1,20 @@
 import sys
 import os
-import yaml
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QFileDialog, QListWidget, QVBoxLayout,
-    QWidget, QLabel, QPushButton, QGraphicsView, QGraphicsScene, QGraphicsEllipseItem, QGraphicsItem, QHBoxLayout
+    QWidget, QLabel, QPushButton, QGraphicsView, QGraphicsScene, QGraphicsEllipseItem, QGraphicsItem, QHBoxLayout,
+    QStyleOptionGraphicsItem
 )
-from PyQt5.QtCore import Qt, QRectF, QPointF
-from PyQt5.QtGui import QTransform, QPainter, QPen, QColor
+from PyQt5.QtCore import Qt, QRectF, QPointF, QLineF, QObject, pyqtSignal
+from PyQt5.QtGui import QTransform, QPainter, QPen, QColor, QPicture
+
+from trajectory import load_trajectory_timed, save_trajectory_timed
+from trajectory_io import TRAJECTORY_SUFFIXES
 
 
 class CustomGraphicsView(QGraphicsView):
@@ -30,29 +38,76 @@ class CustomGraphicsView(QGraphicsView):
 
 
 class GridItem(QGraphicsItem):
-    def __init__(self, grid_size=0.05, width=200, height=200):
+    # 与 main.py 的网格相同: 按缩放选择网格间距，一个瓦片的网格线录制为 QPicture 后反复回放，
+    # 场景随数据扩大到很大范围时缩小查看也只需绘制少量线条
+    def __init__(self, grid_size=0.05, width=200, height=200, min_pixel_spacing=4, tier_factor=10, tile_cells=100):
         super().__init__()
         self.grid_size = grid_size
         self.width = width
         self.height = height
+        self.bounds = QRectF(-width / 2, -height / 2, width, height)
         self.pen = QPen(Qt.lightGray)
         self.pen.setWidthF(0.01)  # 设置笔宽为 0.01，使得网格线更细
 
+        # 细节层次: 网格线在屏幕上的间距不小于 min_pixel_spacing 像素，
+        # 否则切换到下一级 (间距乘以 tier_factor) 的网格
+        self.min_pixel_spacing = min_pixel_spacing
+        self.tier_factor = tier_factor
+        self.tile_cells = tile_cells  # 每个缓存瓦片包含的网格数 (每个方向)
+        self.tile_cache = {}  # 间距 -> QPicture
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)  # 只绘制暴露区域
+
     def boundingRect(self):
-        return QRectF(-self.width / 2, -self.height / 2, self.width, self.height)
+        return self.bounds
+
+    def set_bounds(self, rect):
+        # 场景随数据扩大时网格跟着扩大，瓦片按坐标原点对齐，已缓存的瓦片仍然可用
+        if rect != self.bounds:
+            self.prepareGeometryChange()
+            self.bounds = QRectF(rect)
+            self.width = rect.width()
+            self.height = rect.height()
+
+    def spacing_for_lod(self, lod):
+        # 选择屏幕间距不小于 min_pixel_spacing 的最细一级网格
+        spacing = self.grid_size
+        while spacing * lod < self.min_pixel_spacing and spacing * self.tier_factor <= max(self.width, self.height):
+            spacing *= self.tier_factor
+        return spacing
+
+    def tile_picture(self, spacing):
+        picture = self.tile_cache.get(spacing)
+        if picture is None:
+            tile_size = spacing * self.tile_cells
+            lines = []
+            for i in range(self.tile_cells + 1):
+                offset = i * spacing
+                lines.append(QLineF(offset, 0, offset, tile_size))
+                lines.append(QLineF(0, offset, tile_size, offset))
+            picture = QPicture()
+            picture_painter = QPainter(picture)
+            picture_painter.setPen(self.pen)
+            picture_painter.drawLines(lines)
+            picture_painter.end()
+            self.tile_cache[spacing] = picture
+        return picture
 
     def paint(self, painter, option, widget=None):
-        left, top = self.boundingRect().topLeft().x(), self.boundingRect().topLeft().y()
-        right, bottom = self.boundingRect().bottomRight().x(), self.boundingRect().bottomRight().y()
-
-        painter.setPen(self.pen)
+        # 只回放与暴露区域相交的瓦片
+        exposed = option.exposedRect.intersected(self.bounds)
+        if exposed.isEmpty():
+            return
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        spacing = self.spacing_for_lod(lod)
+        picture = self.tile_picture(spacing)
+        tile_size = spacing * self.tile_cells
 
-        for i in range(int(self.width / self.grid_size) + 1):
-            x = left + i * self.grid_size
-            painter.drawLine(QPointF(x, top), QPointF(x, bottom))
-        for i in range(int(self.height / self.grid_size) + 1):
-            y = top + i * self.grid_size
-            painter.drawLine(QPointF(left, y), QPointF(right, y))
+        painter.save()
+        painter.setClipRect(exposed)
+        for row in range(math.floor(exposed.top() / tile_size), math.floor(exposed.bottom() / tile_size) + 1):
+            for col in range(math.floor(exposed.left() / tile_size), math.floor(exposed.right() / tile_size) + 1):
+                painter.drawPicture(QPointF(col * tile_size, row * tile_size), picture)
+        painter.restore()
 
 
 class DraggableEllipseItem(QGraphicsEllipseItem):
@@ -86,6 +141,11 @@ class DraggableEllipseItem(QGraphicsEllipseItem):
             super().keyPressEvent(event)
 
 
+class SaveSignals(QObject):
+    # 后台保存完成的通知 (文件名, Future)，跨线程发射时自动排队到 GUI 线程
+    saved = pyqtSignal(str, object)
+
+
 class MapEditor(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -94,9 +154,13 @@ class MapEditor(QMainWindow):
 
         # 初始化变量
         self.root_dir = ""
-        self.path_data_list = []
+        self.trajectories = {}  # 文件名 -> Trajectory
         self.undo_stack = []
         self.deleted_items_stack = []
+        self.executor = None  # 保存在后台进程中进行，第一次保存时创建
+        self.pending_saves = {}  # 文件名 -> (Future, Trajectory, 保存时的 revision)
+        self.save_signals = SaveSignals()
+        self.save_signals.saved.connect(self.on_file_saved)
 
         # 创建主布局
         central_widget = QWidget()
@@ -108,7 +172,8 @@ class MapEditor(QMainWindow):
         main_layout.addLayout(map_layout)
 
         # 图形视图
-        self.scene = QGraphicsScene(-100, -100, 200, 200)  # 设置场景大小为200x200米
+        self.default_scene_rect = QRectF(-100, -100, 200, 200)  # 初始场景 200x200 米，加载数据后随数据范围扩大
+        self.scene = QGraphicsScene(self.default_scene_rect)
         self.graphics_view = CustomGraphicsView(self.scene, self)
         self.graphics_view.setFocusPolicy(Qt.StrongFocus)  # 确保图形视图具有强焦点策略
         map_layout.addWidget(self.graphics_view)
@@ -153,6 +218,15 @@ class MapEditor(QMainWindow):
         self.scene.removeItem(item)
         self.deleted_items_stack.append((item, item.scenePos()))
         self.undo_stack.append(('delete', item))
+        self.trajectories[item.file_name].mark_modified(item.pose_index)
+
+    def sync_item(self, item):
+        # 把点的位置写回所属轨迹并标记为已修改
+        pos = item.scenePos()
+        trajectory = self.trajectories[item.file_name]
+        trajectory.points[item.pose_index] = (pos.x(), pos.y())
+        trajectory.mark_modified(item.pose_index)
+
     def record_initial_position(self, item, pos):
         # 记录初始位置
         self.initial_position = pos
@@ -160,6 +234,7 @@ class MapEditor(QMainWindow):
     def record_final_position_and_store_undo(self, item, new_pos):
         # 将初始位置和新位置存储到撤销栈
         self.undo_stack.append(('move', item, self.initial_position, new_pos))
+        self.sync_item(item)
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Z and (event.modifiers() & Qt.ControlModifier):
@@ -176,10 +251,12 @@ class MapEditor(QMainWindow):
         if action[0] == 'move':
             _, item, old_pos, _ = action
             item.setPos(old_pos)
+            self.sync_item(item)
         elif action[0] == 'delete':
             item, pos = self.deleted_items_stack.pop()
             self.scene.addItem(item)
             item.setPos(pos)
+            self.trajectories[item.file_name].mark_modified(item.pose_index)
 
     def choose_folder(self):
         self.root_dir = QFileDialog.getExistingDirectory(self, "选择目录")
@@ -189,23 +266,23 @@ class MapEditor(QMainWindow):
     def load_files(self):
         self.file_list_widget.clear()
         for file_name in os.listdir(self.root_dir):
-            if file_name.endswith('.yaml'):
+            if file_name.endswith(TRAJECTORY_SUFFIXES):
                 self.file_list_widget.addItem(file_name)
 
     def load_yaml_files(self, item):
         file_name = item.text()
 
-        # 检查文件是否已存在于 path_data_list 中
-        for existing_file_name, _ in self.path_data_list:
-            if existing_file_name == file_name:
-                return  # 文件已存在，不重复加载
+        # 检查文件是否已加载，不重复加载
+        if file_name in self.trajectories:
+            return
 
         file_path = os.path.join(self.root_dir, file_name)
-        with open(file_path, 'r') as file:
-            path_data = yaml.load(file, Loader=yaml.FullLoader)
-            len_path_data = len(path_data['poses'])
-            print_msg = f"文件名={file_name} 轨迹长度={len_path_data}"
-            self.path_data_list.append((file_name, path_data))
+        trajectory, cache_hit, elapsed = load_trajectory_timed(file_path)
+        len_path_data = len(trajectory)
+        cache_state = "命中" if cache_hit else "未命中"
+        print_msg = f"文件名={file_name} 轨迹长度={len_path_data} 缓存={cache_state} 解析耗时={elapsed:.3f}s"
+        self.status_label.setText(print_msg)
+        self.trajectories[file_name] = trajectory
 
         self.display_points()
 
@@ -219,37 +296,74 @@ class MapEditor(QMainWindow):
         colors = [QColor('red'), QColor('blue'), QColor('green'), QColor('yellow'), QColor('cyan')]
 
         # 显示每个加载文件中的点
-        for idx, (file_name, path_data) in enumerate(self.path_data_list):
-            if not path_data or 'poses' not in path_data:
-                continue
-
+        for idx, (file_name, trajectory) in enumerate(self.trajectories.items()):
             color = colors[idx % len(colors)]  # 轮询使用颜色
 
-            for pose in path_data['poses']:
-                position = pose['position']
-                x, y = position['x'], position['y']
+            for pose_index, (x, y) in enumerate(trajectory.points.tolist()):
                 ellipse = DraggableEllipseItem(self, color, -0.05, -0.05, 0.1, 0.1)  # 调整后的固定大小
                 ellipse.setPos(x, y)  # 设置椭圆的位置
+                ellipse.file_name = file_name  # 记录所属文件和位姿索引，保存时直接写回
+                ellipse.pose_index = pose_index
                 self.scene.addItem(ellipse)
 
-    def save_yaml_files(self):
-        for file_name, path_data in self.path_data_list:
-            if not path_data or 'poses' in path_data:
-                continue
+        self.update_scene_extent()
 
-            for item in self.scene.items():
-                if isinstance(item, DraggableEllipseItem):
-                    pos = item.scenePos()
-                    idx = self.scene.items().index(item) - 1  # 减去GridItem的位置
-                    path_data['poses'][idx]['position']['x'] = pos.x()
-                    path_data['poses'][idx]['position']['y'] = pos.y()
+    def update_scene_extent(self):
+        # 场景范围 = 所有轨迹的包围盒外扩 10%，至少为初始的 200x200 米
+        rect = QRectF(self.default_scene_rect)
+        for trajectory in self.trajectories.values():
+            if len(trajectory):
+                (left, top), (right, bottom) = trajectory.points.min(axis=0), trajectory.points.max(axis=0)
+                margin = max(right - left, bottom - top) * 0.1 + 1.0
+                rect = rect.united(QRectF(QPointF(left - margin, top - margin), QPointF(right + margin, bottom + margin)))
+        self.scene.setSceneRect(rect)
+        self.grid_item.set_bounds(rect)
 
+    def save_yaml_files(self):
+        # 只保存有修改的文件，点的位置在拖动时已写回轨迹，已删除的点不再保存；
+        # 在 GUI 线程中只取出快照，写文件在后台进程中进行
+        deleted = {}
+        for item, _ in self.deleted_items_stack:
+            deleted.setdefault(item.file_name, []).append(item.pose_index)
+
+        for file_name, trajectory in self.trajectories.items():
+            if not trajectory.is_dirty or file_name in self.pending_saves:
+                continue
+            alive = np.ones(len(trajectory), dtype=bool)
+            alive[deleted.get(file_name, [])] = False
             file_path = os.path.join(self.root_dir, file_name)
-            with open(file_path, 'w') as file:
-                yaml.dump(path_data, file)
-
-        self.status_label.setText("已保存修改到文件")
-
+            future = self.get_executor().submit(save_trajectory_timed, trajectory.take(alive), file_path)
+            self.pending_saves[file_name] = (future, trajectory, trajectory.revision)
+            future.add_done_callback(partial(self.save_signals.saved.emit, file_name))
+
+        if self.pending_saves:
+            self.status_label.setText(f"正在保存 {len(self.pending_saves)} 个文件...")
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def on_file_saved(self, file_name, future):
+        if self.pending_saves.get(file_name, (None,))[0] is not future:
+            return  # 关闭窗口时已处理
+        _, trajectory, revision = self.pending_saves.pop(file_name)
+        try:
+            elapsed = future.result()
+        except Exception as error:
+            self.status_label.setText(f"保存失败 文件名={file_name}: {error}")
+            return
+        # 保存期间又有修改时 mark_saved 保持未保存状态
+        trajectory.mark_saved(revision)
+        self.status_label.setText(f"已保存 {file_name} 耗时={elapsed:.3f}s")
+
+    def closeEvent(self, event):
+        if self.executor is not None:
+            # 等待正在进行的保存完成，避免留下未写完的文件
+            self.executor.shutdown(wait=True)
+            for file_name, (future, *_) in list(self.pending_saves.items()):
+                self.on_file_saved(file_name, future)
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
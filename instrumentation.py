@@ -0,0 +1,63 @@
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Profiler:
+    # 热点路径计时 (不依赖 Qt): 每个名称累计次数/总耗时/最大/最近一次，最近的样本存在环形缓冲中
+    # 名称约定: 'frame' 整帧绘制，'paint:<图层>' 单个图形项绘制，其余为加载、解析、保存等操作
+    def __init__(self, sample_count=4096):
+        self.stats = {}
+        self.samples = deque(maxlen=sample_count)  # (时间戳, 名称, 秒)
+
+    def record(self, name, seconds):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}
+        stat['count'] += 1
+        stat['total'] += seconds
+        stat['last'] = seconds
+        if seconds > stat['max']:
+            stat['max'] = seconds
+        self.samples.append((time.time(), name, seconds))
+
+    @contextmanager
+    def timer(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def rate(self, name, window=1.0):
+        # 最近 window 秒内每秒记录的次数 (如 'frame' 即帧率)
+        now = time.time()
+        count = 0
+        for timestamp, sample_name, _ in reversed(self.samples):
+            if now - timestamp > window:
+                break
+            count += sample_name == name
+        return count / window
+
+    def summary(self):
+        return {name: {'count': stat['count'],
+                       'total_ms': stat['total'] * 1000,
+                       'mean_ms': stat['total'] / stat['count'] * 1000,
+                       'max_ms': stat['max'] * 1000,
+                       'last_ms': stat['last'] * 1000}
+                for name, stat in sorted(self.stats.items())}
+
+    def dump(self, file_path, **extra):
+        data = dict(extra, summary=self.summary(),
+                    samples=[{'time': timestamp, 'name': name, 'ms': seconds * 1000}
+                             for timestamp, name, seconds in self.samples])
+        with open(file_path, 'w') as file:
+            json.dump(data, file, indent=2, ensure_ascii=False)
+
+    def reset(self):
+        self.stats = {}
+        self.samples.clear()
+
+
+profiler = Profiler()
@@ -1,106 +1,1009 @@
 import sys
 import os
-import yaml
+import math
+import time
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque, OrderedDict
+from functools import partial
+import numpy as np
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QFileDialog, QListWidget, QVBoxLayout,
-    QWidget, QLabel, QPushButton, QGraphicsView, QGraphicsScene, QGraphicsEllipseItem, QGraphicsItem, QHBoxLayout,
-    QTextEdit, QMessageBox, QDialog
+    QWidget, QLabel, QPushButton, QGraphicsView, QGraphicsScene, QGraphicsItem, QHBoxLayout,
+    QTextEdit, QMessageBox, QDialog, QStyleOptionGraphicsItem, QListWidgetItem, QColorDialog,
+    QProgressBar, QAbstractItemView, QComboBox, QCheckBox, QInputDialog, QLineEdit, QGraphicsPathItem,
+    QDoubleSpinBox, QFormLayout, QOpenGLWidget, QDockWidget
 )
-from PyQt5.QtCore import Qt, QRectF, QPointF
-from PyQt5.QtGui import QTransform, QPainter, QPen, QColor
+from PyQt5.QtCore import Qt, QRectF, QPointF, QLineF, QObject, QTimer, QFileSystemWatcher, QDateTime, QItemSelectionModel, pyqtSignal
+from PyQt5.QtGui import (QTransform, QPainter, QPen, QColor, QPicture, QPolygonF, QPixmap, QIcon, QImage, QPainterPath,
+                         QSurfaceFormat, QOpenGLContext)
+
+from trajectory import (Trajectory, stream_trajectory_timed, save_trajectory_timed, write_trajectory_cache,
+                        set_stream_queue, rotation_about, mirror_about)
+from trajectory_io import BINARY_SUFFIX, is_binary_path
+from spatial_index import GridIndex
+from simplification import douglas_peucker, remove_duplicates, decimate_by_arc_length, resample
+from commands import CommandStack, MoveCommand, TransformCommand, DeleteCommand, ReplaceCommand
+from edit_journal import EditJournal, JournalError, discard_session, replay_session, stale_sessions, summarize_session
+from instrumentation import profiler
+from occupancy_map import build_pyramid, MapPyramid
+from folder_index import FolderIndex, index_trajectory_file
+from minimap import MinimapRaster
+from comparison import (DEVIATION_BINS, build_reference_index, path_deviations, compare_trajectories_timed,
+                        deviation_stats, out_of_tolerance_segments, deviation_bins)
+
+
+def draft_level(widget):
+    # 绘制所在视图的草图级别: 0 为完整画质，交互 (平移/缩放) 中为 1 及以上，级别越高越粗略；
+    # 不在视图中绘制 (如导出图片) 时为 0
+    view = widget.parentWidget() if widget is not None else None
+    return getattr(view, 'draft_level', 0)
 
 
 class CustomGraphicsView(QGraphicsView):
+    background_clicked = pyqtSignal(object)  # 点击空白处 (没有位姿被选中)，参数为键盘修饰键
+    rect_selected = pyqtSignal(QRectF, object)  # 框选结束 (场景矩形, 修饰键)
+    lasso_selected = pyqtSignal(QPolygonF, object)  # 套索结束 (场景多边形, 修饰键)
+    interaction_finished = pyqtSignal(int, float, int)  # 一次平移/缩放结束: (帧数, 秒, 最高草图级别)
+
     def __init__(self, scene, parent=None):
         super().__init__(scene, parent)
         self.setDragMode(QGraphicsView.ScrollHandDrag)  # 允许拖动
         self.setRenderHint(QPainter.Antialiasing)
+        self.setOptimizationFlag(QGraphicsView.DontSavePainterState)  # 各图形项自行设置画笔，需要时自己 save/restore
+
+        # 交互画质: 平移/缩放时关闭抗锯齿并改用草图级别绘制，每帧耗时超出 frame_budget 时提高级别，
+        # 远低于预算时降低级别；停止交互 interaction_timer 的间隔后恢复完整画质重绘一帧
+        self.adaptive_quality = True
+        self.frame_budget = 1 / 30
+        self.max_draft_level = 4
+        self.draft_level = 0
+        self.interaction_draft_level = 1  # 下次交互开始时的级别 (沿用上次交互结束时的级别)
+        self.interaction_start = None
+        self.interaction_frames = 0
+        self.interaction_last_frame = None
+        self.interaction_max_level = 0
+        self.interaction_timer = QTimer(self)
+        self.interaction_timer.setSingleShot(True)
+        self.interaction_timer.setInterval(150)
+        self.interaction_timer.timeout.connect(self.end_interaction)
+        self.opengl_viewport = False
+        for scroll_bar in (self.horizontalScrollBar(), self.verticalScrollBar()):
+            scroll_bar.actionTriggered.connect(self.begin_interaction)
+
+        # 选择模式: 'pan' 拖动画布, 'rect' 框选, 'lasso' 套索
+        self.selection_mode = 'pan'
+        self.selection_points = None  # 正在框选/套索时的场景坐标
+        self.selection_modifiers = Qt.NoModifier
+        self.selection_pen = QPen(Qt.black, 0, Qt.DashLine)  # 宽度 0 为固定 1 像素
+        self.overlay_visible = False  # 在左上角显示帧耗时和各图层的绘制耗时
+
+    def set_overlay_visible(self, visible):
+        self.overlay_visible = visible
+        self.update_viewport_mode()
+
+    def update_viewport_mode(self):
+        # 叠加层固定在视口上，需要整个视口重绘才不会留下残影；OpenGL 视口每帧都整体重绘
+        full = self.overlay_visible or self.opengl_viewport
+        self.setViewportUpdateMode(QGraphicsView.FullViewportUpdate if full
+                                   else QGraphicsView.MinimalViewportUpdate)
+        self.viewport().update()
+
+    def set_opengl_viewport(self, enabled):
+        # QOpenGLWidget 视口: 没有 GPU 时由 Mesa 的软件光栅化 (llvmpipe) 实现，
+        # 可设置环境变量 LIBGL_ALWAYS_SOFTWARE=1 强制使用。无法创建 OpenGL 上下文时保持原视口，返回 False
+        if enabled == self.opengl_viewport:
+            return True
+        if enabled:
+            surface_format = QSurfaceFormat()
+            surface_format.setSamples(4)  # 多重采样抗锯齿
+            context = QOpenGLContext()
+            context.setFormat(surface_format)
+            if not context.create():
+                return False
+            viewport = QOpenGLWidget()
+            viewport.setFormat(surface_format)
+        else:
+            viewport = QWidget()
+        self.opengl_viewport = enabled
+        self.setViewport(viewport)
+        self.update_viewport_mode()
+        return True
+
+    def begin_interaction(self, *_):
+        # 用户平移、缩放或拖动滚动条时调用 (程序中的 centerOn/fitInView 不算)，停止 150 毫秒后 end_interaction
+        if not self.adaptive_quality:
+            return
+        if self.interaction_start is None:
+            self.interaction_start = time.perf_counter()
+            self.interaction_frames = 0
+            self.interaction_last_frame = self.interaction_start
+            self.draft_level = self.interaction_max_level = self.interaction_draft_level
+            self.setRenderHint(QPainter.Antialiasing, False)
+        self.interaction_timer.start()
+
+    def end_interaction(self):
+        if self.interaction_start is None:
+            return
+        elapsed = self.interaction_last_frame - self.interaction_start  # 不含停止后等待的时间
+        self.interaction_start = None
+        self.interaction_draft_level = max(self.draft_level, 1)
+        self.draft_level = 0
+        self.setRenderHint(QPainter.Antialiasing)
+        self.viewport().update()
+        self.interaction_finished.emit(self.interaction_frames, elapsed, self.interaction_max_level)
+
+    def paintEvent(self, event):
+        start_time = time.perf_counter()
+        with profiler.timer('frame'):
+            super().paintEvent(event)
+        if self.interaction_start is not None:
+            # 按本帧耗时调整下一帧的草图级别
+            self.interaction_last_frame = time.perf_counter()
+            frame_time = self.interaction_last_frame - start_time
+            self.interaction_frames += 1
+            if frame_time > self.frame_budget and self.draft_level < self.max_draft_level:
+                self.draft_level += 1
+            elif frame_time < self.frame_budget / 3 and self.draft_level > 1:
+                self.draft_level -= 1
+            self.interaction_max_level = max(self.interaction_max_level, self.draft_level)
+            profiler.record('frame:draft', frame_time)
+
+    def set_selection_mode(self, mode):
+        self.selection_mode = mode
+        self.setDragMode(QGraphicsView.ScrollHandDrag if mode == 'pan' else QGraphicsView.NoDrag)
 
-    def wheelEvent(self, event):
-        # 缩放因子
-        zoom_in_factor = 1.15
-        zoom_out_factor = 1 / zoom_in_factor
+    def mousePressEvent(self, event):
+        super().mousePressEvent(event)
+        if self.scene().mouseGrabberItem() is None:
+            self.background_clicked.emit(event.modifiers())
+            if self.selection_mode != 'pan' and event.button() == Qt.LeftButton:
+                self.selection_points = [self.mapToScene(event.pos())]
+                self.selection_modifiers = event.modifiers()
+
+    def mouseMoveEvent(self, event):
+        if self.selection_points is None:
+            if event.buttons() & Qt.LeftButton and self.dragMode() == QGraphicsView.ScrollHandDrag \
+                    and self.scene().mouseGrabberItem() is None:
+                self.begin_interaction()  # 拖动画布
+            super().mouseMoveEvent(event)
+            return
+        pos = self.mapToScene(event.pos())
+        if self.selection_mode == 'rect':
+            self.selection_points = [self.selection_points[0], pos]
+        else:
+            self.selection_points.append(pos)
+        self.viewport().update()
 
-        # 缩放
-        if event.angleDelta().y() > 0:
-            zoom_factor = zoom_in_factor
+    def mouseReleaseEvent(self, event):
+        if self.selection_points is None or event.button() != Qt.LeftButton:
+            super().mouseReleaseEvent(event)
+            return
+        points = self.selection_points
+        self.selection_points = None
+        self.viewport().update()
+        if len(points) < 2:
+            return
+        if self.selection_mode == 'rect':
+            self.rect_selected.emit(QRectF(points[0], points[-1]).normalized(), self.selection_modifiers)
         else:
-            zoom_factor = zoom_out_factor
+            self.lasso_selected.emit(QPolygonF(points), self.selection_modifiers)
+
+    def drawForeground(self, painter, rect):
+        if self.overlay_visible:
+            self.draw_overlay(painter)
+        if not self.selection_points or len(self.selection_points) < 2:
+            return
+        painter.setPen(self.selection_pen)
+        painter.setBrush(Qt.NoBrush)
+        if self.selection_mode == 'rect':
+            painter.drawRect(QRectF(self.selection_points[0], self.selection_points[-1]).normalized())
+        else:
+            painter.drawPolygon(QPolygonF(self.selection_points))
+
+    def draw_overlay(self, painter):
+        # 上一帧的耗时 (本帧还没画完) 和耗时最多的图形项
+        stats = profiler.stats
+        lines = []
+        frame = stats.get('frame')
+        if frame is not None:
+            lines.append(f"帧 {frame['last'] * 1000:.1f}ms 平均 {frame['total'] / frame['count'] * 1000:.1f}ms "
+                         f"最大 {frame['max'] * 1000:.1f}ms {profiler.rate('frame'):.0f} 帧/s")
+        if self.draft_level:
+            lines.append(f"草图级别 {self.draft_level} (预算 {self.frame_budget * 1000:.0f}ms)")
+        items = sorted((name for name in stats if name.startswith('paint:')), key=lambda name: -stats[name]['last'])
+        for name in items[:8]:
+            lines.append(f"{name[len('paint:'):]} {stats[name]['last'] * 1000:.2f}ms")
+        for name in ('load', 'parse', 'display', 'save'):
+            if name in stats:
+                lines.append(f"{name} {stats[name]['last'] * 1000:.0f}ms")
+        if not lines:
+            return
+
+        painter.save()
+        painter.resetTransform()
+        metrics = painter.fontMetrics()
+        width = max(metrics.horizontalAdvance(line) for line in lines) + 12
+        height = metrics.height() * len(lines) + 8
+        painter.fillRect(QRectF(4, 4, width, height), QColor(255, 255, 255, 200))
+        painter.setPen(Qt.black)
+        for i, line in enumerate(lines):
+            painter.drawText(QPointF(10, 8 + metrics.ascent() + i * metrics.height()), line)
+        painter.restore()
 
+    def wheelEvent(self, event):
+        # 每一格 (120) 缩放 1.15 倍，触控板的小步长按比例缩放；连续滚动期间使用草图画质
+        steps = event.angleDelta().y() / 120
+        if not steps:
+            return
+        self.begin_interaction()
+        zoom_factor = 1.15 ** steps
         self.scale(zoom_factor, zoom_factor)
 
 
 class GridItem(QGraphicsItem):
-    def __init__(self, grid_size=0.05, width=200, height=200):
+    def __init__(self, grid_size=0.05, width=200, height=200, min_pixel_spacing=4, tier_factor=10, tile_cells=100):
         super().__init__()
         self.grid_size = grid_size
         self.width = width
         self.height = height
+        self.bounds = QRectF(-width / 2, -height / 2, width, height)
         self.pen = QPen(Qt.lightGray)
         self.pen.setWidthF(0.01)  # 设置笔宽为 0.01，使得网格线更细
 
+        # 细节层次: 网格线在屏幕上的间距不小于 min_pixel_spacing 像素，
+        # 否则切换到下一级 (间距乘以 tier_factor) 的网格
+        self.min_pixel_spacing = min_pixel_spacing
+        self.tier_factor = tier_factor
+        self.tile_cells = tile_cells  # 每个缓存瓦片包含的网格数 (每个方向)
+        self.tile_cache = {}  # 间距 -> QPicture
+
+        # 只需重绘 option.exposedRect 内的部分
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
     def boundingRect(self):
-        return QRectF(-self.width / 2, -self.height / 2, self.width, self.height)
+        return self.bounds
+
+    def set_bounds(self, rect):
+        # 随场景范围扩大或缩小，瓦片按坐标原点对齐，范围变化时已缓存的瓦片仍然可用
+        self.prepareGeometryChange()
+        self.bounds = QRectF(rect)
+        self.width = rect.width()
+        self.height = rect.height()
+        self.update()
+
+    def spacing_for_lod(self, lod):
+        # 选择屏幕间距不小于 min_pixel_spacing 的最细一级网格
+        spacing = self.grid_size
+        while spacing * lod < self.min_pixel_spacing and spacing * self.tier_factor <= max(self.width, self.height):
+            spacing *= self.tier_factor
+        return spacing
+
+    def tile_picture(self, spacing):
+        picture = self.tile_cache.get(spacing)
+        if picture is None:
+            # 录制一个瓦片内的全部网格线，平移时直接回放
+            tile_size = spacing * self.tile_cells
+            lines = []
+            for i in range(self.tile_cells + 1):
+                offset = i * spacing
+                lines.append(QLineF(offset, 0, offset, tile_size))
+                lines.append(QLineF(0, offset, tile_size, offset))
+            picture = QPicture()
+            picture_painter = QPainter(picture)
+            picture_painter.setPen(self.pen)
+            picture_painter.drawLines(lines)
+            picture_painter.end()
+            self.tile_cache[spacing] = picture
+        return picture
 
     def paint(self, painter, option, widget=None):
-        left, top = self.boundingRect().topLeft().x(), self.boundingRect().topLeft().y()
-        right, bottom = self.boundingRect().bottomRight().x(), self.boundingRect().bottomRight().y()
-
-        painter.setPen(self.pen)
-
-        for i in range(int(self.width / self.grid_size) + 1):
-            x = left + i * self.grid_size
-            painter.drawLine(QPointF(x, top), QPointF(x, bottom))
-        for i in range(int(self.height / self.grid_size) + 1):
-            y = top + i * self.grid_size
-            painter.drawLine(QPointF(left, y), QPointF(right, y))
-
-
-class DraggableEllipseItem(QGraphicsEllipseItem):
-    def __init__(self, parent, color, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.setFlag(QGraphicsItem.ItemIsMovable)
-        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges)
-        self.setBrush(color)
-        self.setPen(QPen(color, 0.001))  # 使用非常细的边框
-        self.parent = parent
-        self.original_position = self.pos()
+        with profiler.timer('paint:grid'):
+            self.paint_tiles(painter, option, widget)
+
+    def paint_tiles(self, painter, option, widget=None):
+        bounds = self.boundingRect()
+        exposed = option.exposedRect.intersected(bounds)
+        if exposed.isEmpty():
+            return
+
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        spacing = self.spacing_for_lod(lod / 2 ** draft_level(widget))  # 交互中网格线更稀疏
+        picture = self.tile_picture(spacing)
+        tile_size = spacing * self.tile_cells
+
+        # 只回放与暴露区域相交的瓦片
+        first_col = math.floor(exposed.left() / tile_size)
+        last_col = math.floor(exposed.right() / tile_size)
+        first_row = math.floor(exposed.top() / tile_size)
+        last_row = math.floor(exposed.bottom() / tile_size)
+
+        painter.save()
+        painter.setClipRect(exposed)
+        for row in range(first_row, last_row + 1):
+            y = row * tile_size
+            for col in range(first_col, last_col + 1):
+                x = col * tile_size
+                painter.drawPicture(QPointF(x, y), picture)
+        painter.restore()
+
+
+class OccupancyMapItem(QGraphicsItem):
+    # 栅格地图背景: 项坐标为原图像素 (列, 行)，由 map.yaml 的分辨率和原点变换到场景坐标 (米)；
+    # 按当前缩放选择金字塔级别，只为可见瓦片从内存映射的数据生成 QPixmap，超过 max_tiles 个时丢弃最久未用的
+    def __init__(self, pyramid, tile_pixels=256, max_tiles=256):
+        super().__init__()
+        self.pyramid = pyramid
+        self.tile_pixels = tile_pixels
+        self.max_tiles = max_tiles
+        self.tile_cache = OrderedDict()  # (级别, 列, 行) -> QPixmap
+        height, width = pyramid.shape
+        self.bounds = QRectF(0, 0, width, height)
+
+        # 原图第 0 行在最上方，对应 y 最大处；origin 为左下角像素的位置和朝向
+        resolution = pyramid.resolution
+        origin_x, origin_y, yaw = pyramid.origin
+        transform = QTransform()
+        transform.translate(origin_x, origin_y)
+        transform.rotateRadians(yaw)
+        transform.translate(0, height * resolution)
+        transform.scale(resolution, -resolution)
+        self.setTransform(transform)
+
+        self.setZValue(-1)  # 在网格和轨迹之下
+        self.setAcceptedMouseButtons(Qt.NoButton)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
 
-        # 使项可选择并接收焦点
-        self.setFlag(QGraphicsItem.ItemIsSelectable)
+    def boundingRect(self):
+        return self.bounds
+
+    def level_for(self, lod):
+        # lod 为每个原图像素对应的屏幕像素数，选择像素不大于一个屏幕像素的最粗一级
+        if lod >= 1:
+            return 0
+        return min(int(math.floor(math.log2(1 / lod))), self.pyramid.level_count() - 1)
+
+    def tile_pixmap(self, level, col, row):
+        key = (level, col, row)
+        pixmap = self.tile_cache.get(key)
+        if pixmap is not None:
+            self.tile_cache.move_to_end(key)
+            return pixmap
+        pixels = self.pyramid.tile(level, col, row, self.tile_pixels)
+        height, width = pixels.shape
+        image = QImage(pixels.tobytes(), width, height, width, QImage.Format_Grayscale8)
+        pixmap = QPixmap.fromImage(image)
+        self.tile_cache[key] = pixmap
+        while len(self.tile_cache) > self.max_tiles:
+            self.tile_cache.popitem(last=False)
+        return pixmap
+
+    def nbytes(self):
+        return sum(pixmap.width() * pixmap.height() * pixmap.depth() // 8 for pixmap in self.tile_cache.values())
+
+    def paint(self, painter, option, widget=None):
+        with profiler.timer('paint:map'):
+            self.paint_tiles(painter, option, widget)
+
+    def paint_tiles(self, painter, option, widget=None):
+        exposed = option.exposedRect.intersected(self.bounds)
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        if lod <= 0 or exposed.isEmpty():
+            return
+        level = self.level_for(lod / 2 ** draft_level(widget))  # 交互中使用更粗的金字塔级别，瓦片更少
+        scale = 2 ** level
+        span = self.tile_pixels * scale  # 一个瓦片覆盖的原图像素数
+
+        painter.save()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, False)  # 放大时显示清晰的栅格
+        for row in range(math.floor(exposed.top() / span), math.floor(exposed.bottom() / span) + 1):
+            for col in range(math.floor(exposed.left() / span), math.floor(exposed.right() / span) + 1):
+                pixmap = self.tile_pixmap(level, col, row)
+                if pixmap.isNull():
+                    continue
+                target = QRectF(col * span, row * span, pixmap.width() * scale, pixmap.height() * scale)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        painter.restore()
+
+
+def points_to_polygon(points):
+    # 直接把 (n, 2) float64 数组拷贝进 QPolygonF 的内存，避免逐点构造 QPointF
+    polygon = QPolygonF(len(points))
+    if len(points):
+        buffer = polygon.data()
+        buffer.setsize(len(points) * 2 * 8)
+        np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = points
+    return polygon
+
+
+class TrajectoryLayerItem(QGraphicsItem):
+    # 一个文件的全部位姿: 坐标直接使用 Trajectory 的连续数组，一次 drawPoints 批量绘制
+    def __init__(self, parent, file_name, trajectory, color, point_size=0.1):
+        super().__init__()
+        self.parent = parent
+        self.file_name = file_name
+        self.trajectory = trajectory
+        self.alive = np.ones(len(self.points), dtype=bool)  # 删除的位姿只做标记，便于撤销
+        self.selected = np.zeros(len(self.points), dtype=bool)
+        self.point_size = point_size
+
+        self.color = color
+        self.pen = QPen(color, point_size)
+        self.pen.setCapStyle(Qt.RoundCap)  # 圆形端点，效果与原来的椭圆一致
+        self.selected_pen = QPen(QColor('black'), point_size * 1.6)
+        self.selected_pen.setCapStyle(Qt.RoundCap)
+
+        self.bounds = QRectF()
+        # 绘制按空间瓦片组织: 瓦片边长随缩放取 2 的幂 (米)，只为可见的瓦片生成 QPolygonF，
+        # 缓存的瓦片超过 max_tiles 个时丢弃最久未用的，内存和绘制耗时只与可见范围有关
+        self.tile_cache = OrderedDict()  # (显示级别, 瓦片边长, 列, 行) -> [(颜色分级, QPolygonF)]
+        self.tile_indexes = OrderedDict()  # 瓦片边长 -> 以瓦片为格子的 GridIndex
+        self.tile_pixels = 256  # 瓦片在屏幕上的大致边长
+        self.max_tiles = 256
+        self.max_tile_indexes = 2
+        self.display_cache = {}  # 显示级别 -> 绘制的位姿掩码
+        self.display_decimation = False  # 缩小时只绘制简化后的位姿 (仅影响显示)
+        self.color_bins = None  # 按位姿着色时每个位姿的颜色分级 (如比较模式的偏差)，None 时统一用 pen
+        self.bin_pens = []
+        self.index = None  # 空间索引，第一次查询时建立
+
+        # 使项可接收焦点 (Delete 键) 并只重绘暴露区域
         self.setFlag(QGraphicsItem.ItemIsFocusable)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.update_geometry()
+
+    @property
+    def points(self):
+        return self.trajectory.points
+
+    def update_geometry(self):
+        # 整条轨迹变化后重新计算包围盒并丢弃全部绘制缓存
+        self.update_bounds()
+        self.tile_cache.clear()
+        self.tile_indexes.clear()
+        self.display_cache = {}
+        self.update()
+
+    def update_bounds(self):
+        self.prepareGeometryChange()
+        live_points = self.points[self.alive]
+        self.bounds = self.rect_of(live_points) if len(live_points) else QRectF()
+        if self.scene() is not None:
+            # 构造时还没有加入场景和图层列表，由 add_layer (或加载预览) 加入后再更新场景范围
+            self.parent.update_scene_extent()
+
+    def rect_of(self, points):
+        margin = self.point_size
+        x_min, y_min = points.min(axis=0)
+        x_max, y_max = points.max(axis=0)
+        return QRectF(x_min - margin, y_min - margin, x_max - x_min + 2 * margin, y_max - y_min + 2 * margin)
+
+    def drop_tiles_at(self, points):
+        # 丢弃包含这些坐标的已缓存瓦片 (所有级别)
+        if not self.tile_cache or not len(points):
+            return
+        stale = set()
+        for tile_size in {key[1] for key in self.tile_cache}:
+            cells = np.unique(np.floor(points / tile_size).astype(np.int64), axis=0)
+            stale.update((tile_size, col, row) for col, row in cells.tolist())
+        for key in [key for key in self.tile_cache if key[1:] in stale]:
+            del self.tile_cache[key]
+
+    def drop_decimated_tiles(self):
+        # 简化显示的位姿与坐标和删除标记都有关，有变化时整体丢弃
+        self.display_cache = {level: mask for level, mask in self.display_cache.items() if level is None}
+        for key in [key for key in self.tile_cache if key[0] is not None]:
+            del self.tile_cache[key]
+
+    def set_trajectory(self, trajectory, alive=None):
+        # 替换整条轨迹 (如重采样后位姿数变化)
+        self.trajectory = trajectory
+        self.alive = np.ones(len(trajectory), dtype=bool) if alive is None else alive
+        self.selected = np.zeros(len(trajectory), dtype=bool)
+        self.color_bins = None
+        self.update_geometry()
+        self.parent.layer_changed(self)
+
+    def set_color_bins(self, bins, colors=None):
+        # bins: 每个位姿的颜色分级 (uint8)，colors: 各级的颜色；bins 为 None 时恢复图层颜色
+        self.color_bins = bins
+        if colors is not None:
+            self.bin_pens = []
+            for color in colors:
+                pen = QPen(color, self.point_size)
+                pen.setCapStyle(Qt.RoundCap)
+                self.bin_pens.append(pen)
+        self.tile_cache.clear()
+        self.update()
+
+    def set_display_decimation(self, enabled):
+        self.display_decimation = enabled
+        self.update()
+
+    def display_mask(self, lod, draft=0):
+        # 返回 (显示级别, 绘制的位姿掩码)
+        # 缩小到一个像素比点的半径还大时，沿轨迹每个像素 (取 2 的幂) 只画一个位姿；编辑仍使用全部位姿。
+        # 交互中 (draft > 0) 不论是否开启都抽稀，每 2^(draft-1) 个像素一个位姿
+        level = None
+        pixel = 2 ** max(draft - 1, 0) / lod if lod > 0 else 0
+        if (self.display_decimation or draft) and lod > 0 and pixel > self.point_size / 2:
+            level = math.floor(math.log2(pixel))
+        mask = self.display_cache.get(level)
+        if mask is None:
+            if level is None:
+                mask = self.alive
+            else:
+                indices = np.flatnonzero(self.alive)
+                mask = np.zeros(len(self.points), dtype=bool)
+                mask[indices[decimate_by_arc_length(self.points[indices], 2.0 ** level)]] = True
+            self.display_cache[level] = mask
+        return level, mask
+
+    def tile_size_for(self, lod):
+        return 2.0 ** math.ceil(math.log2(self.tile_pixels / lod))
+
+    def get_tile_index(self, tile_size):
+        index = self.tile_indexes.get(tile_size)
+        if index is None:
+            index = self.tile_indexes[tile_size] = GridIndex(self.points, cell_size=tile_size)
+            while len(self.tile_indexes) > self.max_tile_indexes:
+                self.tile_indexes.popitem(last=False)
+        else:
+            self.tile_indexes.move_to_end(tile_size)
+        return index
+
+    def tile_polygons(self, level, mask, tile_size, col, row):
+        # 瓦片内的位姿，按颜色分级拆成多个 QPolygonF
+        key = (level, tile_size, col, row)
+        polygons = self.tile_cache.get(key)
+        if polygons is not None:
+            self.tile_cache.move_to_end(key)
+            return polygons
+        # 瓦片范围 [x, x + tile_size)，右边界和上边界上的点属于相邻瓦片
+        x_min, y_min = col * tile_size, row * tile_size
+        x_max = np.nextafter(x_min + tile_size, -np.inf)
+        y_max = np.nextafter(y_min + tile_size, -np.inf)
+        indices = self.get_tile_index(tile_size).query_rect(x_min, y_min, x_max, y_max, mask)
+        if self.color_bins is None:
+            polygons = [(None, points_to_polygon(self.points[indices]))]
+        else:
+            bins = self.color_bins[indices]
+            polygons = [(int(level_bin), points_to_polygon(self.points[indices[bins == level_bin]]))
+                        for level_bin in np.unique(bins)]
+        self.tile_cache[key] = polygons
+        while len(self.tile_cache) > self.max_tiles:
+            self.tile_cache.popitem(last=False)
+        return polygons
+
+    def set_color(self, color):
+        # 只需重绘本图层
+        self.color = color
+        self.pen.setColor(color)
+        self.update()
+
+    def get_index(self):
+        if self.index is None or self.index.points is not self.points:
+            self.index = GridIndex(self.points)
+        return self.index
+
+    def set_points(self, indices, points):
+        # 只丢弃移动前后所在的瓦片；包围盒只扩大 (删除或替换轨迹时才重新计算)，拖动时无需遍历全部位姿
+        if len(indices) > len(self.points) // 4:
+            # 大范围的批量修改 (如整条轨迹的变换): 直接重建包围盒和全部绘制缓存，比逐个找出受影响的瓦片更快
+            self.points[indices] = points
+            if self.index is not None:
+                self.index.update(indices)
+            self.trajectory.mark_modified(indices)
+            self.update_geometry()
+            self.parent.layer_changed(self, indices)
+            return
+        old_points = self.points[indices]
+        self.points[indices] = points
+        new_points = self.points[indices]
+        if self.index is not None:
+            self.index.update(indices)
+        for tile_index in self.tile_indexes.values():
+            tile_index.update(indices)
+        self.trajectory.mark_modified(indices)
+
+        self.drop_tiles_at(old_points)
+        self.drop_tiles_at(new_points)
+        # 未开启简化显示时也可能有交互中 (草图级别) 抽稀的缓存，同样丢弃
+        self.drop_decimated_tiles()
+        if len(new_points):
+            rect = self.rect_of(new_points)
+            if not self.bounds.contains(rect):
+                self.prepareGeometryChange()
+                self.bounds = self.bounds.united(rect) if not self.bounds.isEmpty() else rect
+                self.parent.update_scene_extent()
+        self.parent.layer_changed(self, indices)
+        self.update()
+
+    def set_alive(self, indices, alive):
+        self.alive[indices] = alive
+        self.selected[indices] = False
+        self.trajectory.mark_modified(indices)
+        self.update_bounds()
+        self.drop_tiles_at(self.points[indices])
+        self.drop_decimated_tiles()
+        self.parent.layer_changed(self, indices)
+        self.update()
+
+    def selected_indices(self):
+        return np.flatnonzero(self.alive & self.selected)
+
+    def nbytes(self):
+        # 图层自身 (标记、绘制缓存、空间索引) 的大致内存占用，不含轨迹数据
+        size = self.alive.nbytes + self.selected.nbytes
+        size += sum(polygon.size() * 16 for polygons in self.tile_cache.values() for _, polygon in polygons)
+        size += sum(mask.nbytes for mask in self.display_cache.values() if mask is not self.alive)
+        for index in [self.index] + list(self.tile_indexes.values()):
+            if index is not None:
+                size += index.nbytes()
+        return size
+
+    def clear_selection(self):
+        if self.selected.any():
+            self.selected[:] = False
+            self.update()
+
+    def hit_test(self, pos):
+        # 返回 pos 处 (点半径内) 最近的未删除位姿索引
+        index, _ = self.get_index().nearest(pos.x(), pos.y(), self.point_size / 2, self.alive)
+        return index
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget=None):
+        with profiler.timer('paint:' + self.file_name):
+            self.paint_points(painter, option, draft_level(widget))
+
+    def paint_points(self, painter, option, draft=0):
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        margin = self.point_size
+        exposed = option.exposedRect.adjusted(-margin, -margin, margin, margin).intersected(self.bounds)
+        if lod <= 0 or exposed.isEmpty():
+            return
+        level, mask = self.display_mask(lod, draft)
+
+        # 只取与暴露区域相交的瓦片
+        tile_size = self.tile_size_for(lod)
+        cols = range(math.floor(exposed.left() / tile_size), math.floor(exposed.right() / tile_size) + 1)
+        rows = range(math.floor(exposed.top() / tile_size), math.floor(exposed.bottom() / tile_size) + 1)
+        polygons = [polygon for row in rows for col in cols
+                    for polygon in self.tile_polygons(level, mask, tile_size, col, row)]
+
+        selected = self.selected_indices()
+        if len(selected):
+            points = self.points[selected]
+            xs, ys = points[:, 0], points[:, 1]
+            visible = ((xs >= exposed.left()) & (xs <= exposed.right())
+                       & (ys >= exposed.top()) & (ys <= exposed.bottom()))
+            painter.setPen(self.selected_pen)
+            painter.drawPoints(points_to_polygon(points[visible]))
+
+        for level_bin, polygon in polygons:
+            if polygon.size():
+                painter.setPen(self.pen if level_bin is None else self.bin_pens[level_bin])
+                painter.drawPoints(polygon)
 
     def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            self.parent.record_initial_position(self, self.pos())
-        super().mousePressEvent(event)
+        index = self.hit_test(event.scenePos()) if event.button() == Qt.LeftButton else None
+        if index is None:
+            event.ignore()  # 交给下面的图层或视图 (拖动画布)
+            return
+        self.setFocus()
+        self.parent.record_initial_position(self, index, event.scenePos(), event.modifiers())
+
+    def mouseMoveEvent(self, event):
+        self.parent.move_selected_poses(event.scenePos())
 
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton:
-            self.parent.record_final_position_and_store_undo(self, self.pos())
-        super().mouseReleaseEvent(event)
+            self.parent.record_final_position_and_store_undo(event.scenePos())
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Delete:
-            self.parent.delete_item(self)
+            self.parent.delete_selected_poses()
         else:
             super().keyPressEvent(event)
 
 
+class WorkerSignals(QObject):
+    # 后台加载/保存完成的通知 (文件名, Future)，跨线程发射时自动排队到 GUI 线程
+    loaded = pyqtSignal(str, object)
+    saved = pyqtSignal(str, object)
+    map_loaded = pyqtSignal(str, object)
+    indexed = pyqtSignal(str, object)
+    compared = pyqtSignal(str, object)
+    exported = pyqtSignal(str, object)
+
+
+class MinimapWidget(QWidget):
+    # 概览小地图: 全部已加载轨迹 (和栅格地图) 降采样后的缓存图像，叠加当前视口的矩形；
+    # 点击或拖动跳转到该位置。图层修改时只增量更新栅格计数，下次绘制时才重新合成图像
+    def __init__(self, editor):
+        super().__init__()
+        self.editor = editor
+        self.raster = MinimapRaster()
+        self.pixmap = None  # 合成后的缓存图像，为 None 时下次绘制重新合成
+        self.map_image = None  # (栅格地图图形项, 最粗一级的 QImage)
+        self.viewport_pen = QPen(QColor(220, 0, 0), 1)
+        self.setMinimumSize(160, 160)
+
+    def invalidate(self):
+        self.pixmap = None
+        self.update()
+
+    def set_extent(self, rect):
+        # 场景范围变化时所有图层按新的像素重新栅格化
+        if self.raster.set_extent(rect.x(), rect.y(), rect.width(), rect.height()):
+            for layer in self.editor.trajectory_layers.values():
+                self.raster.set_layer(layer.file_name, layer.points, layer.alive)
+            self.invalidate()
+
+    def update_layer(self, layer, indices=None):
+        if self.raster.extent is None:
+            return
+        if indices is None or layer.file_name not in self.raster.pixels:
+            self.raster.set_layer(layer.file_name, layer.points, layer.alive)
+        else:
+            indices = np.arange(len(layer.points))[indices]
+            self.raster.update_layer(layer.file_name, indices, layer.points[indices], layer.alive[indices])
+        self.invalidate()
+
+    def remove_layer(self, file_name):
+        self.raster.remove_layer(file_name)
+        self.invalidate()
+
+    def compose(self):
+        # 白底 -> 栅格地图最粗一级 -> 各可见图层的占用像素
+        raster = self.raster
+        layers = [(name, layer.color.getRgb()[:3]) for name, layer in self.editor.trajectory_layers.items()
+                  if layer.isVisible()]
+        pixels = raster.compose(layers, background=(0, 0, 0, 0))
+        image = QImage(pixels.data, raster.width, raster.height, raster.width * 4, QImage.Format_RGBA8888)
+        pixmap = QPixmap(raster.width, raster.height)
+        pixmap.fill(Qt.white)
+        painter = QPainter(pixmap)
+        map_item = self.editor.map_item
+        if map_item is not None:
+            if self.map_image is None or self.map_image[0] is not map_item:
+                pyramid = map_item.pyramid
+                top = pyramid.level_count() - 1
+                coarse = pyramid.tile(top, 0, 0, max(pyramid.levels[top].shape))
+                height, width = coarse.shape
+                self.map_image = (map_item, QImage(coarse.tobytes(), width, height, width,
+                                                   QImage.Format_Grayscale8).copy())
+            x0, y0, pixel = raster.extent
+            scene_to_pixel = QTransform(1 / pixel, 0, 0, 1 / pixel, -x0 / pixel, -y0 / pixel)
+            painter.setTransform(map_item.sceneTransform() * scene_to_pixel)
+            painter.drawImage(map_item.boundingRect(), self.map_image[1])
+            painter.resetTransform()
+        painter.drawImage(0, 0, image)
+        painter.end()
+        self.pixmap = pixmap
+
+    def image_rect(self):
+        # 缓存图像在控件中的位置 (保持比例居中)
+        scale = min(self.width() / self.raster.width, self.height() / self.raster.height)
+        width, height = self.raster.width * scale, self.raster.height * scale
+        return QRectF((self.width() - width) / 2, (self.height() - height) / 2, width, height)
+
+    def paintEvent(self, event):
+        if self.raster.extent is None:
+            return
+        if self.pixmap is None:
+            with profiler.timer('minimap_compose'):
+                self.compose()
+        painter = QPainter(self)
+        target = self.image_rect()
+        painter.drawPixmap(target, self.pixmap, QRectF(self.pixmap.rect()))
+
+        # 当前视口在场景中的范围
+        view = self.editor.graphics_view
+        visible = view.mapToScene(view.viewport().rect()).boundingRect()
+        scale = target.width() / self.raster.width
+        left, top = self.raster.scene_to_pixel(visible.left(), visible.top())
+        right, bottom = self.raster.scene_to_pixel(visible.right(), visible.bottom())
+        painter.setPen(self.viewport_pen)
+        painter.setClipRect(target)
+        painter.drawRect(QRectF(target.x() + left * scale, target.y() + top * scale,
+                                max((right - left) * scale, 2), max((bottom - top) * scale, 2)))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.jump_to(event.pos())
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton:
+            self.jump_to(event.pos())
+
+    def jump_to(self, pos):
+        if self.raster.extent is None:
+            return
+        target = self.image_rect()
+        scale = target.width() / self.raster.width
+        x, y = self.raster.pixel_to_scene((pos.x() - target.x()) / scale, (pos.y() - target.y()) / scale)
+        self.editor.graphics_view.centerOn(QPointF(x, y))
+        self.update()
+
+
+class ComparisonDialog(QDialog):
+    # 比较模式的设置和结果 (非模态): 选择参考/候选轨迹和容差，显示统计量和超出容差的区段
+    max_listed_segments = 1000
+
+    def __init__(self, editor):
+        super().__init__(editor)
+        self.editor = editor
+        self.setWindowTitle("比较轨迹")
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+        self.reference_combo = QComboBox(self)
+        self.candidate_combo = QComboBox(self)
+        self.tolerance_spin = QDoubleSpinBox(self)
+        self.tolerance_spin.setDecimals(3)
+        self.tolerance_spin.setRange(0.001, 100.0)
+        self.tolerance_spin.setSingleStep(0.05)
+        self.tolerance_spin.setValue(0.2)
+        self.tolerance_spin.setSuffix(" m")
+        self.tolerance_spin.valueChanged.connect(self.editor.set_comparison_tolerance)
+        form.addRow("参考轨迹", self.reference_combo)
+        form.addRow("候选轨迹", self.candidate_combo)
+        form.addRow("容差", self.tolerance_spin)
+        layout.addLayout(form)
+
+        button_layout = QHBoxLayout()
+        compare_button = QPushButton("比较", self)
+        compare_button.clicked.connect(self.start)
+        end_button = QPushButton("结束比较", self)
+        end_button.clicked.connect(self.editor.end_comparison)
+        button_layout.addWidget(compare_button)
+        button_layout.addWidget(end_button)
+        layout.addLayout(button_layout)
+
+        self.stats_label = QLabel(self)
+        layout.addWidget(self.stats_label)
+        self.segment_list = QListWidget(self)
+        self.segment_list.itemClicked.connect(self.on_segment_clicked)
+        layout.addWidget(self.segment_list)
+        self.show_report(None, [])
+
+    def refresh_files(self):
+        for combo in (self.reference_combo, self.candidate_combo):
+            current = combo.currentText()
+            combo.clear()
+            combo.addItems(list(self.editor.trajectory_layers))
+            if current in self.editor.trajectory_layers:
+                combo.setCurrentText(current)
+        if self.reference_combo.currentIndex() == self.candidate_combo.currentIndex() and self.candidate_combo.count() > 1:
+            self.candidate_combo.setCurrentIndex(1)
+
+    def start(self):
+        reference = self.reference_combo.currentText()
+        candidate = self.candidate_combo.currentText()
+        if reference and candidate:
+            self.editor.start_comparison(reference, candidate, self.tolerance_spin.value())
+
+    def show_report(self, stats, segments):
+        self.segment_list.clear()
+        if stats is None:
+            self.stats_label.setText("未在比较")
+            return
+        self.stats_label.setText(f"位姿数 {stats['count']}  最大 {stats['max']:.3f} m  平均 {stats['mean']:.3f} m  "
+                                 f"P95 {stats['p95']:.3f} m  超差区段 {len(segments)}")
+        # 偏差最大的区段排在前面，只列出前 max_listed_segments 个
+        for start, end, maximum in sorted(segments, key=lambda segment: -segment[2])[:self.max_listed_segments]:
+            item = QListWidgetItem(f"位姿 {start}-{end}  最大偏差 {maximum:.3f} m")
+            item.setData(Qt.UserRole, (start, end))
+            self.segment_list.addItem(item)
+
+    def on_segment_clicked(self, item):
+        self.editor.select_deviation_segment(*item.data(Qt.UserRole))
+
+
 class MapEditor(QMainWindow):
-    def __init__(self):
+    def __init__(self, undo_max_depth=1000, undo_max_bytes=256 * 1024 * 1024):
         super().__init__()
         self.setWindowTitle("Map Editor")
         self.setGeometry(100, 100, 1200, 600)
 
         # 初始化变量
         self.root_dir = ""
-        self.path_data_list = []
-        self.undo_stack = []
-
-        # 初始化删除操作的栈和集合
-        self.deleted_items_stack = []
-        self.deleted_items_set = set()
+        self.trajectories = {}  # 文件名 -> Trajectory
+        self.trajectory_layers = {}  # 文件名 -> TrajectoryLayerItem
+        self.next_color_index = 0
+
+        # 日志环形缓冲，每 log_interval 毫秒批量刷新到日志控件
+        self.log_capacity = 2000
+        self.log_lines = deque(maxlen=self.log_capacity)
+        self.pending_log_count = 0
+        self.log_timer = QTimer(self)
+        self.log_timer.setSingleShot(True)
+        self.log_timer.setInterval(200)
+        self.log_timer.timeout.connect(self.flush_log)
+        # 撤销/重做栈，超过条数或内存上限时丢弃最早的记录
+        self.command_stack = CommandStack(undo_max_depth, undo_max_bytes)
+
+        # 后台加载和保存在进程池中并行执行
+        self.executor = None
+        self.pending_loads = {}  # 文件名 -> Future
+        self.pending_saves = {}  # 文件名 -> (Future, 保存的轨迹, 保存时的版本, 编辑日志的保存记号)
+        self.load_total = 0
+        self.worker_signals = WorkerSignals()
+        self.worker_signals.loaded.connect(self.on_file_loaded)
+        self.worker_signals.saved.connect(self.on_file_saved)
+        self.worker_signals.map_loaded.connect(self.on_map_loaded)
+        self.worker_signals.exported.connect(self.on_layer_exported)
+
+        # 目录索引: 文件列表显示缓存的元数据，变化的文件在后台重新建立索引，目录变化时由 folder_watcher 通知
+        self.folder_index = None
+        self.pending_index = {}  # 文件名 -> Future
+        self.index_total = 0
+        self.thumbnail_icons = {}  # (文件名, 修改时间) -> QIcon
+        self.preview_item = None  # 文件列表当前项的缩略折线
+        self.worker_signals.indexed.connect(self.on_file_indexed)
+        self.folder_watcher = QFileSystemWatcher(self)
+        self.folder_watcher.directoryChanged.connect(lambda: self.folder_rescan_timer.start())
+        self.folder_rescan_timer = QTimer(self)  # 合并短时间内的多次目录变化
+        self.folder_rescan_timer.setSingleShot(True)
+        self.folder_rescan_timer.setInterval(500)
+        self.folder_rescan_timer.timeout.connect(self.rescan_folder)
+        self.file_list_timer = QTimer(self)  # 批量刷新文件列表
+        self.file_list_timer.setSingleShot(True)
+        self.file_list_timer.setInterval(200)
+        self.file_list_timer.timeout.connect(self.refresh_file_list)
+        self.index_save_timer = QTimer(self)
+        self.index_save_timer.setSingleShot(True)
+        self.index_save_timer.setInterval(2000)
+        self.index_save_timer.timeout.connect(self.save_folder_index)
+
+        # 比较模式: 候选轨迹按到参考轨迹的偏差着色；全量计算在后台进程中，
+        # 候选轨迹的小范围编辑 (拖动、删除) 在本进程中只重新计算改动的位姿
+        self.comparison = None  # {'reference', 'candidate', 'tolerance', 'distances', 'future', ...}
+        self.comparison_dialog = None
+        self.incremental_compare_limit = 50000
+        self.worker_signals.compared.connect(self.on_trajectories_compared)
+        self.compare_timer = QTimer(self)  # 参考轨迹或大范围修改后，合并多次修改再重新计算
+        self.compare_timer.setSingleShot(True)
+        self.compare_timer.setInterval(300)
+        self.compare_timer.timeout.connect(self.start_comparison_job)
+        self.comparison_stats_timer = QTimer(self)  # 统计量和超差区段的刷新
+        self.comparison_stats_timer.setSingleShot(True)
+        self.comparison_stats_timer.setInterval(200)
+        self.comparison_stats_timer.timeout.connect(self.update_comparison_report)
+
+        # 编辑日志: 每条编辑命令追加到本次会话的日志，分批 fsync；异常退出后下次启动时可在原文件上重放恢复
+        self.journal = None
+        self.command_stack.listener = self.journal_command
+        self.journal_sync_timer = QTimer(self)  # 编辑后至多这么久写入磁盘
+        self.journal_sync_timer.setSingleShot(True)
+        self.journal_sync_timer.setInterval(1000)
+        self.journal_sync_timer.timeout.connect(self.sync_journal)
+        QTimer.singleShot(0, self.offer_journal_recovery)
+
+        # 栅格地图背景 (同一时间一张)，金字塔在后台进程中建立
+        self.map_item = None
+        self.pending_map = None
+
+        # 流式加载: 后台进程每解析出一块位姿就放入 stream_queue，定时取出并先作为预览图层显示
+        self.stream_queue = None  # 与进程池一起创建
+        self.stream_futures = []  # 已提交的流式解析任务，全部结束前持续取出队列 (含已取消加载的块)
+        self.stream_serial = 0
+        self.streaming_loads = {}  # 文件名 -> {'key', 'color', 'chunks', 'items', 'result'}
+        self.stream_timer = QTimer(self)
+        self.stream_timer.setInterval(50)
+        self.stream_timer.timeout.connect(self.receive_stream_chunks)
+
+        # 拖动中的位姿: [(图层, 索引数组, 初始坐标)]
+        self.drag_start_pos = None
+        self.drag_origins = []
+        self.drag_anchor = None  # 按下的位姿 (图层, 索引, 初始坐标)，吸附时以它为准
+        self.drag_delta = (0.0, 0.0)
+        self.snap_pixels = 10  # 吸附半径 (屏幕像素)
 
         # 创建主布局
         central_widget = QWidget()
@@ -116,10 +1019,24 @@ class MapEditor(QMainWindow):
         top_layout.addLayout(map_layout)
 
         # 图形视图
-        self.scene = QGraphicsScene(-100, -100, 200, 200)  # 设置场景大小为200x200米
+        # 场景至少为 200x200 米，加载数据后随所有图层的包围盒自动扩大 (update_scene_extent)
+        self.default_scene_rect = QRectF(-100, -100, 200, 200)
+        self.scene = QGraphicsScene(self.default_scene_rect)
         self.graphics_view = CustomGraphicsView(self.scene, self)
+        self.graphics_view.background_clicked.connect(self.on_background_clicked)
+        self.graphics_view.rect_selected.connect(self.select_poses_in_rect)
+        self.graphics_view.lasso_selected.connect(self.select_poses_in_polygon)
+        self.graphics_view.interaction_finished.connect(self.report_interaction)
+        self.graphics_view.interaction_finished.connect(lambda *_: self.minimap.update())
         map_layout.addWidget(self.graphics_view)
 
+        # 概览小地图 (可停靠)，平移和跳转只需重绘这张缓存图像
+        self.minimap = MinimapWidget(self)
+        self.minimap_dock = QDockWidget("概览", self)
+        self.minimap_dock.setWidget(self.minimap)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.minimap_dock)
+        self.minimap.set_extent(self.scene.sceneRect())
+
         # 添加网格项
         self.grid_item = GridItem(grid_size=0.05, width=200, height=200)
         self.scene.addItem(self.grid_item)
@@ -136,9 +1053,52 @@ class MapEditor(QMainWindow):
 
         # 文件列表
         self.file_list_widget = QListWidget()
-        self.file_list_widget.itemClicked.connect(self.load_yaml_files)
+        self.file_list_widget.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.file_list_widget.itemDoubleClicked.connect(self.load_yaml_files)  # 单击只选择，多选后用"加载所选"
+        self.file_list_widget.currentItemChanged.connect(self.show_file_preview)
         control_layout.addWidget(self.file_list_widget)
 
+        # 文件列表的过滤和排序 (使用目录索引，不解析文件)
+        self.file_filter_edit = QLineEdit()
+        self.file_filter_edit.setPlaceholderText("按名称过滤")
+        self.file_filter_edit.textChanged.connect(self.refresh_file_list)
+        control_layout.addWidget(self.file_filter_edit)
+
+        sort_layout = QHBoxLayout()
+        self.file_sort_combo = QComboBox()
+        for label, key in (("名称", 'name'), ("位姿数", 'poses'), ("长度", 'length'), ("修改时间", 'mtime')):
+            self.file_sort_combo.addItem(label, key)
+        self.file_sort_combo.currentIndexChanged.connect(self.refresh_file_list)
+        sort_layout.addWidget(self.file_sort_combo)
+        self.file_sort_descending_checkbox = QCheckBox("降序")
+        self.file_sort_descending_checkbox.toggled.connect(self.refresh_file_list)
+        sort_layout.addWidget(self.file_sort_descending_checkbox)
+        control_layout.addLayout(sort_layout)
+
+        self.region_filter_checkbox = QCheckBox("只显示视野内的文件")
+        self.region_filter_checkbox.toggled.connect(self.refresh_file_list)
+        self.graphics_view.horizontalScrollBar().valueChanged.connect(self.on_view_changed)
+        self.graphics_view.verticalScrollBar().valueChanged.connect(self.on_view_changed)
+        control_layout.addWidget(self.region_filter_checkbox)
+
+        load_selected_button = QPushButton("加载所选", self)
+        load_selected_button.clicked.connect(self.load_selected_files)
+        control_layout.addWidget(load_selected_button)
+
+        # 已加载图层列表 (勾选控制显示/隐藏)
+        self.layer_list_widget = QListWidget()
+        self.layer_list_widget.itemChanged.connect(self.on_layer_item_changed)
+        control_layout.addWidget(self.layer_list_widget)
+
+        layer_button_layout = QHBoxLayout()
+        color_button = QPushButton("颜色", self)
+        color_button.clicked.connect(self.change_layer_color)
+        layer_button_layout.addWidget(color_button)
+        unload_button = QPushButton("卸载", self)
+        unload_button.clicked.connect(self.unload_selected_layer)
+        layer_button_layout.addWidget(unload_button)
+        control_layout.addLayout(layer_button_layout)
+
         # 按钮
         load_button = QPushButton("选择文件夹", self)
         load_button.clicked.connect(self.choose_folder)
@@ -148,6 +1108,21 @@ class MapEditor(QMainWindow):
         save_button.clicked.connect(self.save_yaml_files)
         control_layout.addWidget(save_button)
 
+        # 选择模式和吸附
+        self.selection_mode_combo = QComboBox()
+        for label, mode in (("拖动画布", 'pan'), ("框选", 'rect'), ("套索", 'lasso')):
+            self.selection_mode_combo.addItem(label, mode)
+        self.selection_mode_combo.currentIndexChanged.connect(
+            lambda: self.graphics_view.set_selection_mode(self.selection_mode_combo.currentData()))
+        control_layout.addWidget(self.selection_mode_combo)
+
+        self.snap_checkbox = QCheckBox("吸附到最近位姿")
+        control_layout.addWidget(self.snap_checkbox)
+
+        self.display_decimation_checkbox = QCheckBox("缩小时简化显示")
+        self.display_decimation_checkbox.toggled.connect(self.set_display_decimation)
+        control_layout.addWidget(self.display_decimation_checkbox)
+
         # 状态标签
         self.status_label = QLabel("")
         control_layout.addWidget(self.status_label)
@@ -156,6 +1131,7 @@ class MapEditor(QMainWindow):
         self.log_text_edit = QTextEdit()
         self.log_text_edit.setReadOnly(True)
         self.log_text_edit.setMaximumHeight(100)  # 设置最大高度为100像素
+        self.log_text_edit.document().setMaximumBlockCount(self.log_capacity)
         main_layout.addWidget(self.log_text_edit)
 
         # 启用键盘事件处理
@@ -164,8 +1140,61 @@ class MapEditor(QMainWindow):
         # 添加状态栏
         self.statusBar().showMessage('Ready')
 
+        # 状态栏中的加载进度和取消按钮
+        self.load_progress_bar = QProgressBar()
+        self.load_progress_bar.setMaximumWidth(200)
+        self.load_progress_bar.hide()
+        self.statusBar().addPermanentWidget(self.load_progress_bar)
+        self.cancel_load_button = QPushButton("取消加载", self)
+        self.cancel_load_button.clicked.connect(self.cancel_loading)
+        self.cancel_load_button.hide()
+        self.statusBar().addPermanentWidget(self.cancel_load_button)
+
         # 添加菜单项
         menubar = self.menuBar()
+        file_menu = menubar.addMenu('File')
+        file_menu.addAction(f'导出当前图层为二进制 ({BINARY_SUFFIX})...').triggered.connect(
+            lambda: self.export_current_layer(BINARY_SUFFIX))
+        file_menu.addAction('导出当前图层为 YAML...').triggered.connect(lambda: self.export_current_layer('.yaml'))
+        edit_menu = menubar.addMenu('Edit')
+        edit_menu.addAction('撤销 (Ctrl+Z)').triggered.connect(self.undo_action)
+        edit_menu.addAction('重做 (Ctrl+Shift+Z / Ctrl+Y)').triggered.connect(self.redo_action)
+        edit_menu.addAction('撤销历史上限...').triggered.connect(self.set_undo_limits)
+        edit_menu.addSeparator()
+        edit_menu.addAction('简化轨迹 (Douglas-Peucker)...').triggered.connect(self.simplify_poses)
+        edit_menu.addAction('按间距重采样...').triggered.connect(self.resample_poses)
+        edit_menu.addAction('去除重复位姿...').triggered.connect(self.remove_duplicate_poses)
+        transform_menu = edit_menu.addMenu('变换')
+        transform_menu.addAction('平移...').triggered.connect(self.translate_poses)
+        transform_menu.addAction('旋转...').triggered.connect(self.rotate_poses)
+        transform_menu.addAction('缩放...').triggered.connect(self.scale_poses)
+        transform_menu.addAction('镜像...').triggered.connect(self.mirror_poses)
+        transform_menu.addAction('对齐到网格').triggered.connect(self.snap_poses_to_grid)
+        transform_menu.addAction('刚体变换 (x, y, theta)...').triggered.connect(self.rigid_transform_poses)
+        transform_menu.addSeparator()
+        self.transform_all_action = transform_menu.addAction('作用于全部已加载文件')
+        self.transform_all_action.setCheckable(True)
+        map_menu = menubar.addMenu('Map')
+        map_menu.addAction('打开栅格地图 (map.yaml)...').triggered.connect(self.open_occupancy_map)
+        map_menu.addAction('关闭栅格地图').triggered.connect(self.close_occupancy_map)
+        map_menu.addSeparator()
+        map_menu.addAction(self.minimap_dock.toggleViewAction())
+        compare_menu = menubar.addMenu('Compare')
+        compare_menu.addAction('比较轨迹...').triggered.connect(self.show_comparison_dialog)
+        debug_menu = menubar.addMenu('Debug')
+        overlay_action = debug_menu.addAction('显示性能叠加层')
+        overlay_action.setCheckable(True)
+        overlay_action.toggled.connect(self.set_overlay_visible)
+        adaptive_action = debug_menu.addAction('平移/缩放时降低画质')
+        adaptive_action.setCheckable(True)
+        adaptive_action.setChecked(True)
+        adaptive_action.toggled.connect(self.set_adaptive_quality)
+        debug_menu.addAction('帧预算...').triggered.connect(self.set_frame_budget)
+        opengl_action = debug_menu.addAction('OpenGL 视口 (可用软件光栅化)')
+        opengl_action.setCheckable(True)
+        opengl_action.toggled.connect(lambda enabled: self.set_opengl_viewport(opengl_action, enabled))
+        debug_menu.addAction('导出性能数据...').triggered.connect(self.dump_instrumentation)
+        debug_menu.addAction('清空性能数据').triggered.connect(self.reset_instrumentation)
         help_menu = menubar.addMenu('Help')
         about_action = help_menu.addAction('About')
         about_action.triggered.connect(self.show_about_dialog)
@@ -193,47 +1222,401 @@ class MapEditor(QMainWindow):
         about_dialog.exec_()
 
     def log_message(self, message):
-        self.log_text_edit.append(message)
-
-    def record_initial_position(self, item, pos):
-        # 记录初始位置
-        self.initial_position = pos
-
-    def record_final_position_and_store_undo(self, item, new_pos):
-        # 将初始位置和新位置存储到撤销栈
-        self.undo_stack.append(('move', item, self.initial_position, new_pos))
-        self.log_message(f"Moved item from {self.initial_position} to {new_pos}")
-
-    def delete_item(self, item):
-        # 从场景中移除项并添加到删除栈
-        self.scene.removeItem(item)
-        self.deleted_items_stack.append((item, item.scenePos()))
-        self.deleted_items_set.add(item)
-        self.undo_stack.append(('delete', item))
-        self.log_message(f"Deleted item at position {item.scenePos()}")
+        # 先记入环形缓冲，定时批量写入日志控件，避免每次编辑都追加一次文本
+        self.log_lines.append(message)
+        self.pending_log_count = min(self.pending_log_count + 1, self.log_capacity)
+        if not self.log_timer.isActive():
+            self.log_timer.start()
+
+    def flush_log(self):
+        if self.pending_log_count:
+            lines = list(self.log_lines)[-self.pending_log_count:]
+            self.pending_log_count = 0
+            self.log_text_edit.append('\n'.join(lines))
+
+    def set_overlay_visible(self, visible):
+        self.graphics_view.set_overlay_visible(visible)
+
+    def set_adaptive_quality(self, enabled):
+        self.graphics_view.end_interaction()
+        self.graphics_view.adaptive_quality = enabled
+
+    def set_frame_budget(self):
+        view = self.graphics_view
+        budget, ok = QInputDialog.getInt(self, "帧预算", "平移/缩放时每帧的目标耗时 (毫秒):",
+                                         round(view.frame_budget * 1000), 5, 1000)
+        if ok:
+            view.frame_budget = budget / 1000
+
+    def set_opengl_viewport(self, action, enabled):
+        if not self.graphics_view.set_opengl_viewport(enabled):
+            self.log_message("无法创建 OpenGL 上下文，继续使用默认视口")
+            action.setChecked(False)
+
+    def report_interaction(self, frames, seconds, max_level):
+        # 每次平移/缩放结束后在状态栏显示达到的帧率
+        if frames and seconds > 0:
+            self.statusBar().showMessage(f"平移/缩放 {frames / seconds:.0f} 帧/s "
+                                         f"({frames} 帧 {seconds:.2f}s 草图级别 ≤{max_level})", 5000)
+
+    def dump_instrumentation(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出性能数据", "profile.json", "JSON (*.json)")
+        if not file_path:
+            return
+        profiler.dump(file_path, log=list(self.log_lines))
+        self.log_message(f"性能数据已导出到 {file_path}")
+
+    def reset_instrumentation(self):
+        profiler.reset()
+        self.graphics_view.viewport().update()
+
+    def record_initial_position(self, layer, index, pos, modifiers):
+        # 更新选择 (Ctrl 切换选择状态)，并记录所有已选位姿的初始位置
+        if modifiers & Qt.ControlModifier:
+            layer.selected[index] = not layer.selected[index]
+        elif not layer.selected[index]:
+            self.clear_pose_selection()
+            layer.selected[index] = True
+        layer.update()
+
+        self.drag_start_pos = pos
+        self.drag_anchor = (layer, index, layer.points[index].copy())
+        self.drag_delta = (0.0, 0.0)
+        self.drag_origins = []
+        for selected_layer in self.trajectory_layers.values():
+            indices = selected_layer.selected_indices()
+            if len(indices):
+                self.drag_origins.append((selected_layer, indices, selected_layer.points[indices].copy()))
+
+    def move_selected_poses(self, pos):
+        if self.drag_start_pos is None:
+            return
+        with profiler.timer('drag_move'):
+            self.apply_drag(pos)
+
+    def apply_drag(self, pos):
+        delta = (pos.x() - self.drag_start_pos.x(), pos.y() - self.drag_start_pos.y())
+        if self.snap_checkbox.isChecked() and self.drag_anchor is not None:
+            # 让按下的位姿吸附到附近未被选中的位姿上
+            _, _, anchor_origin = self.drag_anchor
+            target = QPointF(anchor_origin[0] + delta[0], anchor_origin[1] + delta[1])
+            radius = self.snap_pixels / self.graphics_view.transform().m11()
+            nearest_layer, nearest_index, _ = self.nearest_pose(target, radius, exclude_selected=True)
+            if nearest_layer is not None:
+                snapped = nearest_layer.points[nearest_index]
+                delta = (snapped[0] - anchor_origin[0], snapped[1] - anchor_origin[1])
+        self.drag_delta = delta
+        for layer, indices, origin in self.drag_origins:
+            layer.set_points(indices, origin + delta)
+
+    def record_final_position_and_store_undo(self, pos):
+        if self.drag_start_pos is None:
+            return
+        self.move_selected_poses(pos)
+        dx, dy = self.drag_delta
+        drag_origins = self.drag_origins
+        self.drag_start_pos = None
+        self.drag_origins = []
+        self.drag_anchor = None
+        if (dx or dy) and drag_origins:
+            # 所有图层的移动作为一步记录到撤销栈，只保存索引和位移
+            with self.command_stack.group():
+                for layer, indices, _ in drag_origins:
+                    self.command_stack.push(MoveCommand(layer.file_name, indices, (dx, dy)))
+            count = sum(len(indices) for _, indices, _ in drag_origins)
+            self.log_message(f"Moved {count} poses by ({dx:.3f}, {dy:.3f})")
+
+    def delete_selected_poses(self):
+        # 标记已选位姿为删除，作为一步记录到撤销栈
+        count = 0
+        with profiler.timer('delete'), self.command_stack.group():
+            for layer in self.trajectory_layers.values():
+                indices = layer.selected_indices()
+                if len(indices):
+                    layer.set_alive(indices, False)
+                    self.command_stack.push(DeleteCommand(layer.file_name, indices))
+                    count += len(indices)
+        if count:
+            self.log_message(f"Deleted {count} poses")
+
+    def nearest_pose(self, pos, max_distance=None, exclude_selected=False):
+        # 在所有可见图层中查找离 pos 最近的位姿，返回 (图层, 索引, 距离)
+        best = (None, None, None)
+        for layer in self.trajectory_layers.values():
+            if not layer.isVisible():
+                continue
+            mask = layer.alive & ~layer.selected if exclude_selected else layer.alive
+            limit = max_distance if best[2] is None else best[2]
+            index, distance = layer.get_index().nearest(pos.x(), pos.y(), limit, mask)
+            if index is not None and (best[2] is None or distance < best[2]):
+                best = (layer, index, distance)
+        return best
+
+    def select_poses_in_rect(self, rect, modifiers):
+        self.select_poses(lambda layer: layer.get_index().query_rect(
+            rect.left(), rect.top(), rect.right(), rect.bottom(), layer.alive))
+
+    def select_poses_in_polygon(self, polygon, modifiers):
+        vertices = np.array([(point.x(), point.y()) for point in polygon], dtype=np.float64)
+        self.select_poses(lambda layer: layer.get_index().query_polygon(vertices, layer.alive))
+
+    def select_poses(self, query):
+        # 把查询到的位姿加入选择 (不按 Ctrl 时，点击空白处已清除原有选择)
+        count = 0
+        with profiler.timer('select'):
+            for layer in self.trajectory_layers.values():
+                if not layer.isVisible():
+                    continue
+                indices = query(layer)
+                if len(indices):
+                    layer.selected[indices] = True
+                    layer.update()
+                    count += len(indices)
+        self.log_message(f"Selected {count} poses")
+
+    def clear_pose_selection(self):
+        for layer in self.trajectory_layers.values():
+            layer.clear_selection()
+
+    def on_background_clicked(self, modifiers):
+        if not modifiers & Qt.ControlModifier:
+            self.clear_pose_selection()
 
     def keyPressEvent(self, event):
-        if event.key() == Qt.Key_Z and (event.modifiers() & Qt.ControlModifier):
-            self.undo_action()
+        # Ctrl+Z 撤销，Ctrl+Shift+Z 或 Ctrl+Y 重做
+        modifiers = event.modifiers()
+        if event.key() == Qt.Key_Z and (modifiers & Qt.ControlModifier):
+            if modifiers & Qt.ShiftModifier:
+                self.redo_action()
+            else:
+                self.undo_action()
+        elif event.key() == Qt.Key_Y and (modifiers & Qt.ControlModifier):
+            self.redo_action()
         else:
             super().keyPressEvent(event)
 
     def undo_action(self):
-        if not self.undo_stack:
+        command = self.command_stack.undo(self)
+        if command is not None:
+            self.log_message(f"Undo: {command.description()}")
+
+    def redo_action(self):
+        command = self.command_stack.redo(self)
+        if command is not None:
+            self.log_message(f"Redo: {command.description()}")
+
+    def set_undo_limits(self):
+        stack = self.command_stack
+        depth, ok = QInputDialog.getInt(self, "撤销历史上限", "最多保留的操作数:", stack.max_depth, 1, 1000000)
+        if not ok:
             return
+        megabytes, ok = QInputDialog.getInt(self, "撤销历史上限", "最多占用内存 (MB):",
+                                            stack.max_bytes // (1024 * 1024), 1, 65536)
+        if not ok:
+            return
+        stack.set_limits(depth, megabytes * 1024 * 1024)
+        self.log_message(f"撤销历史: {len(stack.undo_commands)} 步 约 {stack.total_bytes / 1024:.0f} KB "
+                         f"(上限 {depth} 步 {megabytes} MB)")
+
+    # 撤销/重做命令通过以下方法按文件名修改图层
+
+    def move_poses(self, file_name, indices, delta):
+        layer = self.trajectory_layers[file_name]
+        layer.set_points(indices, layer.points[indices] + delta)
+
+    def transform_poses(self, file_name, indices, matrix, offset):
+        layer = self.trajectory_layers[file_name]
+        layer.trajectory.transform_orientations(matrix, indices)
+        layer.set_points(indices, layer.points[indices] @ matrix.T + offset)
+
+    def set_poses_alive(self, file_name, indices, alive):
+        self.trajectory_layers[file_name].set_alive(indices, alive)
+
+    def edit_targets(self):
+        # 编辑操作的对象: 有选中的位姿时为各图层的选中位姿，否则为图层列表中当前图层的全部位姿
+        targets = []
+        for layer in self.trajectory_layers.values():
+            indices = layer.selected_indices()
+            if len(indices):
+                targets.append((layer, indices))
+        if not targets:
+            list_item = self.layer_list_widget.currentItem()
+            if list_item is not None:
+                layer = self.trajectory_layers[list_item.text()]
+                targets.append((layer, np.flatnonzero(layer.alive)))
+        if not targets:
+            self.log_message("请先选择位姿或图层")
+        return targets
+
+    def transform_targets(self):
+        # 批量变换的对象: 勾选“作用于全部已加载文件”时为所有图层的全部位姿，否则同 edit_targets
+        if self.transform_all_action.isChecked():
+            targets = [(layer, np.flatnonzero(layer.alive)) for layer in self.trajectory_layers.values()]
+            targets = [(layer, indices) for layer, indices in targets if len(indices)]
+            if not targets:
+                self.log_message("没有已加载的文件")
+            return targets
+        return self.edit_targets()
+
+    def targets_center(self, targets):
+        # 所有对象位姿包围盒的中心，作为旋转、缩放和镜像的默认中心
+        lows = [layer.points[indices].min(axis=0) for layer, indices in targets]
+        highs = [layer.points[indices].max(axis=0) for layer, indices in targets]
+        return (np.min(lows, axis=0) + np.max(highs, axis=0)) / 2
+
+    def ask_numbers(self, title, label, defaults):
+        # 一次输入多个数值 (逗号或空格分隔)，取消或格式错误时返回 None
+        text, ok = QInputDialog.getText(self, title, label, text=", ".join(f"{value:g}" for value in defaults))
+        if not ok:
+            return None
+        try:
+            values = [float(value) for value in text.replace(',', ' ').split()]
+        except ValueError:
+            values = []
+        if len(values) != len(defaults):
+            QMessageBox.warning(self, title, f"需要 {len(defaults)} 个数值")
+            return None
+        return values
+
+    def apply_transform(self, name, targets, matrix, offset):
+        # 每个图层一次向量化计算，全部图层作为一步记录到撤销栈
+        start_time = time.perf_counter()
+        with profiler.timer('transform'), self.command_stack.group(name):
+            for layer, indices in targets:
+                self.transform_poses(layer.file_name, indices, matrix, offset)
+                self.command_stack.push(TransformCommand(layer.file_name, indices, matrix, offset))
+        count = sum(len(indices) for _, indices in targets)
+        self.log_message(f"{name}: {count} 个位姿 耗时={time.perf_counter() - start_time:.3f}s")
+
+    def translate_poses(self):
+        targets = self.transform_targets()
+        if not targets:
+            return
+        values = self.ask_numbers("平移", "dx, dy (米):", (0.0, 0.0))
+        if values:
+            self.apply_transform("平移", targets, np.eye(2), np.array(values))
 
-        action = self.undo_stack.pop()
-
-        if action[0] == 'move':
-            _, item, old_pos, _ = action
-            item.setPos(old_pos)
-            self.log_message(f"Undo move: item moved back to {old_pos}")
-        elif action[0] == 'delete':
-            item, pos = self.deleted_items_stack.pop()
-            self.scene.addItem(item)
-            item.setPos(pos)
-            self.deleted_items_set.remove(item)
-            self.log_message(f"Undo delete: item restored to {pos}")
+    def rotate_poses(self):
+        targets = self.transform_targets()
+        if not targets:
+            return
+        values = self.ask_numbers("旋转", "角度 (度，逆时针), 中心 x, 中心 y:",
+                                  (90.0, *self.targets_center(targets)))
+        if values:
+            angle, cx, cy = values
+            self.apply_transform("旋转", targets, *rotation_about(math.radians(angle), cx, cy))
+
+    def scale_poses(self):
+        targets = self.transform_targets()
+        if not targets:
+            return
+        values = self.ask_numbers("缩放", "倍数, 中心 x, 中心 y:", (1.0, *self.targets_center(targets)))
+        if values:
+            factor, cx, cy = values
+            if factor == 0:
+                QMessageBox.warning(self, "缩放", "倍数不能为 0")
+                return
+            self.apply_transform("缩放", targets, *rotation_about(0.0, cx, cy, factor))
+
+    def mirror_poses(self):
+        targets = self.transform_targets()
+        if not targets:
+            return
+        values = self.ask_numbers("镜像", "镜像轴方向角 (度，0 为水平), 轴上一点 x, y:",
+                                  (90.0, *self.targets_center(targets)))
+        if values:
+            axis_angle, cx, cy = values
+            self.apply_transform("镜像", targets, *mirror_about(math.radians(axis_angle), cx, cy))
+
+    def rigid_transform_poses(self):
+        # 地图重新定原点等场景: p' = R(theta) p + (x, y)
+        targets = self.transform_targets()
+        if not targets:
+            return
+        values = self.ask_numbers("刚体变换", "x, y (米), theta (度):", (0.0, 0.0, 0.0))
+        if values:
+            x, y, theta = values
+            matrix, _ = rotation_about(math.radians(theta))
+            self.apply_transform("刚体变换", targets, matrix, np.array([x, y]))
+
+    def snap_poses_to_grid(self):
+        # 坐标取整到网格间距，各位姿的位移不同，按逐位姿位移记录
+        targets = self.transform_targets()
+        if not targets:
+            return
+        spacing = self.grid_item.grid_size
+        start_time = time.perf_counter()
+        with profiler.timer('transform'), self.command_stack.group("对齐到网格"):
+            for layer, indices in targets:
+                points = layer.points[indices]
+                delta = np.round(points / spacing) * spacing - points
+                moved = np.flatnonzero(np.any(delta != 0, axis=1))
+                if len(moved):
+                    self.move_poses(layer.file_name, indices[moved], delta[moved])
+                    self.command_stack.push(MoveCommand(layer.file_name, indices[moved], delta[moved]))
+        count = sum(len(indices) for _, indices in targets)
+        self.log_message(f"对齐到网格 ({spacing:g} 米): {count} 个位姿 耗时={time.perf_counter() - start_time:.3f}s")
+
+    def filter_poses(self, name, keep_function):
+        # keep_function(坐标数组) 返回保留的位姿，其余位姿作为一次删除操作记录到撤销栈
+        count = 0
+        with self.command_stack.group(name):
+            for layer, indices in self.edit_targets():
+                keep = np.zeros(len(indices), dtype=bool)
+                keep[keep_function(layer.points[indices])] = True
+                removed = indices[~keep]
+                if len(removed):
+                    layer.set_alive(removed, False)
+                    self.command_stack.push(DeleteCommand(layer.file_name, removed))
+                    count += len(removed)
+        self.log_message(f"{name}: 删除 {count} 个位姿")
+
+    def simplify_poses(self):
+        tolerance, ok = QInputDialog.getDouble(self, "简化轨迹", "允许的最大偏差 (米):", 0.05, 0.0, 1000.0, 3)
+        if ok:
+            self.filter_poses("简化轨迹", lambda points: douglas_peucker(points, tolerance))
+
+    def remove_duplicate_poses(self):
+        tolerance, ok = QInputDialog.getDouble(self, "去除重复位姿", "视为重复的距离 (米):", 0.0, 0.0, 1000.0, 3)
+        if ok:
+            self.filter_poses("去除重复位姿", lambda points: remove_duplicates(points, tolerance))
+
+    def resample_poses(self):
+        spacing, ok = QInputDialog.getDouble(self, "按间距重采样", "间距 (米):", 0.1, 0.001, 1000.0, 3)
+        if not ok:
+            return
+        # 位姿数会变化，整条轨迹作为一次替换操作记录到撤销栈
+        count = 0
+        with self.command_stack.group("按间距重采样"):
+            for layer, indices in self.edit_targets():
+                self.resample_layer(layer, indices, spacing)
+                count += len(layer.trajectory)
+        if count:
+            self.log_message(f"按间距重采样: 共 {count} 个位姿")
+
+    def resample_layer(self, layer, indices, spacing):
+        # 对所选范围 (第一个到最后一个所选位姿之间) 的未删除位姿重采样，已删除的位姿不再保留
+        old_trajectory, old_alive = layer.trajectory, layer.alive
+        alive_indices = np.flatnonzero(old_alive)
+        span = alive_indices[(alive_indices >= indices[0]) & (alive_indices <= indices[-1])]
+        points, sources = resample(old_trajectory.points[span], spacing)
+        resampled = Trajectory(old_trajectory.document, old_trajectory.table.take(span[sources]), points)
+        new_trajectory = Trajectory.merge([old_trajectory.take(alive_indices[alive_indices < indices[0]]),
+                                           resampled,
+                                           old_trajectory.take(alive_indices[alive_indices > indices[-1]])])
+        new_alive = np.ones(len(new_trajectory), dtype=bool)
+        self.replace_trajectory(layer.file_name, new_trajectory, new_alive)
+        self.command_stack.push(ReplaceCommand(layer.file_name, old_trajectory, old_alive,
+                                               new_trajectory, new_alive))
+
+    def replace_trajectory(self, file_name, trajectory, alive):
+        trajectory.mark_modified()  # 与文件内容不同，需要保存
+        self.trajectories[file_name] = trajectory
+        self.trajectory_layers[file_name].set_trajectory(trajectory, alive.copy())
+
+    def set_display_decimation(self, enabled):
+        for layer in self.trajectory_layers.values():
+            layer.set_display_decimation(enabled)
 
     def choose_folder(self):
         self.root_dir = QFileDialog.getExistingDirectory(self, "选择目录")
@@ -241,84 +1624,878 @@ class MapEditor(QMainWindow):
             self.load_files()
 
     def load_files(self):
-        self.file_list_widget.clear()
-        for file_name in os.listdir(self.root_dir):
-            if file_name.endswith('.yaml'):
-                self.file_list_widget.addItem(file_name)
+        # 先用已有索引显示文件列表，新的和有变化的文件在后台建立索引
+        if self.folder_index is not None:
+            self.save_folder_index()
+        if self.folder_watcher.directories():
+            self.folder_watcher.removePaths(self.folder_watcher.directories())
+        for future in self.pending_index.values():
+            future.cancel()
+        self.pending_index.clear()
+        self.index_total = 0
+        self.folder_index = FolderIndex(self.root_dir)
+        self.folder_watcher.addPath(self.root_dir)
+        self.rescan_folder()
+
+    def rescan_folder(self):
+        if self.folder_index is None:
+            return
+        try:
+            stale = self.folder_index.refresh()
+        except OSError as error:
+            self.log_message(f"读取目录失败 {self.root_dir}: {error}")
+            return
+        for file_name in stale:
+            if file_name in self.pending_index:
+                continue
+            future = self.get_executor().submit(index_trajectory_file, os.path.join(self.root_dir, file_name))
+            self.pending_index[file_name] = future
+            self.index_total += 1
+            future.add_done_callback(partial(self.worker_signals.indexed.emit, file_name))
+        self.update_index_progress()
+        self.refresh_file_list()
+
+    def on_file_indexed(self, file_name, future):
+        if self.pending_index.get(file_name) is not future:
+            return  # 已切换目录
+        del self.pending_index[file_name]
+        try:
+            entry = future.result()
+        except Exception as error:
+            entry = {'error': str(error)}
+        self.folder_index.update(file_name, entry)
+        self.update_index_progress()
+        self.index_save_timer.start()
+        self.file_list_timer.start()
+
+    def update_index_progress(self):
+        if not self.pending_index:
+            self.index_total = 0
+            if not self.pending_loads:
+                self.statusBar().showMessage('Ready')
+            return
+        done = self.index_total - len(self.pending_index)
+        self.statusBar().showMessage(f"正在建立目录索引 {done}/{self.index_total}...")
 
-    def load_yaml_files(self, item):
-        file_name = item.text()
+    def save_folder_index(self):
+        if self.folder_index is not None:
+            self.folder_index.save()
 
-        # 检查文件是否已存在于 path_data_list 中
-        for existing_file_name, _ in self.path_data_list:
-            if existing_file_name == file_name:
-                return  # 文件已存在，不重复加载
+    def on_view_changed(self):
+        self.minimap.update()
+        if self.region_filter_checkbox.isChecked():
+            self.file_list_timer.start()
 
-        file_path = os.path.join(self.root_dir, file_name)
+    def refresh_file_list(self):
+        # 按过滤和排序条件重建文件列表，保留原有的选择
+        if self.folder_index is None:
+            return
+        region = None
+        if self.region_filter_checkbox.isChecked():
+            view = self.graphics_view
+            rect = view.mapToScene(view.viewport().rect()).boundingRect()
+            region = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        file_names = self.folder_index.query(self.file_filter_edit.text(), region,
+                                             self.file_sort_combo.currentData(),
+                                             self.file_sort_descending_checkbox.isChecked())
+
+        widget = self.file_list_widget
+        selected = {item.data(Qt.UserRole) for item in widget.selectedItems()}
+        current = widget.currentItem().data(Qt.UserRole) if widget.currentItem() is not None else None
+        widget.blockSignals(True)
+        widget.clear()
+        for file_name in file_names:
+            entry = self.folder_index.entries.get(file_name)
+            item = QListWidgetItem(file_name)
+            item.setData(Qt.UserRole, file_name)
+            item.setToolTip(self.describe_index_entry(entry))
+            if entry is not None and entry.get('thumbnail'):
+                item.setIcon(self.thumbnail_icon(file_name, entry))
+            widget.addItem(item)
+            if file_name in selected:
+                item.setSelected(True)
+            if file_name == current:
+                widget.setCurrentItem(item, QItemSelectionModel.NoUpdate)
+        widget.blockSignals(False)
+
+    def describe_index_entry(self, entry):
+        if entry is None:
+            return "正在建立索引..."
+        if 'error' in entry:
+            return f"无法读取: {entry['error']}"
+        modified = QDateTime.fromMSecsSinceEpoch(entry['mtime'] // 1000000).toString('yyyy-MM-dd hh:mm:ss')
+        text = f"位姿数={entry['poses']} 长度={entry['length']:.1f}m 修改时间={modified}"
+        if entry['bounds'] is not None:
+            x0, y0, x1, y1 = entry['bounds']
+            text += f"\n范围=({x0:.1f}, {y0:.1f}) - ({x1:.1f}, {y1:.1f})"
+        return text
+
+    def thumbnail_icon(self, file_name, entry, size=32):
+        # 缩略折线缩放到图标大小绘制，按修改时间缓存
+        key = (file_name, entry['mtime'])
+        icon = self.thumbnail_icons.get(key)
+        if icon is None:
+            points = np.array(entry['thumbnail'], dtype=np.float64).reshape(-1, 2)
+            low, high = points.min(axis=0), points.max(axis=0)
+            scale = (size - 4) / max(float((high - low).max()), 1e-9)
+            points = (points - (low + high) / 2) * scale + size / 2
+            pixmap = QPixmap(size, size)
+            pixmap.fill(Qt.white)
+            painter = QPainter(pixmap)
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setPen(QPen(QColor('black'), 1))
+            painter.drawPolyline(points_to_polygon(points))
+            painter.end()
+            icon = self.thumbnail_icons[key] = QIcon(pixmap)
+        return icon
+
+    def show_file_preview(self, current, previous=None):
+        # 在场景中用虚线显示文件列表当前项的缩略折线，不需要加载文件
+        if self.preview_item is not None:
+            self.scene.removeItem(self.preview_item)
+            self.preview_item = None
+        file_name = current.data(Qt.UserRole) if current is not None else None
+        entry = self.folder_index.entries.get(file_name) if self.folder_index is not None else None
+        if entry is not None and entry.get('thumbnail') and file_name not in self.trajectory_layers:
+            path = QPainterPath()
+            path.addPolygon(points_to_polygon(np.array(entry['thumbnail'], dtype=np.float64).reshape(-1, 2)))
+            pen = QPen(QColor('gray'), 2, Qt.DashLine)
+            pen.setCosmetic(True)
+            self.preview_item = QGraphicsPathItem(path)
+            self.preview_item.setPen(pen)
+            self.preview_item.setZValue(1)
+            self.preview_item.setAcceptedMouseButtons(Qt.NoButton)
+            self.scene.addItem(self.preview_item)
+        self.update_scene_extent()
 
-        with open(file_path, 'r') as file:
-            path_data = yaml.load(file, Loader=yaml.FullLoader)
-            len_path_data = len(path_data['poses'])
-            print_msg = f"加载文件名={file_name} 轨迹长度={len_path_data}"
-            self.log_message(print_msg)
-            self.path_data_list.append((file_name, path_data))
+    def load_yaml_files(self, item):
+        self.start_loading([item.data(Qt.UserRole)])
+
+    def load_selected_files(self):
+        self.start_loading([item.data(Qt.UserRole) for item in self.file_list_widget.selectedItems()])
+
+    def get_executor(self):
+        if self.executor is None:
+            # 流式加载的队列在创建工作进程时传入，块直接经管道发送，不经过 Manager 代理进程再序列化一次
+            context = multiprocessing.get_context('spawn')
+            self.stream_queue = context.Queue()
+            self.executor = ProcessPoolExecutor(mp_context=context, initializer=set_stream_queue,
+                                                initargs=(self.stream_queue,))
+        return self.executor
+
+    def update_scene_extent(self):
+        # 场景范围 = 默认范围与所有图层 (含加载中的预览) 包围盒的并集，数据外留 10% 边距
+        data_rect = QRectF()
+        preview_items = [item for stream in self.streaming_loads.values() for item in stream['items']]
+        rects = [layer.bounds for layer in list(self.trajectory_layers.values()) + preview_items]
+        if self.map_item is not None:
+            rects.append(self.map_item.sceneBoundingRect())
+        if self.preview_item is not None:
+            rects.append(self.preview_item.sceneBoundingRect())
+        for bounds in rects:
+            if not bounds.isEmpty():
+                data_rect = data_rect.united(bounds) if not data_rect.isEmpty() else bounds
+        rect = QRectF(self.default_scene_rect)
+        if not data_rect.isEmpty():
+            margin = max(data_rect.width(), data_rect.height()) * 0.1
+            rect = rect.united(data_rect.adjusted(-margin, -margin, margin, margin))
+        if rect != self.scene.sceneRect():
+            self.scene.setSceneRect(rect)
+            self.grid_item.set_bounds(rect)
+            self.minimap.set_extent(rect)
+
+    def next_color(self):
+        colors = [QColor('red'), QColor('blue'), QColor('green'), QColor('yellow'), QColor('cyan')]
+        color = colors[self.next_color_index % len(colors)]  # 轮询使用颜色
+        self.next_color_index += 1
+        return color
+
+    def start_loading(self, file_names):
+        # 在后台进程中解析文件，界面不阻塞；每个文件完成后立即显示
+        for file_name in file_names:
+            # 检查文件是否已加载或正在加载，不重复加载
+            if file_name in self.trajectory_layers or file_name in self.pending_loads or file_name in self.streaming_loads:
+                continue
 
-        self.display_points()
+            file_path = os.path.join(self.root_dir, file_name)
+            if is_binary_path(file_name):
+                self.open_binary_file(file_name, file_path)
+                continue
+            self.stream_serial += 1
+            key = (file_name, self.stream_serial)
+            self.streaming_loads[file_name] = {'key': key, 'color': self.next_color(), 'chunks': [], 'items': [],
+                                               'result': None, 'start_time': time.perf_counter()}
+            future = self.get_executor().submit(stream_trajectory_timed, file_path, key)
+            self.stream_futures.append(future)
+            self.pending_loads[file_name] = future
+            self.load_total += 1
+            future.add_done_callback(partial(self.worker_signals.loaded.emit, file_name))
+        if self.streaming_loads:
+            self.stream_timer.start()
+        self.update_load_progress()
+
+    def open_binary_file(self, file_name, file_path):
+        # 二进制文件只需内存映射 (Windows 上整个读入)，直接在本进程中打开 (经进程池返回反而要复制全部数组)
+        start_time = time.perf_counter()
+        try:
+            trajectory = Trajectory.load(file_path)
+        except (OSError, ValueError) as error:
+            self.log_message(f"加载失败 文件名={file_name}: {error}")
+            return
+        elapsed = time.perf_counter() - start_time
+        self.log_message(f"加载文件名={file_name} 轨迹长度={len(trajectory)} 格式=二进制 映射耗时={elapsed:.3f}s")
+        self.trajectories[file_name] = trajectory
+        self.display_points(file_name, trajectory)
+        self.journal_file(file_name)
+        profiler.record('load', time.perf_counter() - start_time)
         self.log_message(f"Loaded file: {file_name}")
+        self.log_memory_usage(file_name)
+
+    def receive_stream_chunks(self):
+        # 取出已解析的位姿块，每块作为一个只用于显示的预览图层，无需等整个文件解析完
+        while True:
+            try:
+                (file_name, serial), chunk = self.stream_queue.get_nowait()
+            except queue.Empty:
+                break
+            stream = self.streaming_loads.get(file_name)
+            if stream is None or stream['key'] != (file_name, serial):
+                continue  # 已取消
+            stream['chunks'].append(chunk)
+            item = TrajectoryLayerItem(self, file_name, chunk, stream['color'])
+            item.setAcceptedMouseButtons(Qt.NoButton)
+            item.setFlag(QGraphicsItem.ItemIsFocusable, False)
+            item.set_display_decimation(self.display_decimation_checkbox.isChecked())
+            self.scene.addItem(item)
+            stream['items'].append(item)
+            self.update_scene_extent()
+            if stream['result'] is not None:
+                self.finish_streaming(file_name)
+        self.stream_futures = [future for future in self.stream_futures if not future.done()]
+        if not self.streaming_loads and not self.stream_futures:
+            self.stream_timer.stop()
+
+    def discard_stream(self, file_name):
+        stream = self.streaming_loads.pop(file_name, None)
+        if stream is not None:
+            for item in stream['items']:
+                self.scene.removeItem(item)
+            self.update_scene_extent()
+        return stream
+
+    def on_file_loaded(self, file_name, future):
+        if self.pending_loads.get(file_name) is not future:
+            return  # 已取消
+        del self.pending_loads[file_name]
+        self.update_load_progress()
+
+        try:
+            result = future.result()
+        except Exception as error:
+            self.discard_stream(file_name)
+            self.log_message(f"加载失败 文件名={file_name}: {error}")
+            return
 
-    def display_points(self):
-        # 移除所有已有的点
-        items_to_remove = [item for item in self.scene.items() if isinstance(item, QGraphicsEllipseItem)]
-        for item in items_to_remove:
-            self.scene.removeItem(item)
-
-        # 定义颜色列表
-        colors = [QColor('red'), QColor('blue'), QColor('green'), QColor('yellow'), QColor('cyan')]
+        # 解析完成时可能还有位姿块留在队列中，全部收到后再合并
+        self.streaming_loads[file_name]['result'] = result
+        self.receive_stream_chunks()
+        if file_name in self.streaming_loads:
+            self.finish_streaming(file_name)
 
-        # 显示每个加载文件中的点
-        for idx, (file_name, path_data) in enumerate(self.path_data_list):
-            if not path_data or 'poses' not in path_data:
-                continue
+    def finish_streaming(self, file_name):
+        stream = self.streaming_loads[file_name]
+        document, chunk_count, stat, cache_hit, elapsed = stream['result']
+        if len(stream['chunks']) < chunk_count:
+            return
+        self.discard_stream(file_name)
+        trajectory = Trajectory.merge(stream['chunks'])
+        trajectory.document = dict(document)
+        profiler.record('parse', elapsed)
+        if not cache_hit:
+            # 在编辑之前写入，缓存与文件内容一致
+            with profiler.timer('cache_write'):
+                write_trajectory_cache(os.path.join(self.root_dir, file_name), stat, trajectory)
+
+        len_path_data = len(trajectory)
+        cache_state = "命中" if cache_hit else "未命中"
+        print_msg = f"加载文件名={file_name} 轨迹长度={len_path_data} 缓存={cache_state} 解析耗时={elapsed:.3f}s"
+        self.log_message(print_msg)
+        self.trajectories[file_name] = trajectory
+
+        self.display_points(file_name, trajectory, stream['color'])
+        self.journal_file(file_name)
+        profiler.record('load', time.perf_counter() - stream['start_time'])
+        self.log_message(f"Loaded file: {file_name}")
+        self.log_memory_usage(file_name)
+
+    def log_memory_usage(self, file_name):
+        trajectory = self.trajectories[file_name]
+        layer = self.trajectory_layers[file_name]
+        data_bytes, layer_bytes = trajectory.nbytes(), layer.nbytes()
+        per_pose = (data_bytes + layer_bytes) / max(len(trajectory), 1)
+        self.log_message(f"内存 文件名={file_name} 轨迹数据={data_bytes / 1024 / 1024:.2f}MB "
+                         f"图层={layer_bytes / 1024 / 1024:.2f}MB 每位姿={per_pose:.1f} 字节")
+
+    def cancel_loading(self):
+        # 未开始的任务直接取消，正在解析的任务结果将被丢弃
+        count = len(self.pending_loads)
+        for future in self.pending_loads.values():
+            future.cancel()
+        self.pending_loads.clear()
+        for file_name in list(self.streaming_loads):
+            self.discard_stream(file_name)
+        self.update_load_progress()
+        if count:
+            self.log_message(f"已取消加载 {count} 个文件")
+
+    def update_load_progress(self):
+        if not self.pending_loads:
+            self.load_total = 0
+            self.load_progress_bar.hide()
+            self.cancel_load_button.hide()
+            self.statusBar().showMessage('Ready')
+            return
+        done = self.load_total - len(self.pending_loads)
+        self.load_progress_bar.setRange(0, self.load_total)
+        self.load_progress_bar.setValue(done)
+        self.load_progress_bar.show()
+        self.cancel_load_button.show()
+        self.statusBar().showMessage(f"正在加载 {done}/{self.load_total} 个文件...")
+
+    def closeEvent(self, event):
+        self.save_folder_index()
+        if self.executor is not None:
+            # 等待正在进行的保存完成，避免留下未写完的文件
+            self.executor.shutdown(wait=bool(self.pending_saves), cancel_futures=not self.pending_saves)
+            for file_name, (future, *_) in list(self.pending_saves.items()):
+                self.on_file_saved(file_name, future)
+        if self.journal is not None:
+            # 还有未保存的修改时保留日志，下次启动时可以恢复
+            if any(trajectory.is_dirty for trajectory in self.trajectories.values()):
+                self.journal.close()
+            else:
+                self.journal.discard()
+            self.journal = None
+        super().closeEvent(event)
+
+    def display_points(self, file_name, trajectory, color=None):
+        with profiler.timer('display'):
+            self.add_layer(file_name, trajectory, color)
+
+    def add_layer(self, file_name, trajectory, color=None):
+        # 只为新加载的文件添加一个图层，已有图层 (及其未保存的修改) 保持不变
+        if color is None:
+            color = self.next_color()
+
+        layer = TrajectoryLayerItem(self, file_name, trajectory, color)
+        layer.set_display_decimation(self.display_decimation_checkbox.isChecked())
+        self.scene.addItem(layer)
+        self.trajectory_layers[file_name] = layer
+        self.update_scene_extent()
+        self.show_file_preview(self.file_list_widget.currentItem())  # 已加载的文件不再显示缩略预览
+        self.minimap.update_layer(layer)
+
+        list_item = QListWidgetItem(file_name)
+        list_item.setFlags(list_item.flags() | Qt.ItemIsUserCheckable)
+        list_item.setCheckState(Qt.Checked)
+        list_item.setIcon(self.color_icon(color))
+        self.layer_list_widget.addItem(list_item)
+
+    def color_icon(self, color):
+        pixmap = QPixmap(12, 12)
+        pixmap.fill(color)
+        return QIcon(pixmap)
+
+    def on_layer_item_changed(self, list_item):
+        layer = self.trajectory_layers.get(list_item.text())
+        if layer is None:
+            return
+        visible = list_item.checkState() == Qt.Checked
+        if layer.isVisible() != visible:
+            layer.clear_selection()  # 隐藏的位姿不参与拖动和删除
+            layer.setVisible(visible)
+            self.minimap.invalidate()
+
+    def change_layer_color(self):
+        list_item = self.layer_list_widget.currentItem()
+        if list_item is None:
+            return
+        layer = self.trajectory_layers[list_item.text()]
+        color = QColorDialog.getColor(layer.color, self, "选择颜色")
+        if color.isValid():
+            layer.set_color(color)
+            list_item.setIcon(self.color_icon(color))
+            self.minimap.invalidate()
+
+    def unload_selected_layer(self):
+        list_item = self.layer_list_widget.currentItem()
+        if list_item is None:
+            return
+        file_name = list_item.text()
+        if not self.confirm_unload(file_name):
+            return
+        if self.comparison is not None and file_name in (self.comparison['reference'], self.comparison['candidate']):
+            self.end_comparison()
+        layer = self.trajectory_layers.pop(file_name)
+        self.scene.removeItem(layer)
+        self.layer_list_widget.takeItem(self.layer_list_widget.row(list_item))
+        del self.trajectories[file_name]
+        self.minimap.remove_layer(file_name)
+        self.update_scene_extent()
+
+        # 丢弃撤销栈中属于该图层的记录
+        self.command_stack.discard_file(file_name)
+        if self.journal is not None:
+            self.journal_call(self.journal.close_file, file_name)
+        self.log_message(f"Unloaded file: {file_name}")
+
+    def confirm_unload(self, file_name):
+        # 有未保存的修改时询问: 保存后卸载、放弃修改或取消；卸载后撤销栈和编辑日志中都不再有这些修改
+        if not self.trajectories[file_name].is_dirty:
+            return True
+        answer = QMessageBox.question(self, "卸载图层", f"{file_name} 有未保存的修改，卸载前是否保存?",
+                                      QMessageBox.Save | QMessageBox.Discard | QMessageBox.Cancel, QMessageBox.Save)
+        if answer == QMessageBox.Cancel:
+            return False
+        if answer == QMessageBox.Discard:
+            return True
+        return self.save_file_now(file_name)
+
+    def save_file_now(self, file_name):
+        # 在本进程中同步保存一个文件，返回是否成功；先等待该文件正在进行的后台保存，避免它覆盖较新的内容
+        if file_name in self.pending_saves:
+            future = self.pending_saves[file_name][0]
+            try:
+                future.result()
+            except Exception:
+                pass
+            self.on_file_saved(file_name, future)
+        trajectory = self.trajectories[file_name]
+        if not trajectory.is_dirty:
+            return True
+        layer = self.trajectory_layers[file_name]
+        file_path = os.path.join(self.root_dir, file_name)
+        # 与后台保存一样更新日志中该文件的起点，保存后到卸载前异常退出时日志仍以新文件为起点
+        token = None
+        if self.journal is not None and file_name in self.journal.file_ids:
+            token = self.journal.begin_save(trajectory, layer.alive)
+        try:
+            elapsed = save_trajectory_timed(trajectory.take(layer.alive), file_path)
+        except (OSError, ValueError) as error:
+            self.log_message(f"保存失败 文件名={file_name}: {error}")
+            QMessageBox.warning(self, "卸载图层", f"保存 {file_name} 失败: {error}")
+            return False
+        profiler.record('save', elapsed)
+        trajectory.mark_saved()
+        if token is not None and self.journal is not None:
+            self.journal_call(self.journal.finish_save, file_name, file_path, token)
+        self.log_message(f"保存文件名={file_name} 轨迹长度={int(np.count_nonzero(layer.alive))} 耗时={elapsed:.3f}s")
+        return True
+
+    def show_comparison_dialog(self):
+        if self.comparison_dialog is None:
+            self.comparison_dialog = ComparisonDialog(self)
+        self.comparison_dialog.refresh_files()
+        self.comparison_dialog.show()
+        self.comparison_dialog.raise_()
+
+    def deviation_colors(self):
+        # 绿 (无偏差) 到红 (两倍容差及以上)
+        return [QColor.fromHsvF((1 - level_bin / (DEVIATION_BINS - 1)) / 3, 0.9, 0.9)
+                for level_bin in range(DEVIATION_BINS)]
+
+    def start_comparison(self, reference, candidate, tolerance):
+        if reference == candidate:
+            self.log_message("参考轨迹和候选轨迹不能是同一个文件")
+            return
+        self.end_comparison()
+        self.comparison = {'reference': reference, 'candidate': candidate, 'tolerance': tolerance,
+                           'distances': None, 'future': None, 'reference_points': None, 'index': None}
+        self.start_comparison_job()
+
+    def end_comparison(self):
+        comparison = self.comparison
+        if comparison is None:
+            return
+        self.comparison = None
+        self.compare_timer.stop()
+        if comparison['future'] is not None:
+            comparison['future'].cancel()
+        layer = self.trajectory_layers.get(comparison['candidate'])
+        if layer is not None:
+            layer.set_color_bins(None)
+        if self.comparison_dialog is not None:
+            self.comparison_dialog.show_report(None, [])
+
+    def set_comparison_tolerance(self, tolerance):
+        # 容差只影响着色和区段，不需要重新计算距离
+        if self.comparison is None:
+            return
+        self.comparison['tolerance'] = tolerance
+        if self.comparison['distances'] is not None:
+            self.apply_deviation_colors()
+            self.update_comparison_report()
+
+    def start_comparison_job(self):
+        # 在后台计算候选轨迹全部未删除位姿到参考轨迹的距离
+        comparison = self.comparison
+        if comparison is None:
+            return
+        reference_layer = self.trajectory_layers.get(comparison['reference'])
+        candidate_layer = self.trajectory_layers.get(comparison['candidate'])
+        if reference_layer is None or candidate_layer is None:
+            self.end_comparison()
+            return
+        if comparison['future'] is not None:
+            comparison['future'].cancel()
+        reference = reference_layer.points[reference_layer.alive]
+        candidate_indices = np.flatnonzero(candidate_layer.alive)
+        future = self.get_executor().submit(compare_trajectories_timed, reference,
+                                            candidate_layer.points[candidate_indices])
+        comparison.update(future=future, job_reference=reference, job_indices=candidate_indices,
+                          job_revisions=(reference_layer.trajectory.revision, candidate_layer.trajectory.revision),
+                          job_size=len(candidate_layer.points))
+        self.statusBar().showMessage(f"正在比较 {comparison['candidate']} 与 {comparison['reference']}...")
+        future.add_done_callback(partial(self.worker_signals.compared.emit, comparison['candidate']))
+
+    def on_trajectories_compared(self, file_name, future):
+        comparison = self.comparison
+        if comparison is None or comparison['future'] is not future:
+            return
+        comparison['future'] = None
+        self.statusBar().showMessage('Ready')
+        try:
+            distances, elapsed = future.result()
+        except Exception as error:
+            self.log_message(f"比较失败 文件名={file_name}: {error}")
+            return
+        reference_layer = self.trajectory_layers[comparison['reference']]
+        candidate_layer = self.trajectory_layers[comparison['candidate']]
+        if len(candidate_layer.points) != comparison['job_size']:
+            self.compare_timer.start()  # 计算期间位姿数变了 (如重采样)，结果已不能对应
+            return
 
-            color = colors[idx % len(colors)]  # 轮询使用颜色
+        full_distances = np.full(comparison['job_size'], np.nan)
+        full_distances[comparison['job_indices']] = distances
+        comparison.update(distances=full_distances, reference_points=comparison['job_reference'], index=None)
+        self.apply_deviation_colors()
+        self.update_comparison_report()
+        profiler.record('compare', elapsed)
+        self.log_message(f"比较 候选={comparison['candidate']} 参考={comparison['reference']} "
+                         f"位姿数={len(distances)} 耗时={elapsed:.3f}s")
+        if comparison['job_revisions'] != (reference_layer.trajectory.revision, candidate_layer.trajectory.revision):
+            self.compare_timer.start()  # 计算期间又有修改
+
+    def apply_deviation_colors(self):
+        comparison = self.comparison
+        layer = self.trajectory_layers[comparison['candidate']]
+        layer.set_color_bins(deviation_bins(comparison['distances'], comparison['tolerance']),
+                             self.deviation_colors())
+
+    def layer_changed(self, layer, indices=None):
+        # 图层的位姿被修改 (indices 为 None 表示整条轨迹被替换): 更新概览小地图，比较中的轨迹还需要更新偏差
+        if self.trajectory_layers.get(layer.file_name) is not layer:
+            return  # 加载中的预览图层
+        self.minimap.update_layer(layer, indices)
+        self.update_comparison_for(layer, indices)
+
+    def update_comparison_for(self, layer, indices):
+        comparison = self.comparison
+        if comparison is None:
+            return
+        if layer.file_name == comparison['reference']:
+            comparison['index'] = None
+            self.compare_timer.start()
+        elif layer.file_name == comparison['candidate']:
+            distances = comparison['distances']
+            if (indices is None or distances is None or comparison['future'] is not None
+                    or len(distances) != len(layer.points)):
+                self.compare_timer.start()
+                return
+            indices = np.arange(len(layer.points))[indices]
+            if len(indices) > self.incremental_compare_limit:
+                self.compare_timer.start()
+            else:
+                self.update_deviations(layer, indices)
+
+    def update_deviations(self, layer, indices):
+        # 只重新计算改动的位姿；绘制缓存中这些位姿所在的瓦片已由图层丢弃，直接修改着色分级即可
+        comparison = self.comparison
+        with profiler.timer('compare_incremental'):
+            if comparison['index'] is None:
+                comparison['index'] = build_reference_index(comparison['reference_points'])
+            alive = layer.alive[indices]
+            values = np.full(len(indices), np.nan)
+            values[alive] = path_deviations(comparison['reference_points'], layer.points[indices[alive]],
+                                            comparison['index'])
+            comparison['distances'][indices] = values
+            if layer.color_bins is not None:
+                layer.color_bins[indices] = deviation_bins(values, comparison['tolerance'])
+        self.comparison_stats_timer.start()
+
+    def update_comparison_report(self):
+        comparison = self.comparison
+        if comparison is None or comparison['distances'] is None or self.comparison_dialog is None:
+            return
+        distances = comparison['distances']
+        stats = deviation_stats(distances[~np.isnan(distances)])
+        segments = out_of_tolerance_segments(distances, comparison['tolerance'])
+        self.comparison_dialog.show_report(stats, segments)
+
+    def select_deviation_segment(self, start, end):
+        # 选中候选轨迹中的一个超差区段并缩放到它
+        if self.comparison is None:
+            return
+        layer = self.trajectory_layers[self.comparison['candidate']]
+        self.clear_pose_selection()
+        layer.selected[start:end + 1] = layer.alive[start:end + 1]
+        layer.update()
+        points = layer.points[start:end + 1][layer.alive[start:end + 1]]
+        if len(points):
+            rect = layer.rect_of(points)
+            margin = max(rect.width(), rect.height(), 1.0) * 0.2
+            self.graphics_view.fitInView(rect.adjusted(-margin, -margin, margin, margin), Qt.KeepAspectRatio)
+
+    def open_occupancy_map(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "打开栅格地图", self.root_dir, "Map (*.yaml *.yml)")
+        if file_path:
+            self.load_occupancy_map(file_path)
+
+    def load_occupancy_map(self, file_path):
+        # 首次打开时在后台建立金字塔缓存，之后直接内存映射
+        future = self.get_executor().submit(build_pyramid, file_path)
+        self.pending_map = future
+        self.statusBar().showMessage(f"正在打开栅格地图 {os.path.basename(file_path)}...")
+        future.add_done_callback(partial(self.worker_signals.map_loaded.emit, file_path))
+
+    def on_map_loaded(self, file_path, future):
+        if self.pending_map is not future:
+            return
+        self.pending_map = None
+        self.statusBar().showMessage('Ready')
+        try:
+            metadata = future.result()
+            pyramid = MapPyramid(metadata)
+        except Exception as error:
+            self.log_message(f"打开栅格地图失败 {file_path}: {error}")
+            return
 
-            for pose in path_data['poses']:
-                position = pose['position']
-                x, y = position['x'], position['y']
-                ellipse = DraggableEllipseItem(self, color, -0.05, -0.05, 0.1, 0.1)  # 调整后的固定大小
-                ellipse.setPos(x, y)  # 设置椭圆的位置
-                self.scene.addItem(ellipse)
+        self.close_occupancy_map()
+        self.map_item = OccupancyMapItem(pyramid)
+        self.scene.addItem(self.map_item)
+        self.update_scene_extent()
+        self.minimap.invalidate()
+        profiler.record('map_load', metadata['elapsed'])
+        height, width = pyramid.shape
+        cache_state = "命中" if metadata['cache_hit'] else "未命中"
+        self.log_message(f"栅格地图={os.path.basename(file_path)} {width}x{height} 分辨率={pyramid.resolution} "
+                         f"级数={pyramid.level_count()} 缓存={cache_state} 耗时={metadata['elapsed']:.3f}s")
+
+    def close_occupancy_map(self):
+        if self.map_item is not None:
+            self.scene.removeItem(self.map_item)
+            self.map_item = None
+            self.update_scene_extent()
+            self.minimap.invalidate()
 
     def save_yaml_files(self):
-        for file_name, path_data in self.path_data_list:
-            if not path_data or 'poses' not in path_data:
+        # 只在后台保存有修改的文件
+        dirty_files = [file_name for file_name, trajectory in self.trajectories.items() if trajectory.is_dirty]
+        if not dirty_files:
+            self.log_message("没有需要保存的修改")
+            return
+
+        for file_name in dirty_files:
+            if file_name in self.pending_saves:
+                self.log_message(f"文件 {file_name} 正在保存，请稍后再保存")
                 continue
 
-            # 获取当前场景中的所有可拖动椭圆
-            current_items = [item for item in self.scene.items() if isinstance(item, DraggableEllipseItem)]
-
-            updated_poses = []
-            for item in current_items:
-                if item in self.deleted_items_set:
-                    continue  # 跳过已删除的项
-                pos = item.scenePos()
-                updated_poses.append({
-                    'position': {'x': pos.x(), 'y': pos.y()}
-                })
-
-            # 更新path_data中的poses
-            path_data['poses'] = updated_poses
-            len_path_data = len(path_data['poses'])
-            print_msg = f"保存文件名={file_name} 轨迹长度={len_path_data}"
-            self.log_message(print_msg)
+            # 写入本文件未删除的位姿的快照，内存中的轨迹保持原样，图层索引依然有效
+            trajectory = self.trajectories[file_name]
+            layer = self.trajectory_layers[file_name]
+            with profiler.timer('save_snapshot'):
+                saved_trajectory = trajectory.take(layer.alive)
             file_path = os.path.join(self.root_dir, file_name)
-            with open(file_path, 'w') as file:
-                yaml.dump(path_data, file)
+            token = None
+            if self.journal is not None and file_name in self.journal.file_ids:
+                token = self.journal.begin_save(trajectory, layer.alive)
+            future = self.get_executor().submit(save_trajectory_timed, saved_trajectory, file_path)
+            self.pending_saves[file_name] = (future, trajectory, trajectory.revision, token)
+            future.add_done_callback(partial(self.worker_signals.saved.emit, file_name))
+            self.statusBar().showMessage(f"正在保存 {len(self.pending_saves)} 个文件...")
+
+    def export_current_layer(self, suffix):
+        # 把当前图层 (未删除的位姿) 另存为 YAML 或二进制格式，不改变图层对应的文件
+        list_item = self.layer_list_widget.currentItem()
+        if list_item is None:
+            self.log_message("请先在图层列表中选择要导出的图层")
+            return
+        file_name = list_item.text()
+        stem = os.path.splitext(file_name)[0]
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出图层", os.path.join(self.root_dir, stem + suffix),
+                                                   f"Poses (*{suffix})")
+        if not file_path:
+            return
+        if not file_path.endswith(suffix):
+            file_path += suffix
+        layer = self.trajectory_layers[file_name]
+        with profiler.timer('save_snapshot'):
+            snapshot = layer.trajectory.take(layer.alive)
+        future = self.get_executor().submit(save_trajectory_timed, snapshot, file_path)
+        future.add_done_callback(partial(self.worker_signals.exported.emit, file_path))
+
+    def on_layer_exported(self, file_path, future):
+        try:
+            elapsed = future.result()
+        except Exception as error:
+            self.log_message(f"导出失败 {file_path}: {error}")
+            return
+        profiler.record('export', elapsed)
+        self.log_message(f"已导出 {file_path} 耗时={elapsed:.3f}s")
+
+    def on_file_saved(self, file_name, future):
+        if self.pending_saves.get(file_name, (None,))[0] is not future:
+            return  # 关闭窗口时已处理
+        _, trajectory, revision, token = self.pending_saves.pop(file_name)
+        try:
+            elapsed = future.result()
+        except Exception as error:
+            self.log_message(f"保存失败 文件名={file_name}: {error}")
+        else:
+            profiler.record('save', elapsed)
+            layer = self.trajectory_layers.get(file_name)
+            if self.trajectories.get(file_name) is trajectory:  # 保存期间没有被卸载或替换
+                modified_count = int(np.count_nonzero(trajectory.modified))
+                len_path_data = int(np.count_nonzero(layer.alive))
+                trajectory.mark_saved(revision)
+                print_msg = f"保存文件名={file_name} 轨迹长度={len_path_data} 修改位姿={modified_count} 耗时={elapsed:.3f}s"
+                self.log_message(print_msg)
+            if token is not None and self.journal is not None:
+                self.journal_call(self.journal.finish_save, file_name, os.path.join(self.root_dir, file_name), token)
+
+        if not self.pending_saves:
+            self.statusBar().showMessage('Ready')
+            self.log_message("Saved modifications to files")
+            self.compact_journal()
+
+    # 编辑日志
+
+    def get_journal(self):
+        if self.journal is None:
+            try:
+                self.journal = EditJournal.create()
+            except OSError as error:
+                self.log_message(f"无法创建编辑日志: {error}")
+        return self.journal
+
+    def journal_call(self, method, *args):
+        # 写日志失败 (如磁盘已满) 时停用日志，不影响编辑
+        try:
+            method(*args)
+        except OSError as error:
+            self.log_message(f"编辑日志写入失败，已停用: {error}")
+            self.journal_sync_timer.stop()
+            self.journal = None
+            return
+        if not self.journal_sync_timer.isActive():
+            self.journal_sync_timer.start()
+
+    def journal_command(self, command, undo):
+        if self.journal is not None:
+            self.journal_call(self.journal.record, command, undo)
+
+    def journal_file(self, file_name):
+        # 新加载的文件从当前磁盘内容开始记录
+        if self.get_journal() is not None:
+            layer = self.trajectory_layers[file_name]
+            self.journal_call(self.journal.open_file, file_name, os.path.join(self.root_dir, file_name),
+                              layer.trajectory, layer.alive)
+
+    def sync_journal(self):
+        if self.journal is not None:
+            try:
+                self.journal.sync()
+            except OSError as error:
+                self.log_message(f"编辑日志写入失败，已停用: {error}")
+                self.journal = None
+
+    def compact_journal(self):
+        # 全部修改都已保存时清空日志，只保留各文件的起点
+        if self.journal is None or self.pending_saves:
+            return
+        if any(trajectory.is_dirty for trajectory in self.trajectories.values()):
+            return
+        files = [(file_name, os.path.join(self.root_dir, file_name), layer.trajectory, layer.alive)
+                 for file_name, layer in self.trajectory_layers.items() if file_name in self.journal.file_ids]
+        self.journal_call(self.journal.compact, files)
+
+    def offer_journal_recovery(self):
+        # 启动时检查上次异常退出留下的编辑日志
+        for session_dir in stale_sessions():
+            try:
+                files = summarize_session(session_dir)
+            except (OSError, JournalError):
+                files = []
+            if not files:
+                discard_session(session_dir)
+                continue
+            lines = "\n".join(f"{path} ({edits} 项编辑)" for path, edits in files[:10])
+            if len(files) > 10:
+                lines += f"\n... 共 {len(files)} 个文件"
+            box = QMessageBox(QMessageBox.Question, "恢复未保存的修改",
+                              f"上次运行 ({os.path.basename(session_dir)}) 没有正常退出，以下文件有未保存的修改:\n{lines}",
+                              parent=self)
+            recover_button = box.addButton("恢复", QMessageBox.AcceptRole)
+            discard_button = box.addButton("丢弃", QMessageBox.DestructiveRole)
+            box.addButton("稍后", QMessageBox.RejectRole)
+            box.exec_()
+            if box.clickedButton() is recover_button:
+                self.recover_session(session_dir)
+            elif box.clickedButton() is discard_button:
+                discard_session(session_dir)
+                self.log_message(f"已丢弃编辑日志 {session_dir}")
+            return
 
-        self.log_message("Saved modifications to files")
+    def recover_session(self, session_dir):
+        # 在原文件上重放日志，恢复的图层保持未保存状态，并继续使用该日志
+        if self.journal is not None:
+            return
+        start_time = time.perf_counter()
+        try:
+            recovered, failed = replay_session(session_dir)
+        except (OSError, JournalError) as error:
+            self.log_message(f"恢复失败: {error}")
+            return
+        for path, error in failed:
+            self.log_message(f"无法恢复 {path}: {error}")
+        # 图层沿用第一次打开时的文件名 (日志中有记录)，保存时写回 root_dir 下的同名文件，
+        # 因此只恢复位于当前目录 (没有打开目录时为第一个文件所在目录) 中的文件
+        if recovered and not self.root_dir:
+            _, file_name, path, *_ = recovered[0]
+            self.root_dir = path[:len(path) - len(file_name)].rstrip(os.sep) or os.sep
+            self.load_files()
+        file_ids = {}
+        for file_id, file_name, path, trajectory, alive, edits in recovered:
+            if os.path.abspath(os.path.join(self.root_dir, file_name)) != path:
+                self.log_message(f"无法恢复 {path}: 不在当前目录 {self.root_dir} 中")
+                continue
+            if file_name in self.trajectories:
+                continue
+            self.trajectories[file_name] = trajectory
+            self.display_points(file_name, trajectory)
+            if not alive.all():
+                self.trajectory_layers[file_name].set_trajectory(trajectory, alive)
+            file_ids[file_name] = file_id
+            self.log_message(f"已恢复 {file_name}: {edits} 项编辑")
+        try:
+            self.journal = EditJournal.adopt(session_dir, file_ids)
+        except (OSError, JournalError) as error:
+            self.log_message(f"无法继续使用编辑日志: {error}")
+        self.log_message(f"恢复 {len(file_ids)} 个文件 耗时={time.perf_counter() - start_time:.3f}s")
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包后的程序需要支持后台进程
     app = QApplication(sys.argv)
     window = MapEditor()
     window.show()
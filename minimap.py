@@ -0,0 +1,82 @@
+import numpy as np
+
+# 概览小地图的栅格化 (不依赖 Qt)
+# 场景范围按固定像素数降采样，每个图层记录每个像素中的位姿数和每个位姿所在的像素，
+# 位姿移动或删除时只从旧像素减去、向新像素加上改动的位姿，不需要重新栅格化整条轨迹。
+
+MINIMAP_SIZE = 256
+
+
+class MinimapRaster:
+    def __init__(self, width=MINIMAP_SIZE, height=MINIMAP_SIZE):
+        self.width = width
+        self.height = height
+        self.extent = None  # (x0, y0, 像素边长)，像素为正方形
+        self.counts = {}  # 图层名 -> (height * width,) 每个像素中的位姿数
+        self.pixels = {}  # 图层名 -> (n,) 每个位姿所在像素的序号，已删除或在范围外为 -1
+
+    def set_extent(self, x0, y0, width, height):
+        # 场景范围变化后需要重新 set_layer；返回范围是否改变
+        pixel = max(width / self.width, height / self.height)
+        if pixel <= 0:
+            return False
+        # 居中，多余的像素留白
+        extent = (x0 + (width - pixel * self.width) / 2, y0 + (height - pixel * self.height) / 2, pixel)
+        if extent == self.extent:
+            return False
+        self.extent = extent
+        return True
+
+    def pixel_of(self, points, alive=None):
+        x0, y0, pixel = self.extent
+        cols = np.floor((points[:, 0] - x0) / pixel)
+        rows = np.floor((points[:, 1] - y0) / pixel)
+        inside = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        if alive is not None:
+            inside &= alive
+        return np.where(inside, rows * self.width + cols, -1).astype(np.int32)
+
+    def histogram(self, pixels):
+        return np.bincount(pixels[pixels >= 0], minlength=self.width * self.height)
+
+    def set_layer(self, name, points, alive=None):
+        pixels = self.pixel_of(points, alive)
+        self.pixels[name] = pixels
+        self.counts[name] = self.histogram(pixels)
+
+    def update_layer(self, name, indices, points, alive=None):
+        # points/alive 为改动后 indices 处位姿的坐标和是否未删除
+        old = self.pixels[name][indices]
+        new = self.pixel_of(points, alive)
+        counts = self.counts[name]
+        counts -= self.histogram(old)
+        counts += self.histogram(new)
+        self.pixels[name][indices] = new
+
+    def remove_layer(self, name):
+        self.counts.pop(name, None)
+        self.pixels.pop(name, None)
+
+    def occupied(self, name):
+        return (self.counts[name] > 0).reshape(self.height, self.width)
+
+    def compose(self, layers, background=(255, 255, 255, 255)):
+        # layers: [(图层名, (r, g, b))]，后面的图层画在上面；返回 (height, width, 4) RGBA 图像
+        image = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        image[:] = background
+        for name, color in layers:
+            if name in self.counts:
+                image[self.occupied(name)] = tuple(color) + (255,)
+        return image
+
+    def scene_to_pixel(self, x, y):
+        x0, y0, pixel = self.extent
+        return (x - x0) / pixel, (y - y0) / pixel
+
+    def pixel_to_scene(self, col, row):
+        x0, y0, pixel = self.extent
+        return x0 + col * pixel, y0 + row * pixel
+
+    def nbytes(self):
+        return (sum(counts.nbytes for counts in self.counts.values())
+                + sum(pixels.nbytes for pixels in self.pixels.values()))
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import yaml
+
+# 栅格地图 (map_server 格式: map.yaml + PGM/PNG) 的多分辨率金字塔 (不依赖 QApplication)
+# 第 0 级直接内存映射原始 PGM，第 k 级每个像素对应原图 2^k x 2^k 个像素 (取最暗值，细墙缩小后仍可见)，
+# 各级存为缓存目录中的 .npy 文件，打开时同样内存映射，显示时只读取可见瓦片，不把整张图解码进内存。
+# PNG 是压缩格式无法内存映射，首次打开时解码一次转存为原始灰度缓存，之后与 PGM 相同。
+
+MAP_CACHE_VERSION = 1
+MAP_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'mapeditor', 'maps'
+)
+PYRAMID_TILE = 256  # 最粗一级不超过一个瓦片
+BLOCK_ROWS = 1024  # 建金字塔时每次读入的行数
+
+
+def load_map_metadata(yaml_path):
+    # 读取 map.yaml: image 相对于 yaml 所在目录，origin 为左下角像素的 (x, y, yaw)
+    with open(yaml_path, 'r') as file:
+        data = yaml.safe_load(file)
+    if not isinstance(data, dict) or 'image' not in data or 'resolution' not in data:
+        raise ValueError("map yaml needs 'image' and 'resolution'")
+    origin = list(data.get('origin') or [0.0, 0.0, 0.0]) + [0.0, 0.0, 0.0]
+    return {
+        'image': os.path.join(os.path.dirname(os.path.abspath(yaml_path)), data['image']),
+        'resolution': float(data['resolution']),
+        'origin': [float(value) for value in origin[:3]],
+        'negate': bool(data.get('negate', 0)),
+        'occupied_thresh': float(data.get('occupied_thresh', 0.65)),
+        'free_thresh': float(data.get('free_thresh', 0.196)),
+    }
+
+
+def read_pgm_header(image_path):
+    # 二进制 PGM (P5) 的 (宽, 高, 最大灰度值, 数据偏移)，其他格式返回 None
+    with open(image_path, 'rb') as file:
+        header = file.read(4096)
+    if not header.startswith(b'P5'):
+        return None
+    fields = []
+    position = 2
+    while len(fields) < 3:
+        while position < len(header) and header[position:position + 1].isspace():
+            position += 1
+        if header[position:position + 1] == b'#':
+            position = header.index(b'\n', position)
+            continue
+        end = position
+        while end < len(header) and not header[end:end + 1].isspace():
+            end += 1
+        if end >= len(header):
+            raise ValueError("truncated PGM header")
+        fields.append(int(header[position:end]))
+        position = end
+    width, height, maxval = fields
+    return width, height, maxval, position + 1  # 最大灰度值后面恰好一个空白字符
+
+
+def open_pgm(image_path):
+    # 内存映射 P5 数据，maxval > 255 时为大端 16 位
+    width, height, maxval, offset = read_pgm_header(image_path)
+    dtype = np.dtype(np.uint8) if maxval < 256 else np.dtype('>u2')
+    return np.memmap(image_path, dtype=dtype, mode='r', offset=offset, shape=(height, width)), maxval
+
+
+def to_gray8(pixels, maxval=255, negate=False):
+    # 原始像素 -> 显示用 8 位灰度，negate 的地图白色为占据，取反后占据统一显示为黑色
+    pixels = np.asarray(pixels)
+    if maxval != 255:
+        pixels = (pixels.astype(np.uint32) * 255 // max(maxval, 1)).astype(np.uint8)
+    else:
+        pixels = pixels.astype(np.uint8, copy=False)
+    return 255 - pixels if negate else pixels
+
+
+def gray8_converter(maxval, negate):
+    # 第 0 级已是 8 位且不取反时无需转换
+    if maxval == 255 and not negate:
+        return None
+    return lambda pixels: to_gray8(pixels, maxval, negate)
+
+
+def downsample(source, target, convert=None):
+    # 2x2 取最小值缩小一半，按行分块读写，内存占用与图像大小无关
+    for start in range(0, target.shape[0], BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, target.shape[0])
+        rows = np.asarray(source[2 * start:2 * stop])
+        if convert is not None:
+            rows = convert(rows)
+        if rows.shape[0] % 2:
+            rows = np.concatenate((rows, rows[-1:]))
+        if rows.shape[1] % 2:
+            rows = np.concatenate((rows, rows[:, -1:]), axis=1)
+        target[start:stop] = rows.reshape(rows.shape[0] // 2, 2, rows.shape[1] // 2, 2).min(axis=(1, 3))
+
+
+def cache_prefix_for(image_path):
+    digest = hashlib.sha1(os.path.abspath(image_path).encode('utf-8')).hexdigest()
+    return os.path.join(MAP_CACHE_DIR, digest)
+
+
+def decode_image(image_path, target_path):
+    # PNG 等压缩格式: 用 Qt 解码一次，转存为可内存映射的 8 位灰度 .npy
+    from PyQt5.QtGui import QImage
+    image = QImage(image_path)
+    if image.isNull():
+        raise ValueError(f"cannot decode map image: {image_path}")
+    image = image.convertToFormat(QImage.Format_Grayscale8)
+    width, height = image.width(), image.height()
+    level = np.lib.format.open_memmap(target_path, mode='w+', dtype=np.uint8, shape=(height, width))
+    buffer = image.constBits()
+    buffer.setsize(image.bytesPerLine() * height)
+    level[:] = np.frombuffer(buffer, dtype=np.uint8).reshape(height, image.bytesPerLine())[:, :width]
+    level.flush()
+    del level
+
+
+def build_pyramid(yaml_path):
+    # 在后台进程中执行: 解析 map.yaml，建立 (或复用缓存的) 金字塔，返回打开各级所需的信息
+    start_time = time.perf_counter()
+    metadata = load_map_metadata(yaml_path)
+    image_path = metadata['image']
+    stat = os.stat(image_path)
+    prefix = cache_prefix_for(image_path)
+    index_path = prefix + '.json'
+    key = {'version': MAP_CACHE_VERSION, 'source_size': stat.st_size, 'source_mtime': stat.st_mtime_ns,
+           'negate': metadata['negate']}
+
+    try:
+        with open(index_path, 'r') as file:
+            index = json.load(file)
+        cache_hit = index['key'] == key and all(os.path.exists(path) for path in index['levels'])
+    except (OSError, ValueError, KeyError):
+        cache_hit = False
+
+    if not cache_hit:
+        os.makedirs(MAP_CACHE_DIR, exist_ok=True)
+        header = read_pgm_header(image_path)
+        if header is not None:
+            source, maxval = open_pgm(image_path)
+            levels = [image_path]
+        else:
+            decoded_path = prefix + '-0.npy'
+            decode_image(image_path, decoded_path + '.tmp')
+            os.replace(decoded_path + '.tmp', decoded_path)
+            source, maxval = np.load(decoded_path, mmap_mode='r'), 255
+            levels = [decoded_path]
+        convert = gray8_converter(maxval, metadata['negate'])
+        level_number = 0
+        while max(source.shape) > PYRAMID_TILE:
+            level_number += 1
+            shape = ((source.shape[0] + 1) // 2, (source.shape[1] + 1) // 2)
+            level_path = prefix + f'-{level_number}.npy'
+            target = np.lib.format.open_memmap(level_path + '.tmp', mode='w+', dtype=np.uint8, shape=shape)
+            downsample(source, target, convert)
+            target.flush()
+            del target
+            os.replace(level_path + '.tmp', level_path)
+            source = np.load(level_path, mmap_mode='r')
+            convert = None  # 第 1 级起已是显示用灰度
+            levels.append(level_path)
+        index = {'key': key, 'levels': levels, 'maxval': maxval, 'pgm': header is not None}
+        with open(index_path + '.tmp', 'w') as file:
+            json.dump(index, file)
+        os.replace(index_path + '.tmp', index_path)
+
+    metadata.update(levels=index['levels'], maxval=index['maxval'], pgm=index['pgm'], cache_hit=cache_hit,
+                    elapsed=time.perf_counter() - start_time)
+    return metadata
+
+
+class MapPyramid:
+    # 已建好的金字塔，各级均为只读内存映射数组
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.resolution = metadata['resolution']
+        self.origin = metadata['origin']
+        self.negate = metadata['negate']
+        self.maxval = metadata['maxval']
+        if metadata['pgm']:
+            base = open_pgm(metadata['image'])[0]
+        else:
+            base = np.load(metadata['levels'][0], mmap_mode='r')
+        self.levels = [base] + [np.load(path, mmap_mode='r') for path in metadata['levels'][1:]]
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    def level_count(self):
+        return len(self.levels)
+
+    def tile(self, level, col, row, tile_size=PYRAMID_TILE):
+        # 第 level 级中 (col, row) 号瓦片的 8 位灰度像素 (连续数组)
+        data = self.levels[level]
+        pixels = data[row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size]
+        if level == 0:
+            pixels = to_gray8(pixels, self.maxval, self.negate)
+        return np.ascontiguousarray(pixels)
@@ -0,0 +1,180 @@
+import sys
+import copy
+import numpy as np
+
+
+# 位姿的按列存储 (不依赖 Qt)
+# PyYAML 解析出的每个位姿是一个嵌套字典，百万位姿要占用数 GB 内存；
+# 这里每个数值字段 (如 'orientation.z') 存为一列连续的 float64/int64 数组，
+# 所有位姿取值相同的非数值字段存一份 (constants)，其余不规则的字段 (非数值、只在部分位姿中出现)
+# 放在按行号索引的附加表 extras 中。
+
+
+MISSING = object()
+
+
+def leaf_items(data, prefix=''):
+    # 展开嵌套字典: {'position': {'x': 1.0}} -> [('position.x', 1.0)]，空字典作为叶子值
+    items = []
+    for key, value in data.items():
+        if not isinstance(key, str) or '.' in key:
+            raise ValueError(f"unsupported pose key: {key!r}")
+        if isinstance(value, dict) and value:
+            items.extend(leaf_items(value, prefix + key + '.'))
+        else:
+            items.append((prefix + key, value))
+    return items
+
+
+def column_from_values(values):
+    # 全是 int 的字段存为 int64，int/float 混合的存为 float64，否则返回 None (bool 不算数值)
+    types = set(map(type, values))
+    try:
+        if types <= {int}:
+            return np.array(values, dtype=np.int64)
+        if types <= {int, float}:
+            return np.array(values, dtype=np.float64)
+    except OverflowError:
+        pass
+    return None
+
+
+def fresh(value):
+    # 列表/字典值每个位姿各用一份，避免 yaml.dump 输出锚点和别名
+    return copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+
+
+def set_path(pose, keys, value):
+    target = pose
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    target[keys[-1]] = value
+
+
+def object_nbytes(value):
+    # 容器对象的大致内存占用 (含内部对象)
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(object_nbytes(key) + object_nbytes(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(object_nbytes(item) for item in value)
+    return size
+
+
+class PoseTable:
+    def __init__(self, length=0, columns=None, constants=None, extras=None):
+        self.length = length
+        self.columns = dict(columns or {})  # 字段路径 -> (n,) 数组
+        self.constants = dict(constants or {})  # 字段路径 -> 值
+        self.extras = dict(extras or {})  # 行号 -> {字段路径: 值}
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def from_poses(cls, poses):
+        rows = []
+        for pose in poses:
+            if not isinstance(pose, dict):
+                raise ValueError("pose is not a mapping")
+            rows.append(dict(leaf_items(pose)))
+
+        # 第一个位姿中的字段，若所有位姿都有且为数值则按列存储
+        columns, constants = {}, {}
+        for path in (rows[0] if rows else ()):
+            values = [row.get(path, MISSING) for row in rows]
+            column = column_from_values(values)
+            if column is not None:
+                columns[path] = column
+            elif all(value is not MISSING and value == values[0] for value in values):
+                constants[path] = values[0]
+
+        # 列和常量字段每个位姿都有，字段数更多的位姿才有附加字段
+        extras = {}
+        known = len(columns) + len(constants)
+        for i, row in enumerate(rows):
+            if len(row) != known:
+                extra = {path: value for path, value in row.items()
+                         if path not in columns and path not in constants}
+                if extra:
+                    extras[i] = extra
+        return cls(len(rows), columns, constants, extras)
+
+    def to_poses(self, overrides=None):
+        # 还原为位姿字典列表，overrides: {字段路径: 数组} 替换对应的列
+        columns = dict(self.columns)
+        columns.update(overrides or {})
+        paths = [path.split('.') for path in columns]
+        values = [column.tolist() for column in columns.values()]
+        constant_items = [(path.split('.'), value) for path, value in self.constants.items()]
+
+        poses = []
+        for row in (zip(*values) if values else [()] * self.length):
+            pose = {}
+            for keys, value in zip(paths, row):
+                set_path(pose, keys, value)
+            for keys, value in constant_items:
+                set_path(pose, keys, fresh(value))
+            poses.append(pose)
+        for i, extra in self.extras.items():
+            for path, value in extra.items():
+                set_path(poses[i], path.split('.'), fresh(value))
+        return poses
+
+    def nbytes(self):
+        return (sum(column.nbytes for column in self.columns.values())
+                + object_nbytes(self.constants) + object_nbytes(self.extras))
+
+    def copy(self):
+        return PoseTable(self.length, {path: column.copy() for path, column in self.columns.items()},
+                         self.constants, {i: dict(extra) for i, extra in self.extras.items()})
+
+    def drop_columns(self, paths):
+        return PoseTable(self.length, {path: column for path, column in self.columns.items() if path not in paths},
+                         self.constants, self.extras)
+
+    def take(self, indices):
+        # 按索引 (或布尔掩码) 取出子表，索引可以重复
+        indices = np.arange(self.length)[indices]
+        extras = {}
+        if self.extras:
+            rows = np.flatnonzero(np.isin(indices, list(self.extras)))
+            extras = {int(new): self.extras[int(indices[new])] for new in rows}
+        return PoseTable(len(indices), {path: column[indices] for path, column in self.columns.items()},
+                         self.constants, extras)
+
+    @classmethod
+    def concatenate(cls, tables):
+        # 依次拼接；只在部分表中按列存储或取值不同的字段转存到 extras
+        tables = list(tables)
+        if not tables:
+            return cls()
+        common_columns = [path for path in tables[0].columns
+                          if all(path in table.columns for table in tables[1:])]
+        constants = {path: value for path, value in tables[0].constants.items()
+                     if all(path in table.constants and table.constants[path] == value for table in tables[1:])}
+
+        columns = {}
+        for path in common_columns:
+            parts = [table.columns[path] for table in tables]
+            dtype = np.result_type(*parts)
+            columns[path] = np.concatenate(parts).astype(np.float64 if dtype.kind == 'f' else dtype)
+
+        extras = {}
+        offset = 0
+        for table in tables:
+            moved_columns = [(path, column.tolist()) for path, column in table.columns.items()
+                             if path not in columns]
+            moved_constants = [(path, value) for path, value in table.constants.items() if path not in constants]
+            if not moved_columns and not moved_constants:
+                extras.update((offset + i, extra) for i, extra in table.extras.items())
+                offset += table.length
+                continue
+            for i in range(table.length):
+                extra = dict(table.extras.get(i, ()))
+                extra.update((path, values[i]) for path, values in moved_columns)
+                extra.update(moved_constants)
+                if extra:
+                    extras[offset + i] = extra
+            offset += table.length
+        return cls(offset, columns, constants, extras)
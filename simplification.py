@@ -0,0 +1,145 @@
+import numpy as np
+
+
+# 轨迹简化和重采样 (不依赖 Qt)，输入均为按轨迹顺序排列的 (n, 2) 坐标数组
+
+
+def concatenated_ranges(starts, lengths):
+    # 把多个 [start, start + length) 区间拼接成一个索引数组
+    total = int(lengths.sum())
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return np.arange(total) + offsets
+
+
+def segment_distances(points, a, b):
+    # 点到线段 ab 的距离 (逐行对应)
+    ab = b - a
+    ap = points - a
+    length_sq = np.einsum('ij,ij->i', ab, ab)
+    t = np.divide(np.einsum('ij,ij->i', ap, ab), length_sq, out=np.zeros(len(points)), where=length_sq > 0)
+    nearest = a + ab * np.clip(t, 0.0, 1.0)[:, None]
+    return np.hypot(*(points - nearest).T)
+
+
+def douglas_peucker(points, tolerance):
+    # Douglas-Peucker 简化，返回保留的索引 (含首尾)
+    # 同一层的所有线段一起向量化处理，每一层只需一遍 numpy 运算
+    n = len(points)
+    if n <= 2:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    starts, ends = np.array([0]), np.array([n - 1])
+    while len(starts):
+        lengths = ends - starts - 1
+        has_inner = lengths > 0
+        starts, ends, lengths = starts[has_inner], ends[has_inner], lengths[has_inner]
+        if not len(starts):
+            break
+
+        segment = np.repeat(np.arange(len(starts)), lengths)
+        inner = concatenated_ranges(starts + 1, lengths)
+        distances = segment_distances(points[inner], points[starts][segment], points[ends][segment])
+
+        # 每条线段上距离最大的点
+        first = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        max_distances = np.maximum.reduceat(distances, first)
+        is_max = np.flatnonzero(distances == max_distances[segment])
+        max_segment = segment[is_max]  # 已按线段排序，取每条线段的第一个最大值
+        first_max = np.flatnonzero(np.diff(max_segment, prepend=-1))
+        farthest = inner[is_max[first_max]]
+
+        split = max_distances > tolerance
+        keep[farthest[split]] = True
+        starts, ends = (np.concatenate((starts[split], farthest[split])),
+                        np.concatenate((farthest[split], ends[split])))
+    return np.flatnonzero(keep)
+
+
+def arc_lengths(points):
+    if not len(points):
+        return np.zeros(0)
+    steps = np.hypot(*np.diff(points, axis=0).T)
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def decimate_by_arc_length(points, spacing):
+    # 沿轨迹每 spacing 长度只保留进入该段的第一个位姿 (并保留终点)，返回保留的索引；
+    # 只按弧长分段，不保证保留的位姿之间的距离，只用于显示抽稀
+    n = len(points)
+    if n <= 2 or spacing <= 0:
+        return np.arange(n)
+    bins = np.floor(arc_lengths(points) / spacing)
+    keep = np.ones(n, dtype=bool)
+    keep[1:] = bins[1:] != bins[:-1]
+    keep[-1] = True
+    return np.flatnonzero(keep)
+
+
+def first_far(points, start, tolerance, chunk):
+    # start 之后第一个与 points[start] 相距超过 tolerance 的位姿，没有时返回 -1；分块查找，块逐次加倍
+    begin = start + 1
+    while begin < len(points):
+        block = points[begin:begin + chunk]
+        far = np.flatnonzero(np.hypot(*(block - points[start]).T) > tolerance)
+        if len(far):
+            return begin + int(far[0])
+        begin += chunk
+        chunk *= 2
+    return -1
+
+
+def remove_duplicates(points, tolerance, window=8):
+    # 去除与前一个保留位姿相距不超过 tolerance 的位姿 (并保留终点)，返回保留的索引
+    # 先向量化地为每个位姿找出其后 window 个位姿内第一个相距超过 tolerance 的位姿，
+    # 再从起点沿这些链接走一遍；链接超出 window 的 (如长时间静止) 走到时再分块查找
+    n = len(points)
+    if n <= 2:
+        return np.arange(n)
+    if tolerance <= 0:
+        # 只去除完全重合的点: 被去除的点与上一个保留的点相同，逐个与前一个点比较即可
+        keep = np.ones(n, dtype=bool)
+        keep[1:] = np.any(np.diff(points, axis=0) != 0, axis=1)
+        keep[-1] = True
+        return np.flatnonzero(keep)
+
+    links = np.full(n, -1)
+    pending = np.arange(n - 1)
+    for offset in range(1, window + 1):
+        pending = pending[pending + offset < n]
+        if not len(pending):
+            break
+        candidates = pending + offset
+        far = np.hypot(*(points[candidates] - points[pending]).T) > tolerance
+        links[pending[far]] = candidates[far]
+        pending = pending[~far]
+
+    links = links.tolist()
+    kept = [0]
+    current = 0
+    while True:
+        following = links[current]
+        if following < 0:
+            following = first_far(points, current, tolerance, window * 4)
+            if following < 0:
+                break
+        kept.append(following)
+        current = following
+    if kept[-1] != n - 1:
+        kept.append(n - 1)
+    return np.array(kept)
+
+
+def resample(points, spacing):
+    # 按固定弧长间距重采样 (含首尾)，返回 (新坐标, 每个新位姿对应的原位姿索引)
+    n = len(points)
+    if n <= 1 or spacing <= 0:
+        return points.copy(), np.arange(n)
+    distances = arc_lengths(points)
+    targets = np.arange(0.0, distances[-1], spacing)
+    if not len(targets) or targets[-1] < distances[-1]:
+        targets = np.append(targets, distances[-1])
+    resampled = np.column_stack((np.interp(targets, distances, points[:, 0]),
+                                 np.interp(targets, distances, points[:, 1])))
+    sources = np.clip(np.searchsorted(distances, targets, side='right') - 1, 0, n - 1)
+    return resampled, sources
@@ -0,0 +1,262 @@
+from functools import partial
+
+import numpy as np
+
+
+class GridIndex:
+    # 位姿坐标的均匀网格索引 (不依赖 Qt)
+    # 点按网格键 (行 * 列数 + 列) 排序存放，一行内连续的格子对应排序数组中的一段，
+    # 用 searchsorted 向量化地取出候选点。
+    # 移动过的点记入 moved，查询时单独检查；积累过多时再整体重建。
+    # 删除不需要更新索引，查询时通过 mask 过滤。
+    def __init__(self, points, cell_size=None, points_per_cell=16, rebuild_fraction=1 / 16):
+        self.points = points  # 与轨迹共用的 (n, 2) 数组，原地修改后调用 update()
+        self.cell_size = cell_size
+        self.points_per_cell = points_per_cell
+        self.rebuild_fraction = rebuild_fraction
+        self.moved = np.zeros(len(points), dtype=bool)
+        self.moved_count = 0
+        self.moved_indices = None  # moved 的索引缓存
+        self.order = None  # 按网格键排序的点索引
+        self.sorted_keys = None
+        self.sorted_points = None  # 按 order 排列的坐标，批量查询时建立
+
+    def choose_cell_size(self):
+        # 轨迹上相邻位姿间距的中位数 * points_per_cell，使每个格子平均约有 points_per_cell 个点
+        if len(self.points) > 1:
+            steps = np.hypot(*np.diff(self.points, axis=0).T)
+            spacing = float(np.median(steps))
+            if spacing > 0:
+                return spacing * self.points_per_cell
+        extent = np.ptp(self.points, axis=0).max() if len(self.points) else 0.0
+        return max(float(extent), 1.0)
+
+    def build(self):
+        if self.cell_size is None:
+            self.cell_size = self.choose_cell_size()
+        if len(self.points):
+            self.origin = self.points.min(axis=0)
+            self.extent = (self.origin, self.points.max(axis=0))
+            cells = self.cells_of(self.points)
+            self.columns = int(cells[:, 0].max()) + 1
+            self.rows = int(cells[:, 1].max()) + 1
+            keys = cells[:, 1] * self.columns + cells[:, 0]
+        else:
+            self.origin = np.zeros(2)
+            self.extent = (self.origin, self.origin)
+            self.columns = self.rows = 1
+            keys = np.zeros(0, dtype=np.int64)
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+        self.sorted_points = None
+        self.moved[:] = False
+        self.moved_count = 0
+        self.moved_indices = None
+
+    def ensure_built(self):
+        if self.order is None or len(self.moved) != len(self.points):
+            if len(self.moved) != len(self.points):
+                self.moved = np.zeros(len(self.points), dtype=bool)
+            self.build()
+
+    def nbytes(self):
+        size = self.moved.nbytes
+        for array in (self.order, self.sorted_keys, self.sorted_points, self.moved_indices):
+            if array is not None:
+                size += array.nbytes
+        return size
+
+    def cells_of(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def update(self, indices):
+        # points[indices] 已被修改
+        if self.order is None:
+            return
+        self.moved_count += int(np.count_nonzero(~self.moved[indices]))
+        self.moved[indices] = True
+        self.moved_indices = None
+        if self.moved_count > max(1024, len(self.points) * self.rebuild_fraction):
+            self.order = None  # 下次查询时重建
+
+    def get_moved_indices(self):
+        if self.moved_indices is None:
+            self.moved_indices = np.flatnonzero(self.moved)
+        return self.moved_indices
+
+    def bounds(self):
+        # 所有点的包围盒: 建索引时的范围加上移动过的点
+        lower, upper = self.extent
+        if self.moved_count:
+            moved_points = self.points[self.get_moved_indices()]
+            lower = np.minimum(lower, moved_points.min(axis=0))
+            upper = np.maximum(upper, moved_points.max(axis=0))
+        return lower, upper
+
+    def query_rect(self, x_min, y_min, x_max, y_max, mask=None):
+        # 返回矩形内 (含边界) 的点索引
+        self.ensure_built()
+        if not len(self.points) or x_min > x_max or y_min > y_max:
+            return np.zeros(0, dtype=np.int64)
+
+        (col_min, row_min), (col_max, row_max) = self.cells_of(np.array([[x_min, y_min], [x_max, y_max]]))
+        col_min, col_max = max(col_min, 0), min(col_max, self.columns - 1)
+        row_min, row_max = max(row_min, 0), min(row_max, self.rows - 1)
+
+        candidates = [self.get_moved_indices()] if self.moved_count else []
+        if col_min <= col_max and row_min <= row_max:
+            rows = np.arange(row_min, row_max + 1, dtype=np.int64)
+            starts = np.searchsorted(self.sorted_keys, rows * self.columns + col_min, side='left')
+            ends = np.searchsorted(self.sorted_keys, rows * self.columns + col_max, side='right')
+            lengths = ends - starts
+            total = int(lengths.sum())
+            if total:
+                # 把各行的 [start, end) 区间拼接成一个位置数组
+                offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+                static = self.order[np.arange(total) + offsets]
+                if self.moved_count:
+                    static = static[~self.moved[static]]
+                candidates.append(static)
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+
+        indices = np.concatenate(candidates) if len(candidates) > 1 else candidates[0]
+        xs, ys = self.points[indices, 0], self.points[indices, 1]
+        inside = (xs >= x_min) & (xs <= x_max) & (ys >= y_min) & (ys <= y_max)
+        if mask is not None:
+            inside &= mask[indices]
+        return np.sort(indices[inside])
+
+    def query_polygon(self, polygon, mask=None):
+        # polygon: (m, 2) 顶点数组，返回多边形内的点索引 (射线法)
+        polygon = np.asarray(polygon, dtype=np.float64)
+        if len(polygon) < 3:
+            return np.zeros(0, dtype=np.int64)
+        (x_min, y_min), (x_max, y_max) = polygon.min(axis=0), polygon.max(axis=0)
+        indices = self.query_rect(x_min, y_min, x_max, y_max, mask)
+        if not len(indices):
+            return indices
+
+        xs, ys = self.points[indices, 0], self.points[indices, 1]
+        inside = np.zeros(len(indices), dtype=bool)
+        for (x1, y1), (x2, y2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+            if y1 == y2:
+                continue
+            crosses = (y1 > ys) != (y2 > ys)
+            x_cross = x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= crosses & (xs < x_cross)
+        return indices[inside]
+
+    def nearest(self, x, y, max_distance=None, mask=None):
+        # 返回 (索引, 距离)，max_distance 内没有点时返回 (None, None)
+        self.ensure_built()
+        if not len(self.points):
+            return None, None
+        (x_min, y_min), (x_max, y_max) = self.bounds()
+        # 覆盖全部点所需的搜索半径
+        reach = max(abs(x - x_min), abs(x - x_max), abs(y - y_min), abs(y - y_max))
+        radius = self.cell_size if max_distance is None else min(self.cell_size, max_distance)
+        while True:
+            indices = self.query_rect(x - radius, y - radius, x + radius, y + radius, mask)
+            if len(indices):
+                offsets = self.points[indices] - (x, y)
+                distances = np.hypot(offsets[:, 0], offsets[:, 1])
+                best = int(np.argmin(distances))
+                distance = float(distances[best])
+                if distance <= radius:
+                    # 半径内的点已全部检查，找到的就是最近点
+                    if max_distance is not None and distance > max_distance:
+                        return None, None
+                    return int(indices[best]), distance
+                # 最近点可能在方框角上，用该距离再查一次
+                radius = distance
+                continue
+            if radius >= reach or (max_distance is not None and radius >= max_distance):
+                return None, None
+            radius = radius * 4 if max_distance is None else min(radius * 4, max_distance)
+
+    def nearest_many(self, queries, chunk_size=65536, distance=None, slack=0.0):
+        # 批量最近点查询 (向量化)，返回 (索引数组, 距离数组)；没有点时索引为 -1、距离为 inf
+        # 先检查每个查询点所在格子周围 ring 圈内的点: 最近距离不超过 ring * cell_size 时必为最近点，
+        # 否则只对这些查询点扩大 ring 重查
+        # distance(查询点序号数组, 点索引数组) 给出逐对距离的平方时，点代表其他几何体 (如折线上的采样点代表所在线段)；
+        # 每个几何体上都有与其最近处相距不超过 slack 的点时，结果仍是精确的最近距离
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 2)
+        self.ensure_built()
+        if self.moved_count:
+            self.build()  # 批量查询前整体重建，不单独处理移动过的点
+        if self.sorted_points is None:
+            # 候选点在排序数组中是连续的几段，按顺序存放坐标使读取连续
+            self.sorted_points = self.points[self.order]
+        nearest = np.full(len(queries), -1, dtype=np.int64)
+        distances = np.full(len(queries), np.inf)
+        if not len(self.points):
+            return nearest, distances
+
+        for start in range(0, len(queries), chunk_size):
+            pending = np.arange(start, min(start + chunk_size, len(queries)))
+            ring = 1
+            while len(pending):
+                cells = self.cells_of(queries[pending])
+                pending_distance = None if distance is None else partial(self.owner_distance, distance, pending)
+                indices, found = self.nearest_in_ring(queries[pending], cells, ring, pending_distance)
+                better = found < distances[pending]
+                nearest[pending[better]] = indices[better]
+                distances[pending[better]] = found[better]
+                covers_all = ((cells[:, 0] - ring <= 0) & (cells[:, 0] + ring >= self.columns - 1)
+                              & (cells[:, 1] - ring <= 0) & (cells[:, 1] + ring >= self.rows - 1))
+                done = (distances[pending] + slack <= ring * self.cell_size) | covers_all
+                pending = pending[~done]
+                ring *= 2
+        return nearest, distances
+
+    @staticmethod
+    def owner_distance(distance, pending, owners, indices):
+        return distance(pending[owners], indices)
+
+    def nearest_in_ring(self, queries, cells, ring, distance=None, max_candidates=1 << 22):
+        # 每个查询点在 (2 * ring + 1)^2 个格子内的最近点，没有候选点时距离为 inf
+        offsets = np.arange(-ring, ring + 1, dtype=np.int64)
+        rows = cells[:, 1, None] + offsets
+        col_min = np.clip(cells[:, 0] - ring, 0, self.columns - 1)[:, None]
+        col_max = np.clip(cells[:, 0] + ring, 0, self.columns - 1)[:, None]
+        valid = ((rows >= 0) & (rows < self.rows)
+                 & (cells[:, 0, None] + ring >= 0) & (cells[:, 0, None] - ring < self.columns))
+        starts = np.searchsorted(self.sorted_keys, rows * self.columns + col_min, side='left')
+        ends = np.searchsorted(self.sorted_keys, rows * self.columns + col_max, side='right')
+        lengths = np.where(valid, ends - starts, 0)
+
+        indices = np.full(len(queries), -1, dtype=np.int64)
+        distances = np.full(len(queries), np.inf)
+        # 按候选点总数分批，远离所有点的查询 ring 很大时候选点可能很多
+        counts = lengths.sum(axis=1)
+        batch_ids = np.cumsum(counts) // max_candidates
+        for batch in np.unique(batch_ids):
+            members = np.flatnonzero(batch_ids == batch)
+            batch_lengths = lengths[members].ravel()
+            total = int(batch_lengths.sum())
+            if not total:
+                continue
+            # 把所有 [start, end) 区间拼接成一个位置数组，并记下每个候选点属于哪个查询点
+            batch_starts = starts[members].ravel()
+            positions = np.arange(total) + np.repeat(
+                batch_starts - np.concatenate(([0], np.cumsum(batch_lengths)[:-1])), batch_lengths)
+            owners = np.repeat(members, counts[members])
+            if distance is None:
+                candidate_points = self.sorted_points[positions]
+                dx = candidate_points[:, 0] - queries[owners, 0]
+                dy = candidate_points[:, 1] - queries[owners, 1]
+                candidate_distances = dx * dx + dy * dy  # 先比较距离的平方
+            else:
+                candidate_distances = distance(owners, self.order[positions])  # 同样是距离的平方
+
+            # 候选点按查询点连续排列，每段取距离最小的一个
+            group_starts = np.flatnonzero(np.concatenate(([True], owners[1:] != owners[:-1])))
+            group_owners = owners[group_starts]
+            minimums = np.minimum.reduceat(candidate_distances, group_starts)
+            is_minimum = candidate_distances == np.repeat(minimums, np.diff(np.append(group_starts, total)))
+            minimum_positions = np.flatnonzero(is_minimum)
+            first = minimum_positions[np.searchsorted(minimum_positions, group_starts)]
+            indices[group_owners] = self.order[positions[first]]
+            distances[group_owners] = np.sqrt(minimums)
+        return indices, distances
@@ -0,0 +1,103 @@
+import numpy as np
+
+from commands import COMMAND_OVERHEAD, CommandGroup, CommandStack, DeleteCommand, MoveCommand
+
+
+class Target:
+    def __init__(self, count=10):
+        self.points = {'a': np.zeros((count, 2))}
+        self.alive = {'a': np.ones(count, dtype=bool)}
+
+    def move_poses(self, file_name, indices, delta):
+        self.points[file_name][indices] += delta
+
+    def set_poses_alive(self, file_name, indices, alive):
+        self.alive[file_name][indices] = alive
+
+
+def move(index, size=1):
+    # size 个索引，用于控制命令占用的字节数
+    return MoveCommand('a', np.full(size, index), (1.0, 0.0))
+
+
+def test_undo_redo_round_trip():
+    target, stack = Target(), CommandStack()
+    command = move(3)
+    command.redo(target)
+    stack.push(command)
+    stack.undo(target)
+    assert target.points['a'][3].tolist() == [0.0, 0.0]
+    stack.redo(target)
+    assert target.points['a'][3].tolist() == [1.0, 0.0]
+
+
+def test_group_is_one_step():
+    stack = CommandStack()
+    with stack.group("两步"):
+        stack.push(move(1))
+        stack.push(DeleteCommand('a', [2]))
+    assert len(stack.undo_commands) == 1
+    assert isinstance(stack.undo_commands[0], CommandGroup)
+
+
+def test_depth_limit_drops_oldest():
+    stack = CommandStack(max_depth=3)
+    commands = [move(index) for index in range(5)]
+    for command in commands:
+        stack.push(command)
+    assert list(stack.undo_commands) == commands[2:]
+    assert stack.total_bytes == sum(command.nbytes() for command in commands[2:])
+
+
+def test_byte_limit_counts_redo_and_evicts_it_first():
+    target = Target()
+    size = move(0, 1000).nbytes()
+    stack = CommandStack(max_bytes=4 * size)
+    for index in range(4):
+        command = move(index % 10, 1000)
+        command.redo(target)
+        stack.push(command)
+    stack.undo(target)
+    stack.undo(target)
+    assert stack.undo_bytes == 2 * size and stack.redo_bytes == 2 * size
+
+    # 上限降低: 重做记录先被丢弃，撤销历史保留
+    stack.set_limits(max_bytes=2 * size)
+    assert len(stack.undo_commands) == 2 and not stack.redo_commands
+    assert stack.total_bytes <= stack.max_bytes
+
+
+def test_byte_limit_holds_after_push():
+    stack = CommandStack(max_bytes=10 * (COMMAND_OVERHEAD + 4 * 100 + 16))
+    for index in range(50):
+        stack.push(move(index % 10, 100))
+        assert stack.total_bytes <= stack.max_bytes
+    assert stack.total_bytes == sum(command.nbytes() for command in stack.undo_commands)
+
+
+def test_push_clears_redo():
+    target, stack = Target(), CommandStack()
+    for index in range(3):
+        stack.push(move(index))
+    stack.undo(target)
+    stack.push(move(5))
+    assert not stack.can_redo() and stack.redo_bytes == 0
+
+
+def test_discard_file_recounts_bytes():
+    stack = CommandStack()
+    stack.push(move(1))
+    stack.push(MoveCommand('b', [0], (1.0, 1.0)))
+    stack.discard_file('b')
+    assert len(stack.undo_commands) == 1
+    assert stack.total_bytes == stack.undo_commands[0].nbytes()
+
+
+def test_listener_sees_execute_undo_redo():
+    target, stack = Target(), CommandStack()
+    events = []
+    stack.listener = lambda command, undo: events.append(undo)
+    stack.push(move(1))
+    stack.undo(target)
+    stack.redo(target)
+    assert events == [False, True, False]
@@ -0,0 +1,49 @@
+import numpy as np
+
+from comparison import (DEVIATION_BINS, build_reference_index, deviation_bins, out_of_tolerance_segments,
+                        path_deviations)
+from simplification import segment_distances
+
+
+def brute_deviations(reference, candidate):
+    starts, ends = reference[:-1], reference[1:]
+    return np.array([segment_distances(np.repeat(point[None], len(starts), axis=0), starts, ends).min()
+                     for point in candidate])
+
+
+def test_sparse_path_uses_nearest_segment_not_nearest_vertex():
+    reference = [(0.0, 0.0), (50.0, 0.0), (100.0, 0.0), (40.0, 1.2)]
+    assert np.allclose(path_deviations(reference, [(40.0, 0.2)]), [0.2])
+
+
+def test_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for trial in range(10):
+        count = int(rng.integers(2, 50))
+        if trial % 2:
+            reference = rng.uniform(0.0, 100.0, (count, 2))  # 稀疏、线段长短悬殊
+        else:
+            reference = np.cumsum(rng.normal(0.0, 1.0, (count, 2)), axis=0)
+        candidate = rng.uniform(-20.0, 120.0, (200, 2))
+        assert np.allclose(path_deviations(reference, candidate), brute_deviations(reference, candidate))
+
+
+def test_reused_index_and_degenerate_references():
+    reference = np.array([[0.0, 0.0], [10.0, 0.0]])
+    index = build_reference_index(reference)
+    assert np.allclose(path_deviations(reference, [(5.0, 3.0), (-4.0, 3.0)], index), [3.0, 5.0])
+    assert np.allclose(path_deviations([(1.0, 1.0)], [(4.0, 5.0)]), [5.0])
+    assert np.allclose(path_deviations([(1.0, 1.0), (1.0, 1.0)], [(4.0, 5.0)]), [5.0])
+    assert np.isinf(path_deviations(np.zeros((0, 2)), [(0.0, 0.0)])).all()
+
+
+def test_out_of_tolerance_segments():
+    distances = np.array([0.0, 0.5, 0.6, 0.1, 0.7])
+    assert out_of_tolerance_segments(distances, 0.4) == [(1, 2, 0.6), (4, 4, 0.7)]
+
+
+def test_deviation_bins_split_at_tolerance():
+    bins = deviation_bins(np.array([0.0, 0.99, 1.01, 5.0, np.nan]), 1.0)
+    half = DEVIATION_BINS // 2
+    assert bins[0] == 0 and bins[1] < half and bins[2] >= half
+    assert bins[3] == DEVIATION_BINS - 1 and bins[4] == 0
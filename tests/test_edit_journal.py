@@ -0,0 +1,154 @@
+import os
+
+import numpy as np
+import pytest
+
+import edit_journal
+from commands import CommandGroup, DeleteCommand, MoveCommand, ReplaceCommand, TransformCommand
+from edit_journal import EditJournal, JOURNAL_FILE, replay_session, stale_sessions, summarize_session
+from pose_table import PoseTable
+from trajectory import Trajectory, rotation_about
+
+
+@pytest.fixture(autouse=True)
+def journal_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(edit_journal, 'JOURNAL_DIR', str(tmp_path / 'journal'))
+
+
+class Editor:
+    # 与编辑器相同的调用顺序: 先修改内存中的轨迹，再记录命令
+    def __init__(self, path, count=5):
+        Trajectory(table=PoseTable(count), points=np.column_stack((np.arange(count), np.zeros(count)))).save(path)
+        self.path = path
+        self.trajectory = Trajectory.load(path)
+        self.alive = np.ones(count, dtype=bool)
+        self.journal = EditJournal.create()
+        self.journal.open_file('a', path, self.trajectory, self.alive)
+
+    def move(self, indices, delta):
+        self.trajectory.points[indices] += delta
+        self.journal.record(MoveCommand('a', indices, delta))
+
+    def delete(self, indices, undo=False):
+        self.alive[indices] = undo
+        self.journal.record(DeleteCommand('a', indices), undo)
+
+    def save(self):
+        token = self.journal.begin_save(self.trajectory, self.alive)
+        self.trajectory.take(self.alive).save(self.path)
+        return token
+
+    def crash(self):
+        # 不删除会话，只释放锁 (进程退出)
+        self.journal.sync()
+        self.journal.file.close()
+        self.journal.lock.close()
+        return self.journal.session_dir
+
+
+def replay_single(session_dir):
+    recovered, failed = replay_session(session_dir)
+    assert not failed
+    assert len(recovered) == 1
+    _, file_name, _, trajectory, alive, _ = recovered[0]
+    assert file_name == 'a'  # 恢复时沿用打开文件时的名称
+    return trajectory, alive
+
+
+def test_replay_moves_deletes_and_transforms(tmp_path):
+    editor = Editor(str(tmp_path / 'a.poses'))
+    editor.move([1, 2], (10.0, 0.0))
+    editor.delete([4])
+    matrix, offset = rotation_about(0.5, 1.0, 1.0)
+    editor.trajectory.transform(matrix, offset, [0, 1])
+    editor.journal.record(TransformCommand('a', [0, 1], matrix, offset))
+    editor.move([2], (0.0, 3.0))
+    editor.trajectory.points[[2]] -= (0.0, 3.0)
+    editor.journal.record(MoveCommand('a', [2], (0.0, 3.0)), undo=True)
+    trajectory, alive = replay_single(editor.crash())
+    assert np.allclose(trajectory.points, editor.trajectory.points)
+    assert alive.tolist() == editor.alive.tolist()
+
+
+def test_edit_during_save_is_replayed(tmp_path):
+    editor = Editor(str(tmp_path / 'a.poses'))
+    editor.move([1], (10.0, 0.0))
+    token = editor.save()
+    editor.move([2], (-1.0, 0.0))  # 保存进行中的编辑
+    editor.journal.finish_save('a', editor.path, token)
+    trajectory, _ = replay_single(editor.crash())
+    assert trajectory.points[:, 0].tolist() == [0.0, 11.0, 1.0, 3.0, 4.0]
+
+
+def test_save_with_deleted_poses_keeps_indices(tmp_path):
+    editor = Editor(str(tmp_path / 'a.poses'))
+    editor.delete([1, 3])
+    editor.journal.finish_save('a', editor.path, editor.save())
+    editor.delete([3], undo=True)
+    editor.move([4], (0.0, 2.0))
+    trajectory, alive = replay_single(editor.crash())
+    assert alive.tolist() == [True, False, True, True, True]
+    assert np.array_equal(trajectory.points, editor.trajectory.points)
+
+
+def test_replace_and_group(tmp_path):
+    editor = Editor(str(tmp_path / 'a.poses'))
+    old, old_alive = editor.trajectory, editor.alive.copy()
+    new = old.take([0, 2, 4]).copy()
+    new_alive = np.array([True, False, True])
+    editor.journal.record(CommandGroup([ReplaceCommand('a', old, old_alive, new, new_alive),
+                                        MoveCommand('a', [0], (5.0, 5.0))]))
+    new.points[0] += (5.0, 5.0)
+    trajectory, alive = replay_single(editor.crash())
+    assert np.array_equal(trajectory.points, new.points)
+    assert alive.tolist() == new_alive.tolist()
+
+
+def test_nothing_to_recover_after_save_and_compaction(tmp_path):
+    editor = Editor(str(tmp_path / 'a.poses'))
+    editor.move([0], (1.0, 1.0))
+    editor.journal.finish_save('a', editor.path, editor.save())
+    editor.journal.compact([('a', editor.path, editor.trajectory, editor.alive)])
+    assert summarize_session(editor.journal.session_dir) == []
+    editor.move([3], (0.0, 1.0))
+    trajectory, _ = replay_single(editor.crash())
+    assert np.array_equal(trajectory.points, editor.trajectory.points)
+
+
+def test_torn_tail_record_is_ignored_and_truncated_on_adopt(tmp_path):
+    editor = Editor(str(tmp_path / 'a.poses'))
+    editor.move([1], (1.0, 0.0))
+    editor.move([2], (1.0, 0.0))
+    session_dir = editor.crash()
+    journal_path = os.path.join(session_dir, JOURNAL_FILE)
+    os.truncate(journal_path, os.path.getsize(journal_path) - 3)  # 最后一条记录只写了一部分
+    trajectory, _ = replay_single(session_dir)
+    assert trajectory.points[:, 0].tolist() == [0.0, 2.0, 2.0, 3.0, 4.0]
+
+    journal = EditJournal.adopt(session_dir, {'a': 1})
+    journal.record(MoveCommand('a', [4], (1.0, 0.0)))
+    journal.sync()
+    journal.file.close()
+    journal.lock.close()
+    trajectory, _ = replay_single(session_dir)
+    assert trajectory.points[:, 0].tolist() == [0.0, 2.0, 2.0, 3.0, 5.0]
+
+
+def test_changed_file_is_reported(tmp_path):
+    editor = Editor(str(tmp_path / 'a.poses'))
+    editor.move([1], (1.0, 0.0))
+    session_dir = editor.crash()
+    Trajectory(table=PoseTable(1), points=np.zeros((1, 2))).save(editor.path)
+    recovered, failed = replay_session(session_dir)
+    assert not recovered and failed[0][0] == os.path.abspath(editor.path)
+
+
+def test_closed_files_and_live_sessions_are_not_offered(tmp_path):
+    editor = Editor(str(tmp_path / 'a.poses'))
+    editor.move([1], (1.0, 0.0))
+    if edit_journal.fcntl is not None:
+        assert stale_sessions() == []  # 本会话仍持有锁
+    editor.journal.close_file('a')
+    session_dir = editor.crash()
+    assert stale_sessions() == [session_dir]
+    assert summarize_session(session_dir) == []
@@ -0,0 +1,56 @@
+import numpy as np
+
+from simplification import decimate_by_arc_length, douglas_peucker, remove_duplicates, resample
+
+
+def greedy_remove_duplicates(points, tolerance):
+    kept = [0]
+    for index in range(1, len(points)):
+        if np.hypot(*(points[index] - points[kept[-1]])) > tolerance:
+            kept.append(index)
+    if kept[-1] != len(points) - 1:
+        kept.append(len(points) - 1)
+    return kept
+
+
+def test_remove_duplicates_measures_from_last_kept_pose():
+    points = np.array([[0.0, 0.0], [1.999, 0.0], [2.001, 0.0], [3.0, 0.0]])
+    assert remove_duplicates(points, 1.0).tolist() == [0, 1, 3]
+
+
+def test_remove_duplicates_matches_greedy_pass():
+    rng = np.random.default_rng(0)
+    steps = rng.normal(0.0, 0.05, (5000, 2))
+    steps[1000:1500] = 0.0  # 长时间静止，超出向量化查找的窗口
+    points = np.cumsum(steps, axis=0)
+    for tolerance in (0.01, 0.1, 0.5):
+        assert remove_duplicates(points, tolerance).tolist() == greedy_remove_duplicates(points, tolerance)
+
+
+def test_remove_duplicates_zero_tolerance_keeps_distinct_points():
+    points = np.array([[0.0, 0.0], [0.0, 0.0], [1.0, 0.0], [1.0, 0.0], [0.0, 0.0], [2.0, 0.0]])
+    assert remove_duplicates(points, 0.0).tolist() == [0, 2, 4, 5]
+
+
+def test_remove_duplicates_all_within_tolerance_keeps_endpoints():
+    points = np.zeros((100, 2))
+    assert remove_duplicates(points, 1.0).tolist() == [0, 99]
+
+
+def test_decimate_by_arc_length_keeps_endpoints():
+    points = np.column_stack((np.linspace(0.0, 10.0, 101), np.zeros(101)))
+    kept = decimate_by_arc_length(points, 1.0)
+    assert kept[0] == 0 and kept[-1] == 100
+    assert len(kept) == 11
+
+
+def test_douglas_peucker_keeps_corner():
+    points = np.array([[0.0, 0.0], [1.0, 0.01], [2.0, 0.0], [2.0, 1.0], [2.0, 2.0]])
+    assert douglas_peucker(points, 0.1).tolist() == [0, 2, 4]
+
+
+def test_resample_spacing_and_sources():
+    points = np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0]])
+    resampled, sources = resample(points, 0.5)
+    assert np.allclose(resampled, [[0, 0], [0.5, 0], [1, 0], [1, 0.5], [1, 1]])
+    assert sources.tolist() == [0, 0, 1, 1, 2]
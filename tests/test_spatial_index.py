@@ -0,0 +1,87 @@
+import numpy as np
+
+from spatial_index import GridIndex
+
+
+def random_points(count=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.normal(0.0, 0.5, (count, 2)), axis=0)
+
+
+def brute_rect(points, x_min, y_min, x_max, y_max):
+    xs, ys = points[:, 0], points[:, 1]
+    return np.flatnonzero((xs >= x_min) & (xs <= x_max) & (ys >= y_min) & (ys <= y_max))
+
+
+def test_query_rect_matches_brute_force():
+    points = random_points()
+    index = GridIndex(points)
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        (x_min, y_min), (x_max, y_max) = np.sort(rng.uniform(points.min(), points.max(), (2, 2)), axis=0)
+        assert index.query_rect(x_min, y_min, x_max, y_max).tolist() == \
+            brute_rect(points, x_min, y_min, x_max, y_max).tolist()
+
+
+def test_query_rect_sees_moved_points_and_mask():
+    points = random_points()
+    index = GridIndex(points)
+    index.query_rect(0, 0, 1, 1)  # 建立索引
+    points[:10] = 1000.0
+    index.update(np.arange(10))
+    assert index.query_rect(999, 999, 1001, 1001).tolist() == list(range(10))
+    mask = np.ones(len(points), dtype=bool)
+    mask[3] = False
+    assert 3 not in index.query_rect(999, 999, 1001, 1001, mask)
+
+
+def test_rebuild_after_many_moves():
+    points = random_points(5000)
+    index = GridIndex(points)
+    index.query_rect(0, 0, 1, 1)
+    points += 100.0
+    index.update(np.arange(len(points)))
+    assert index.order is None  # 移动过多，下次查询时重建
+    (x_min, y_min), (x_max, y_max) = points.min(axis=0), points.max(axis=0)
+    assert len(index.query_rect(x_min, y_min, x_max, y_max)) == len(points)
+
+
+def test_query_polygon():
+    points = np.array([[0.5, 0.5], [2.0, 0.5], [0.5, 2.0], [1.5, 1.5]])
+    index = GridIndex(points, cell_size=1.0)
+    triangle = [(0.0, 0.0), (3.0, 0.0), (0.0, 3.0)]
+    assert index.query_polygon(triangle).tolist() == [0, 1, 2]
+
+
+def test_nearest_matches_brute_force():
+    points = random_points()
+    index = GridIndex(points)
+    rng = np.random.default_rng(2)
+    for x, y in rng.uniform(points.min() - 10, points.max() + 10, (50, 2)):
+        distances = np.hypot(points[:, 0] - x, points[:, 1] - y)
+        found, distance = index.nearest(x, y)
+        assert np.isclose(distance, distances.min()) and np.isclose(distances[found], distances.min())
+
+
+def test_nearest_respects_max_distance():
+    index = GridIndex(np.array([[0.0, 0.0], [10.0, 0.0]]))
+    assert index.nearest(4.0, 0.0, max_distance=1.0) == (None, None)
+    assert index.nearest(9.5, 0.0, max_distance=1.0) == (1, 0.5)
+
+
+def test_nearest_many_matches_brute_force():
+    points = random_points()
+    index = GridIndex(points)
+    queries = np.random.default_rng(3).uniform(points.min() - 50, points.max() + 50, (500, 2))
+    indices, distances = index.nearest_many(queries, chunk_size=128)
+    expected = np.hypot(*(queries[:, None, :] - points[None, :, :]).transpose(2, 0, 1)).min(axis=1)
+    assert np.allclose(distances, expected)
+    assert np.allclose(np.hypot(*(points[indices] - queries).T), expected)
+
+
+def test_empty_index():
+    index = GridIndex(np.zeros((0, 2)))
+    assert len(index.query_rect(0, 0, 1, 1)) == 0
+    assert index.nearest(0.0, 0.0) == (None, None)
+    indices, distances = index.nearest_many([[0.0, 0.0]])
+    assert indices.tolist() == [-1] and np.isinf(distances).all()
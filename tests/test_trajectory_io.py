@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+from pose_table import PoseTable
+from trajectory import Trajectory
+from trajectory_io import load_pose_binary
+
+
+def sample_trajectory(count=100):
+    poses = [{'position': {'x': float(i), 'y': float(-i), 'z': 0.0},
+              'orientation': {'x': 0.0, 'y': 0.0, 'z': 0.0, 'w': 1.0},
+              'frame': 'map'} for i in range(count)]
+    if count > 3:
+        poses[3]['note'] = 'stop'  # 只有个别位姿才有的字段
+    return Trajectory({'header': {'name': 'test'}}, PoseTable.from_poses(poses))
+
+
+def assert_same(a, b):
+    assert a.document == b.document
+    assert np.array_equal(a.points, b.points)
+    assert a.table.to_poses() == b.table.to_poses()
+
+
+@pytest.mark.parametrize('mapped', [True, False])
+def test_binary_round_trip(tmp_path, mapped):
+    trajectory = sample_trajectory()
+    path = str(tmp_path / 'a.poses')
+    trajectory.save(path)
+    document, table, points = load_pose_binary(path, mapped)
+    assert_same(trajectory, Trajectory(document, table, points))
+
+
+def test_binary_and_yaml_convert_losslessly(tmp_path):
+    trajectory = sample_trajectory()
+    trajectory.save(str(tmp_path / 'a.poses'))
+    Trajectory.load(str(tmp_path / 'a.poses')).save(str(tmp_path / 'b.yaml'))
+    assert_same(trajectory, Trajectory.load(str(tmp_path / 'b.yaml'), use_cache=False))
+
+
+@pytest.mark.parametrize('count', [0, 1])
+def test_binary_empty_and_single_pose(tmp_path, count):
+    trajectory = sample_trajectory(count)
+    path = str(tmp_path / 'a.poses')
+    trajectory.save(path)
+    loaded = Trajectory.load(path)
+    assert len(loaded) == count
+    assert_same(trajectory, loaded)
+
+
+def test_edits_do_not_touch_the_file_and_resave_in_place(tmp_path):
+    path = str(tmp_path / 'a.poses')
+    sample_trajectory().save(path)
+    before = open(path, 'rb').read()
+    loaded = Trajectory.load(path)
+    loaded.translate(1.0, 2.0)
+    assert open(path, 'rb').read() == before  # 写时复制
+    loaded.save(path)  # 覆盖仍在使用的源文件
+    assert np.array_equal(Trajectory.load(path).points, loaded.points)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'a.poses'
+    path.write_bytes(b'not a pose file at all')
+    with pytest.raises(ValueError):
+        Trajectory.load(str(path))
+
+
+@pytest.mark.parametrize('suffix', ['.yaml', '.poses'])
+def test_failed_save_keeps_the_original(tmp_path, monkeypatch, suffix):
+    path = str(tmp_path / ('a' + suffix))
+    sample_trajectory(10).save(path)
+    os.chmod(path, 0o640)
+    sample_trajectory(20).save(path)
+    assert os.stat(path).st_mode & 0o777 == 0o640
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, 'fsync', fail)
+    with pytest.raises(OSError):
+        sample_trajectory(30).save(path)
+    assert len(Trajectory.load(path, use_cache=False)) == 20
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
@@ -0,0 +1,270 @@
+import math
+import time
+import numpy as np
+
+import simplification
+from pose_table import PoseTable
+from trajectory_io import (load_pose_table, stream_pose_table, split_document, save_path_data, write_cache,
+                           is_binary_path, load_pose_binary, save_pose_binary)
+
+POSITION_COLUMNS = ('position.x', 'position.y')
+ORIENTATION_COLUMNS = ('orientation.x', 'orientation.y', 'orientation.z', 'orientation.w')
+
+
+class Trajectory:
+    # 一个轨迹文件的数据模型 (不依赖 Qt)，供编辑器和命令行工具共用
+    # points: (n, 2) float64 数组，保存每个位姿的 x/y；table (PoseTable) 按列保存每个位姿的其余字段
+    # document: 文件中除 poses 以外的字段 (如 header)
+    # 修改记录: modified 标记改动过的位姿，revision 与 saved_revision 不同时表示有未保存的修改
+    # copy=False 时直接使用传入的 points (如二进制文件的内存映射)
+    def __init__(self, document=None, table=None, points=None, copy=True):
+        self.document = dict(document or {})
+        if table is None:
+            table = PoseTable()
+        if points is None:
+            if len(table) and not all(path in table.columns for path in POSITION_COLUMNS):
+                raise ValueError("poses have no numeric position.x/position.y")
+            points = np.column_stack([table.columns.get(path, np.zeros(0)) for path in POSITION_COLUMNS])
+        self.table = table.drop_columns(POSITION_COLUMNS)
+        self.points = (np.array if copy else np.asarray)(points, dtype=np.float64).reshape(-1, 2)
+        if len(self.points) != len(self.table):
+            raise ValueError("points and poses differ in length")
+        self.modified = np.zeros(len(self.points), dtype=bool)
+        self.revision = 0
+        self.saved_revision = 0
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def is_dirty(self):
+        return self.revision != self.saved_revision
+
+    def mark_modified(self, indices=slice(None)):
+        self.modified[indices] = True
+        self.revision += 1
+
+    def mark_saved(self, revision=None):
+        # revision: 保存时的快照版本；保存期间又有修改时仍保持未保存状态
+        if revision is None:
+            revision = self.revision
+        if revision == self.revision:
+            self.modified[:] = False
+        self.saved_revision = revision
+
+    def nbytes(self):
+        # 轨迹数据的大致内存占用
+        return self.points.nbytes + self.modified.nbytes + self.table.nbytes()
+
+    @classmethod
+    def from_document(cls, path_data):
+        return cls(*split_document(path_data))
+
+    def to_document(self):
+        # 当前坐标写入 position.x/y，还原出完整的文件内容
+        overrides = dict(zip(POSITION_COLUMNS, self.points.T))
+        return dict(self.document, poses=self.table.to_poses(overrides))
+
+    @classmethod
+    def load(cls, file_path, use_cache=True):
+        # 二进制文件 (.poses) 直接内存映射，不经过解析缓存
+        if is_binary_path(file_path):
+            return cls(*load_pose_binary(file_path), copy=False)
+        document, table, _ = load_pose_table(file_path, use_cache)
+        return cls(document, table)
+
+    def save(self, file_path):
+        # 按扩展名选择格式，两种格式可无损互相转换
+        if is_binary_path(file_path):
+            save_pose_binary(file_path, self.document, self.table, self.points)
+        else:
+            save_path_data(file_path, self.to_document())
+
+    def copy(self):
+        return Trajectory(self.document, self.table.copy(), self.points.copy())
+
+    def take(self, indices):
+        # 按索引 (或布尔掩码) 取出子轨迹
+        indices = np.arange(len(self))[indices]
+        return Trajectory(self.document, self.table.take(indices), self.points[indices])
+
+    # 几何变换，直接修改本轨迹
+
+    def translate(self, dx, dy):
+        self.points += (dx, dy)
+        self.mark_modified()
+        return self
+
+    def rotate(self, angle, cx=0.0, cy=0.0):
+        # 绕 (cx, cy) 逆时针旋转 angle 弧度，位姿朝向同时绕 z 轴旋转
+        return self.transform(*rotation_about(angle, cx, cy))
+
+    def mirror(self, axis_angle, cx=0.0, cy=0.0):
+        # 以过 (cx, cy)、方向角为 axis_angle 的直线为轴镜像，朝向同样镜像 (偏航角 -> 2 * axis_angle - 偏航角)
+        return self.transform(*mirror_about(axis_angle, cx, cy))
+
+    def transform(self, matrix, offset=(0.0, 0.0), indices=slice(None)):
+        # p' = matrix @ p + offset，只作用于 indices 所选的位姿；matrix 须为旋转或镜像乘以均匀缩放
+        self.transform_orientations(matrix, indices)
+        self.points[indices] = self.points[indices] @ np.asarray(matrix, dtype=np.float64).T + offset
+        self.mark_modified(indices)
+        return self
+
+    def transform_orientations(self, matrix, indices=slice(None)):
+        # 位姿朝向按列整体计算: 旋转 q' = q_z(angle) * q，镜像 q' = n * q * j (n 为镜像面法向，j 翻转机体 y 轴)；
+        # 没有朝向字段的轨迹不处理
+        _, angle, mirrored = decompose_similarity(matrix)
+        columns = self.table.columns
+        if not any(path in columns for path in ORIENTATION_COLUMNS):
+            return
+        defaults = (0.0, 0.0, 0.0, 1.0)
+        for path, default in zip(ORIENTATION_COLUMNS, defaults):
+            column = columns.get(path)
+            columns[path] = np.full(len(self), default) if column is None else column.astype(np.float64)
+        q = tuple(columns[path][indices] for path in ORIENTATION_COLUMNS)
+        if mirrored:
+            axis = angle / 2  # 镜像矩阵 [[cos 2a, sin 2a], [sin 2a, -cos 2a]] 的轴方向角为 a
+            normal = (-math.sin(axis), math.cos(axis), 0.0, 0.0)
+            q = quaternion_multiply(quaternion_multiply(normal, q), (0.0, 1.0, 0.0, 0.0))
+        elif angle:
+            q = quaternion_multiply((0.0, 0.0, math.sin(angle / 2), math.cos(angle / 2)), q)
+        for path, values in zip(ORIENTATION_COLUMNS, q):
+            columns[path][indices] = values
+
+    def scale(self, factor, cx=0.0, cy=0.0):
+        self.points -= (cx, cy)
+        self.points *= factor
+        self.points += (cx, cy)
+        self.mark_modified()
+        return self
+
+    # 删减操作，返回新的轨迹
+
+    def decimate(self, step):
+        # 每 step 个位姿保留一个，并保留终点
+        if step <= 1 or len(self) == 0:
+            return self.copy()
+        indices = np.arange(0, len(self), step)
+        if indices[-1] != len(self) - 1:
+            indices = np.append(indices, len(self) - 1)
+        return self.take(indices)
+
+    def clip(self, x_min, y_min, x_max, y_max):
+        xs, ys = self.points[:, 0], self.points[:, 1]
+        return self.take((xs >= x_min) & (xs <= x_max) & (ys >= y_min) & (ys <= y_max))
+
+    def simplify(self, tolerance):
+        # Douglas-Peucker 简化，tolerance 为允许的最大偏差 (米)
+        return self.take(simplification.douglas_peucker(self.points, tolerance))
+
+    def remove_duplicates(self, tolerance=0.0):
+        # 去除与前一个保留位姿相距不超过 tolerance 的位姿 (0 表示只去除完全重合的)
+        return self.take(simplification.remove_duplicates(self.points, tolerance))
+
+    def resample(self, spacing):
+        # 按固定间距重采样，新位姿的其余字段取自其所在线段的起点位姿
+        points, sources = simplification.resample(self.points, spacing)
+        return Trajectory(self.document, self.table.take(sources), points)
+
+    def split(self, max_poses):
+        return [self.take(slice(start, start + max_poses)) for start in range(0, len(self), max_poses)]
+
+    @classmethod
+    def merge(cls, trajectories):
+        # 依次拼接，文档字段取第一个轨迹的
+        trajectories = list(trajectories)
+        if not trajectories:
+            return cls()
+        table = PoseTable.concatenate(trajectory.table for trajectory in trajectories)
+        points = np.concatenate([trajectory.points for trajectory in trajectories])
+        return cls(trajectories[0].document, table, points)
+
+
+def quaternion_multiply(a, b):
+    # (x, y, z, w) 四元数乘积，各分量可以是数组
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (aw * bx + ax * bw + ay * bz - az * by,
+            aw * by - ax * bz + ay * bw + az * bx,
+            aw * bz + ax * by - ay * bx + az * bw,
+            aw * bw - ax * bx - ay * by - az * bz)
+
+
+def decompose_similarity(matrix, tolerance=1e-9):
+    # 2x2 矩阵 = 均匀缩放 * (旋转或镜像)，返回 (缩放, 角度, 是否镜像)，镜像时角度为轴方向角的两倍；
+    # 错切、非均匀缩放等其他线性变换无法作用于朝向，不支持
+    (a, b), (c, d) = np.asarray(matrix, dtype=np.float64)
+    scale = math.hypot(a, c)
+    mirrored = a * d - b * c < 0
+    if mirrored:
+        similar = abs(a + d) <= tolerance * scale and abs(b - c) <= tolerance * scale
+    else:
+        similar = abs(a - d) <= tolerance * scale and abs(b + c) <= tolerance * scale
+    if scale == 0 or not similar:
+        raise ValueError("only rotations, mirrors and uniform scaling are supported")
+    return scale, math.atan2(c, a), mirrored
+
+
+def rotation_about(angle, cx=0.0, cy=0.0, factor=1.0):
+    # 绕 (cx, cy) 旋转 angle 弧度并缩放 factor 倍的 (matrix, offset)
+    cos_a, sin_a = math.cos(angle) * factor, math.sin(angle) * factor
+    matrix = np.array([[cos_a, -sin_a], [sin_a, cos_a]])
+    return matrix, np.array([cx, cy]) - matrix @ (cx, cy)
+
+
+def mirror_about(axis_angle, cx=0.0, cy=0.0):
+    cos_2a, sin_2a = math.cos(2 * axis_angle), math.sin(2 * axis_angle)
+    matrix = np.array([[cos_2a, sin_2a], [sin_2a, -cos_2a]])
+    return matrix, np.array([cx, cy]) - matrix @ (cx, cy)
+
+
+def load_trajectory_timed(file_path, use_cache=True):
+    # 供后台进程调用: 返回 (Trajectory, 是否命中缓存, 耗时秒)
+    # 二进制文件无需解析，视同命中缓存
+    start_time = time.perf_counter()
+    if is_binary_path(file_path):
+        return Trajectory.load(file_path), True, time.perf_counter() - start_time
+    document, table, cache_hit = load_pose_table(file_path, use_cache)
+    trajectory = Trajectory(document, table)
+    return trajectory, cache_hit, time.perf_counter() - start_time
+
+
+def save_trajectory_timed(trajectory, file_path):
+    # 供后台进程调用: 返回耗时秒
+    start_time = time.perf_counter()
+    trajectory.save(file_path)
+    return time.perf_counter() - start_time
+
+
+stream_queue = None  # 工作进程中由 set_stream_queue 设置
+
+
+def set_stream_queue(queue):
+    # 进程池的 initializer: multiprocessing.Queue 只能在创建进程时传入，不能作为任务参数
+    global stream_queue
+    stream_queue = queue
+
+
+def stream_trajectory_timed(file_path, key, use_cache=True, chunk_size=20000):
+    # 供后台进程调用: 每解析出一块位姿就把 (key, 该块的 Trajectory) 放入 stream_queue，界面可以边加载边显示；
+    # 块只经过队列序列化一次，发送后不再保留
+    # 返回 (document, 块数, 源文件的 stat, 是否命中缓存, 耗时秒)；
+    # 完整轨迹由接收方用 Trajectory.merge 拼接，未命中缓存时再用 write_trajectory_cache 写入解析缓存
+    start_time = time.perf_counter()
+    chunk_count = 0
+
+    def send_chunk(table):
+        nonlocal chunk_count
+        stream_queue.put((key, Trajectory(None, table)))
+        chunk_count += 1
+
+    document, stat, cache_hit = stream_pose_table(file_path, send_chunk, use_cache, chunk_size)
+    return document, chunk_count, stat, cache_hit, time.perf_counter() - start_time
+
+
+def write_trajectory_cache(file_path, stat, trajectory):
+    # stat 为解析开始时源文件的 stat，文件在解析期间被修改时缓存不会被使用
+    columns = dict(trajectory.table.columns)
+    columns.update(zip(POSITION_COLUMNS, trajectory.points.T))
+    table = PoseTable(len(trajectory), columns, trajectory.table.constants, trajectory.table.extras)
+    write_cache(file_path, stat, trajectory.document, table)
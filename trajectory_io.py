@@ -0,0 +1,300 @@
+import os
+import mmap
+import shutil
+import struct
+import hashlib
+import tempfile
+import zipfile
+import numpy as np
+import yaml
+
+from pose_table import PoseTable
+
+# 优先使用 libyaml 的 C 实现，不可用时回退到纯 Python 实现
+YamlLoader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+YamlDumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
+# 解析结果的二进制缓存 (.npz)，按文件路径存放，并用文件大小和修改时间校验
+CACHE_VERSION = 2
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'mapeditor', 'poses'
+)
+POSE_COLUMN_PREFIX = 'pose:'
+
+# 二进制位姿格式 (.poses): 固定文件头 + YAML 元数据 + 按 64 字节对齐的连续小端数组。
+# 打开时整个文件以写时复制方式内存映射，数组直接引用映射的内存，不需要解析；
+# 编辑只复制被修改的页，文件本身只在保存时整体替换。
+# Windows 不能替换 (或删除) 仍被映射的文件，映射会一直保持到轨迹被释放，原地保存就会失败，
+# 因此 Windows 上改为把整个文件读入内存 (同样不需要解析，只是没有按需分页)。
+BINARY_SUFFIX = '.poses'
+BINARY_MAGIC = b'MEPOSES\0'
+BINARY_VERSION = 1
+BINARY_ALIGNMENT = 64
+BINARY_HEADER = struct.Struct('<8sIIQ')  # 魔数, 版本, 保留, 元数据字节数
+BINARY_POINTS = 'points'  # (n, 2) 的 position.x/y，其余列以 POSE_COLUMN_PREFIX + 字段路径命名
+TRAJECTORY_SUFFIXES = ('.yaml', BINARY_SUFFIX)
+MAP_BINARY_FILES = os.name != 'nt'
+
+
+def cache_path_for(file_path):
+    digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, digest + '.npz')
+
+
+def read_cache(file_path, stat):
+    # 返回 (document, PoseTable)，缓存无效时返回 None
+    try:
+        with np.load(cache_path_for(file_path), allow_pickle=False) as cache:
+            if (int(cache['version']) != CACHE_VERSION
+                    or int(cache['source_size']) != stat.st_size
+                    or int(cache['source_mtime']) != stat.st_mtime_ns):
+                return None
+            metadata = yaml.load(str(cache['metadata']), Loader=YamlLoader)
+            columns = {key[len(POSE_COLUMN_PREFIX):]: cache[key]
+                       for key in cache.files if key.startswith(POSE_COLUMN_PREFIX)}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile, yaml.YAMLError):
+        return None
+    table = PoseTable(metadata['length'], columns, metadata['constants'], metadata['extras'])
+    return metadata['document'], table
+
+
+def write_cache(file_path, stat, document, table):
+    # 列直接存为数组，文档字段和不规则字段以 YAML 文本存放
+    metadata = {
+        'document': document,
+        'length': len(table),
+        'constants': table.constants,
+        'extras': table.extras,
+    }
+    arrays = {
+        'version': np.array(CACHE_VERSION),
+        'source_size': np.array(stat.st_size),
+        'source_mtime': np.array(stat.st_mtime_ns),
+        'metadata': np.array(yaml.dump(metadata, Dumper=YamlDumper)),
+    }
+    for path, column in table.columns.items():
+        arrays[POSE_COLUMN_PREFIX + path] = column
+
+    cache_path = cache_path_for(file_path)
+    temp_path = cache_path + '.tmp'
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(temp_path, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass  # 缓存写入失败不影响加载
+
+
+def split_document(path_data):
+    # 文件内容 -> (除 poses 以外的字段, PoseTable)
+    if not isinstance(path_data, dict) or not isinstance(path_data.get('poses'), list):
+        raise ValueError("document has no poses list")
+    document = {key: value for key, value in path_data.items() if key != 'poses'}
+    return document, PoseTable.from_poses(path_data['poses'])
+
+
+def load_pose_table(file_path, use_cache=True):
+    # 返回 (document, PoseTable, 是否命中缓存)
+    stat = os.stat(file_path)
+    if use_cache:
+        cached = read_cache(file_path, stat)
+        if cached is not None:
+            return cached + (True,)
+
+    with open(file_path, 'r') as file:
+        document, table = split_document(yaml.load(file, Loader=YamlLoader))
+
+    if use_cache:
+        write_cache(file_path, stat, document, table)
+    return document, table, False
+
+
+def compose_event_node(loader, anchors):
+    # 从事件流中读出一个完整的节点 (与 yaml.composer.Composer 相同的规则，C 解析器也可用)
+    event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        return anchors[event.anchor]
+    tag = event.tag
+    if isinstance(event, yaml.ScalarEvent):
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+    elif isinstance(event, yaml.SequenceStartEvent):
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(compose_event_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    elif isinstance(event, yaml.MappingStartEvent):
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = compose_event_node(loader, anchors)
+            node.value.append((key, compose_event_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        raise ValueError(f"unexpected YAML event: {event}")
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def stream_path_data(file, chunk_size):
+    # 按 YAML 事件流逐个构造位姿，不需要一次性构造整个文档:
+    # 每 chunk_size 个位姿产出一次 ('poses', [位姿字典])，最后产出 ('document', 除 poses 以外的字段)
+    loader = YamlLoader(file)
+    try:
+        loader.get_event()  # StreamStart
+        if not loader.check_event(yaml.DocumentStartEvent):
+            raise ValueError("document has no poses list")
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise ValueError("document has no poses list")
+        loader.get_event()
+
+        anchors = {}
+        document = {}
+        found_poses = False
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = loader.construct_document(compose_event_node(loader, anchors))
+            if key == 'poses' and loader.check_event(yaml.SequenceStartEvent):
+                found_poses = True
+                loader.get_event()
+                chunk = []
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    chunk.append(loader.construct_document(compose_event_node(loader, anchors)))
+                    if len(chunk) >= chunk_size:
+                        yield 'poses', chunk
+                        chunk = []
+                loader.get_event()
+                if chunk:
+                    yield 'poses', chunk
+            else:
+                document[key] = loader.construct_document(compose_event_node(loader, anchors))
+        if not found_poses:
+            raise ValueError("document has no poses list")
+        yield 'document', document
+    finally:
+        loader.dispose()
+
+
+def stream_pose_table(file_path, on_chunk, use_cache=True, chunk_size=20000):
+    # 流式加载: 每解析出 chunk_size 个位姿就以 PoseTable 调用一次 on_chunk，命中缓存时整个表作为一块。
+    # 不保留已交出的块，同时存在的位姿不超过 chunk_size 个；解析缓存由拿到完整表的接收方写入 (write_cache)。
+    # 返回 (document, 解析开始时源文件的 stat, 是否命中缓存)
+    stat = os.stat(file_path)
+    if use_cache:
+        cached = read_cache(file_path, stat)
+        if cached is not None:
+            on_chunk(cached[1])
+            return cached[0], stat, True
+
+    document = {}
+    with open(file_path, 'r') as file:
+        for kind, value in stream_path_data(file, chunk_size):
+            if kind == 'poses':
+                on_chunk(PoseTable.from_poses(value))
+            else:
+                document = value
+    return document, stat, False
+
+
+def replace_file(file_path, write, mode='w'):
+    # 两种格式共用的保存方式: write(file) 写入同目录下的临时文件，fsync 后保留原文件的权限并原子替换，
+    # 写入中途失败不会损坏原文件，临时文件随即删除
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def save_path_data(file_path, path_data):
+    replace_file(file_path, lambda file: yaml.dump(path_data, file, Dumper=YamlDumper))
+
+
+def is_binary_path(file_path):
+    return file_path.endswith(BINARY_SUFFIX)
+
+
+def aligned(offset):
+    return -(-offset // BINARY_ALIGNMENT) * BINARY_ALIGNMENT
+
+
+def save_pose_binary(file_path, document, table, points):
+    # 元数据中记录每个数组相对于数据区起点的偏移；与 save_path_data 一样经 replace_file 写入
+    arrays = [(BINARY_POINTS, np.ascontiguousarray(points, dtype='<f8').reshape(-1, 2))]
+    for path, column in table.columns.items():
+        arrays.append((POSE_COLUMN_PREFIX + path, np.ascontiguousarray(column, dtype=column.dtype.newbyteorder('<'))))
+    entries = []
+    offset = 0
+    for name, array in arrays:
+        entries.append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset})
+        offset = aligned(offset + array.nbytes)
+    metadata = yaml.dump({
+        'document': document,
+        'length': len(table),
+        'constants': table.constants,
+        'extras': table.extras,
+        'arrays': entries,
+    }, Dumper=YamlDumper).encode('utf-8')
+    data_start = aligned(BINARY_HEADER.size + len(metadata))
+
+    def write(file):
+        file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(metadata)))
+        file.write(metadata)
+        for entry, (_, array) in zip(entries, arrays):
+            file.seek(data_start + entry['offset'])
+            file.write(array.reshape(-1).view(np.uint8))  # 空数组也可以写 (memoryview.cast 不接受)
+        file.truncate(data_start + offset)
+
+    replace_file(file_path, write, 'wb')
+
+
+def load_pose_binary(file_path, mapped=MAP_BINARY_FILES):
+    # 返回 (document, PoseTable, points)，数组都是写时复制内存映射 (mapped=False 时为读入内存的缓冲区) 上的视图
+    with open(file_path, 'rb') as file:
+        header = file.read(BINARY_HEADER.size)
+        if len(header) < BINARY_HEADER.size:
+            raise ValueError("truncated binary pose file")
+        magic, version, _, metadata_size = BINARY_HEADER.unpack(header)
+        if magic != BINARY_MAGIC:
+            raise ValueError("not a binary pose file")
+        if version != BINARY_VERSION:
+            raise ValueError(f"unsupported binary pose file version: {version}")
+        if mapped:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        else:
+            buffer = bytearray(os.fstat(file.fileno()).st_size)
+            file.seek(0)
+            file.readinto(buffer)
+    metadata = yaml.load(bytes(buffer[BINARY_HEADER.size:BINARY_HEADER.size + metadata_size]).decode('utf-8'),
+                         Loader=YamlLoader)
+    data_start = aligned(BINARY_HEADER.size + metadata_size)
+    length = metadata['length']
+
+    arrays = {}
+    for entry in metadata['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        count = int(np.prod(shape))
+        start = data_start + entry['offset']
+        if shape[0] != length or start + count * dtype.itemsize > len(buffer):
+            raise ValueError(f"corrupt binary pose file: array {entry['name']}")
+        arrays[entry['name']] = np.frombuffer(buffer, dtype, count, start).reshape(shape)
+    columns = {name[len(POSE_COLUMN_PREFIX):]: array
+               for name, array in arrays.items() if name.startswith(POSE_COLUMN_PREFIX)}
+    table = PoseTable(length, columns, metadata['constants'], metadata['extras'])
+    return metadata['document'], table, arrays[BINARY_POINTS]